@@ -0,0 +1,251 @@
+"""
+Resource accounting: what a job actually used, what that costs, and
+per-function and per-worker_tag totals in time buckets for /metrics.
+
+Usage is measured where the work runs. In-process (legacy) work is read
+from the calling thread's rusage. The warm pool's process reports its
+own rusage delta with each response. Containers are sampled with
+`docker stats` while they run; one that exits before its first sample
+is marked unmeasured and charged no CPU or memory. Cost is priced from
+the PRICE_* table
+rather than wall-clock time, so a job that sleeps is charged
+for its wall time only through the memory it holds.
+"""
+import os
+import re
+import sys
+import json
+import time
+import threading
+import subprocess
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # non-POSIX platforms
+    resource = None
+
+# Per-resource prices; every job also pays the base price
+PRICES = {
+    'base': float(os.environ.get('PRICE_BASE', 0.01)),
+    'cpu_second': float(os.environ.get('PRICE_CPU_SECOND', 0.05)),
+    'gb_second': float(os.environ.get('PRICE_GB_SECOND', 0.0001)),  # peak RSS held for the job's wall time
+    'io_gb': float(os.environ.get('PRICE_IO_GB', 0.01)),
+}
+
+USAGE_KEY = 'usage:{dimension}:{bucket}'  # "<value>:<metric>" -> total
+DIMENSIONS = ('function', 'worker_tag')
+METRICS = ('jobs', 'failed', 'cost', 'cpu_seconds', 'gb_seconds', 'io_bytes', 'wall_seconds')
+USAGE_BUCKET_SECONDS = int(os.environ.get('USAGE_BUCKET_SECONDS', 3600))
+USAGE_RETENTION = int(os.environ.get('USAGE_RETENTION', 7 * 86400))
+# /metrics sums the buckets of this many most recent seconds
+USAGE_WINDOW = int(os.environ.get('USAGE_WINDOW', 86400))
+
+DOCKER_STATS_INTERVAL = float(os.environ.get('DOCKER_STATS_INTERVAL', 1.0))
+
+BLOCK_SIZE = 512  # ru_inblock and ru_oublock count 512-byte blocks
+# ru_maxrss is in bytes on macOS, kilobytes elsewhere
+RSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+RUSAGE_SCOPE = getattr(resource, 'RUSAGE_THREAD', None) or getattr(resource, 'RUSAGE_SELF', None)
+
+
+class Usage:
+    """
+    CPU seconds, peak RSS, I/O bytes and wall time of a job; unmeasured is
+    set when part of the work ran where it could not be measured
+    """
+
+    FIELDS = ('cpu_user', 'cpu_sys', 'max_rss_mb', 'io_read_bytes', 'io_write_bytes', 'wall')
+
+    def __init__(self, **values):
+        for field in self.FIELDS:
+            setattr(self, field, values.get(field, 0))
+        self.unmeasured = values.get('unmeasured', False)
+
+    def add(self, other):
+        """Fold in usage (a Usage or its dict) measured elsewhere, e.g. in a pool process"""
+        values = other if isinstance(other, dict) else other.as_dict()
+        for field in ('cpu_user', 'cpu_sys', 'io_read_bytes', 'io_write_bytes'):
+            setattr(self, field, getattr(self, field) + values.get(field, 0))
+        self.max_rss_mb = max(self.max_rss_mb, values.get('max_rss_mb', 0))
+        self.unmeasured = self.unmeasured or values.get('unmeasured', False)
+        return self
+
+    def share(self, parts):
+        """This usage split evenly over parts jobs (peak memory is held by each)"""
+        share = Usage(**self.as_dict())
+        for field in ('cpu_user', 'cpu_sys', 'io_read_bytes', 'io_write_bytes', 'wall'):
+            setattr(share, field, getattr(self, field) / parts)
+        return share
+
+    @property
+    def cpu_seconds(self):
+        return self.cpu_user + self.cpu_sys
+
+    @property
+    def gb_seconds(self):
+        return self.max_rss_mb / 1024 * self.wall
+
+    @property
+    def io_bytes(self):
+        return self.io_read_bytes + self.io_write_bytes
+
+    def as_dict(self):
+        values = {field: round(getattr(self, field), 6) for field in self.FIELDS}
+        if self.unmeasured:
+            values['unmeasured'] = True
+        return values
+
+
+def price(usage, prices=PRICES):
+    """Cost of a job's usage under the price table"""
+    return (prices['base']
+            + usage.cpu_seconds * prices['cpu_second']
+            + usage.gb_seconds * prices['gb_second']
+            + usage.io_bytes / 1e9 * prices['io_gb'])
+
+
+def rusage_snapshot(who=RUSAGE_SCOPE):
+    """This thread's (or process's) rusage as a Usage of running totals"""
+    if resource is None:
+        return Usage()
+    r = resource.getrusage(who)
+    return Usage(cpu_user=r.ru_utime, cpu_sys=r.ru_stime, max_rss_mb=r.ru_maxrss * RSS_UNIT / 2 ** 20,
+                 io_read_bytes=r.ru_inblock * BLOCK_SIZE, io_write_bytes=r.ru_oublock * BLOCK_SIZE)
+
+
+def rusage_delta(before, who=RUSAGE_SCOPE):
+    """
+    Usage since the before snapshot. ru_maxrss is the process's high-water
+    mark, so max_rss_mb is how far the work raised it: memory it used below
+    an earlier peak of the worker or pool process is not counted.
+    """
+    after = rusage_snapshot(who)
+    return Usage(cpu_user=after.cpu_user - before.cpu_user, cpu_sys=after.cpu_sys - before.cpu_sys,
+                 max_rss_mb=max(0.0, after.max_rss_mb - before.max_rss_mb), io_read_bytes=after.io_read_bytes - before.io_read_bytes,
+                 io_write_bytes=after.io_write_bytes - before.io_write_bytes)
+
+
+@contextmanager
+def measure():
+    """
+    Yield a Usage that, on exit, holds the calling thread's usage and wall
+    time inside the block, plus whatever the block add()ed from the pool
+    or a container
+    """
+    usage = Usage()
+    before = rusage_snapshot()
+    start = time.time()
+    try:
+        yield usage
+    finally:
+        usage.add(rusage_delta(before))
+        usage.wall = time.time() - start
+
+
+SIZE_UNITS = {'b': 1, 'kb': 1e3, 'mb': 1e6, 'gb': 1e9, 'tb': 1e12,
+              'kib': 2 ** 10, 'mib': 2 ** 20, 'gib': 2 ** 30, 'tib': 2 ** 40}
+SIZE_RE = re.compile(r'([\d.]+)\s*([a-zA-Z]+)')
+
+
+def parse_size(text):
+    """Bytes in a docker stats size such as '12.5MiB' or '1.2kB'"""
+    match = SIZE_RE.match(text.strip())
+    if not match:
+        return 0.0
+    return float(match.group(1)) * SIZE_UNITS.get(match.group(2).lower(), 1)
+
+
+class DockerStatsSampler:
+    """
+    Polls `docker stats` for a running container. CPU seconds are CPU%
+    integrated over the time between samples; peak memory and block I/O
+    are the highest seen. Containers that exit before the first sample
+    report nothing: samples stays 0.
+    """
+
+    def __init__(self, container, interval=DOCKER_STATS_INTERVAL):
+        self.container = container
+        self.interval = interval
+        self.samples = 0
+        self.usage = Usage()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _sample(self):
+        proc = subprocess.run(['docker', 'stats', '--no-stream', '--format', '{{json .}}', self.container],
+                              capture_output=True, text=True, timeout=30)
+        if proc.returncode != 0 or not proc.stdout.strip():
+            return None
+        return json.loads(proc.stdout.splitlines()[0])
+
+    def _run(self):
+        last = time.time()
+        while not self._stop.wait(self.interval):
+            try:
+                stats = self._sample()
+            except (OSError, ValueError, subprocess.TimeoutExpired):
+                stats = None
+            now = time.time()
+            if stats:
+                self.samples += 1
+                self.usage.cpu_user += float(stats['CPUPerc'].rstrip('%') or 0) / 100 * (now - last)
+                memory = parse_size(stats['MemUsage'].split('/')[0]) / 2 ** 20
+                self.usage.max_rss_mb = max(self.usage.max_rss_mb, memory)
+                read, _, written = stats['BlockIO'].partition('/')
+                self.usage.io_read_bytes = max(self.usage.io_read_bytes, parse_size(read))
+                self.usage.io_write_bytes = max(self.usage.io_write_bytes, parse_size(written))
+            last = now
+
+
+def bucket_of(now, bucket_seconds=USAGE_BUCKET_SECONDS):
+    return int(now // bucket_seconds) * bucket_seconds
+
+
+def record_usage(redis_conn, function_name, worker_tag, usage, cost, success=True, now=None, pipeline=None):
+    """Add a job's usage (a Usage or its meta dict) and cost to its function's and worker_tag's current bucket"""
+    if isinstance(usage, dict):
+        usage = Usage(**usage)
+    conn = pipeline if pipeline is not None else redis_conn.pipeline()
+    bucket = bucket_of(now if now is not None else time.time())
+    values = {'jobs': 1, 'failed': 0 if success else 1, 'cost': cost, 'cpu_seconds': usage.cpu_seconds,
+              'gb_seconds': usage.gb_seconds, 'io_bytes': usage.io_bytes, 'wall_seconds': usage.wall}
+    for dimension, value in zip(DIMENSIONS, (function_name, worker_tag)):
+        key = USAGE_KEY.format(dimension=dimension, bucket=bucket)
+        for metric, amount in values.items():
+            conn.hincrbyfloat(key, f"{value}:{metric}", amount)
+        conn.expire(key, USAGE_RETENTION)
+    if pipeline is None:
+        conn.execute()
+
+
+def usage_summary(redis_conn, now=None, window=USAGE_WINDOW, bucket_seconds=USAGE_BUCKET_SECONDS):
+    """Usage and cost totals per function and per worker_tag over the last window seconds, in one round trip"""
+    now = now if now is not None else time.time()
+    buckets = range(bucket_of(now - window + bucket_seconds, bucket_seconds), int(now) + 1, bucket_seconds)
+    with redis_conn.pipeline() as pipe:
+        for dimension in DIMENSIONS:
+            for bucket in buckets:
+                pipe.hgetall(USAGE_KEY.format(dimension=dimension, bucket=bucket))
+        responses = iter(pipe.execute())
+    summary = {'window': window, 'bucket_seconds': bucket_seconds}
+    for dimension in DIMENSIONS:
+        totals = {}
+        for _ in buckets:
+            for field, amount in next(responses).items():
+                value, _, metric = field.decode().rpartition(':')
+                entry = totals.setdefault(value, dict.fromkeys(METRICS, 0.0))
+                entry[metric] = entry.get(metric, 0.0) + float(amount)
+        summary[f"by_{dimension}"] = {
+            value: {metric: int(amount) if metric in ('jobs', 'failed') else round(amount, 6)
+                    for metric, amount in entry.items()}
+            for value, entry in totals.items()}
+    return summary
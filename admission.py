@@ -0,0 +1,275 @@
+"""
+Admission control for submissions: token buckets per function, per
+trigger and per API key, and a cap on each queue's depth.
+
+Every limit a submission touches is checked, and its tokens taken, by one
+Lua script in a single round trip, so a request is either admitted
+against all its limits or refused without consuming any. Refusals carry
+a Retry-After; admitted requests report how close they came to a limit,
+so clients can slow down before they are refused.
+
+Limits are JSON maps of name to [rate per second, burst]; '*' applies to
+names without their own entry:
+
+    FUNCTION_RATE_LIMITS='{"*": [100, 1000], "sample_sleep": [5, 20]}'
+    API_KEY_RATE_LIMITS='{"*": [200, 2000]}'
+    TRIGGER_RATE_LIMITS='{"*": [10, 50]}'   (a trigger may also set its own rate_limit)
+    MAX_QUEUE_DEPTHS='{"*": 100000, "low": 20000}'
+
+The depth cap is checked before the jobs are pushed, so concurrent
+submissions can overshoot it by the size of the requests in flight.
+"""
+import os
+import json
+import math
+import hashlib
+
+API_KEY_HEADER = 'X-API-Key'
+# Requests without an API key share one bucket
+ANONYMOUS = 'anonymous'
+
+BUCKET_KEY = 'ratelimit:{kind}:{name}'      # hash {tokens, ts}
+REJECTED_KEY = 'ratelimit:rejected'         # key of the refusing limit -> refusals
+
+# A full queue frees up at the workers' pace, which the API does not know
+QUEUE_FULL_RETRY_AFTER = float(os.environ.get('QUEUE_FULL_RETRY_AFTER', 1))
+
+# KEYS: bucket hashes, then queue lists, then REJECTED_KEY.
+# ARGV: the number of buckets, (rate, burst, cost) per bucket, then
+# (max depth, jobs) per queue; a max depth of 0 is no cap.
+# Returns {status, index of the refusing limit, seconds to wait, bucket
+# levels..., queue depths...}; status is 1 for admitted, 0 for refused
+# for now and -1 for a request larger than a limit's burst or depth.
+ADMIT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local buckets = tonumber(ARGV[1])
+local queues = #KEYS - buckets - 1
+local levels, depths = {}, {}
+local status, refused, wait = 1, 0, 0
+for i = 1, buckets do
+    local rate, burst, cost = tonumber(ARGV[3 * i - 1]), tonumber(ARGV[3 * i]), tonumber(ARGV[3 * i + 1])
+    local state = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+    local level = burst
+    if state[1] then
+        level = math.min(burst, tonumber(state[1]) + math.max(0, now - tonumber(state[2])) * rate)
+    end
+    levels[i] = level
+    if cost > burst then
+        if status ~= -1 then status, refused = -1, i end
+    elseif level < cost and status ~= -1 and (status == 1 or (cost - level) / rate > wait) then
+        status, refused, wait = 0, i, (cost - level) / rate
+    end
+end
+for j = 1, queues do
+    local offset = 3 * buckets + 2 * j
+    local max_depth, jobs = tonumber(ARGV[offset]), tonumber(ARGV[offset + 1])
+    local depth = redis.call('LLEN', KEYS[buckets + j])
+    depths[j] = depth
+    if max_depth > 0 then
+        if jobs > max_depth then
+            if status ~= -1 then status, refused = -1, buckets + j end
+        elseif depth + jobs > max_depth and status == 1 then
+            status, refused = 0, buckets + j
+        end
+    end
+end
+if status == 1 then
+    for i = 1, buckets do
+        local rate, burst, cost = tonumber(ARGV[3 * i - 1]), tonumber(ARGV[3 * i]), tonumber(ARGV[3 * i + 1])
+        redis.call('HSET', KEYS[i], 'tokens', string.format('%.6f', levels[i] - cost), 'ts', string.format('%.6f', now))
+        redis.call('PEXPIRE', KEYS[i], math.ceil(burst / rate * 1000) + 1000)
+    end
+else
+    redis.call('HINCRBY', KEYS[#KEYS], KEYS[refused], 1)
+end
+local reply = {status, refused, string.format('%.6f', wait)}
+for i = 1, buckets do table.insert(reply, string.format('%.6f', levels[i])) end
+for j = 1, queues do table.insert(reply, depths[j]) end
+return reply
+"""
+
+
+def parse_limits(spec):
+    """A limits JSON map into {name: (rate, burst)}; a bare number is a rate with an equal burst"""
+    limits = {}
+    for name, value in json.loads(spec).items():
+        rate, burst = (value, value) if isinstance(value, (int, float)) else value
+        if rate <= 0 or burst < 1:
+            raise ValueError(f"Invalid rate limit for {name}: {value}")
+        limits[name] = (float(rate), float(burst))
+    return limits
+
+
+def parse_rate_limit(value):
+    """Validate a trigger's rate_limit, [rate per second, burst]; raises ValueError"""
+    if (not isinstance(value, list) or len(value) != 2
+            or not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in value)
+            or value[0] <= 0 or value[1] < 1):
+        raise ValueError('rate_limit must be [rate per second, burst] with a positive rate and a burst of at least 1')
+    return value
+
+
+FUNCTION_RATE_LIMITS = parse_limits(os.environ.get('FUNCTION_RATE_LIMITS', '{}'))
+API_KEY_RATE_LIMITS = parse_limits(os.environ.get('API_KEY_RATE_LIMITS', '{}'))
+TRIGGER_RATE_LIMITS = parse_limits(os.environ.get('TRIGGER_RATE_LIMITS', '{}'))
+MAX_QUEUE_DEPTHS = {name: int(depth) for name, depth in json.loads(os.environ.get('MAX_QUEUE_DEPTHS', '{}')).items()}
+
+
+def api_key_of(headers):
+    """The caller's API key from request headers, ANONYMOUS without one"""
+    return headers.get(API_KEY_HEADER) or ANONYMOUS
+
+
+def key_label(api_key):
+    """An API key as it appears in Redis keys and metrics, without the secret itself"""
+    if api_key == ANONYMOUS:
+        return api_key
+    return hashlib.sha256(api_key.encode()).hexdigest()[:12]
+
+
+def limit_label(key):
+    """'function:<name>' for a bucket key, 'queue:<name>' for a queue key"""
+    if key.startswith('rq:queue:'):
+        return f"queue:{key[len('rq:queue:'):]}"
+    return key[len('ratelimit:'):]
+
+
+class Decision:
+    """
+    The outcome of an admission check. limit names the limit that refused
+    the request ('function:<name>', 'queue:<name>', ...); backpressure is
+    how full the request left its fullest limit, from 0 to 1.
+    """
+
+    def __init__(self, admitted=True, limit=None, retry_after=None, fits=True,
+                 remaining=None, burst=None, depth=None, backpressure=0.0):
+        self.admitted = admitted
+        self.limit = limit
+        self.retry_after = retry_after
+        self.fits = fits
+        self.remaining = remaining
+        self.burst = burst
+        self.depth = depth
+        self.backpressure = backpressure
+
+    def headers(self):
+        """Backpressure headers for the response"""
+        headers = {'X-Backpressure': f"{self.backpressure:.2f}"}
+        if self.burst is not None:
+            headers['X-RateLimit-Limit'] = str(int(self.burst))
+            headers['X-RateLimit-Remaining'] = str(int(self.remaining))
+        if self.depth is not None:
+            headers['X-Queue-Depth'] = str(self.depth)
+        if self.retry_after is not None:
+            # Whole seconds, rounded up so a client retrying on time is admitted
+            headers['Retry-After'] = str(max(1, math.ceil(self.retry_after)))
+        return headers
+
+    def error(self):
+        """(body, status) of the response refusing the request"""
+        kind, _, name = self.limit.partition(':')
+        if not self.fits:
+            what = 'max depth' if kind == 'queue' else 'burst'
+            return {'error': f"request exceeds the {what} of {kind} {name}", 'limit': self.limit}, 413
+        error = f"queue {name} is full" if kind == 'queue' else f"rate limit exceeded for {kind} {name}"
+        return ({'error': error, 'limit': self.limit,
+                 'retry_after': round(self.retry_after, 3)}, 429)
+
+
+class AdmissionControl:
+    """
+    Checks submissions against the configured limits. check() takes the
+    jobs a request would create per function and per queue; requests that
+    touch no configured limit are admitted without a Redis call.
+    """
+
+    def __init__(self, redis_conn, function_limits=None, api_key_limits=None, trigger_limits=None,
+                 max_depths=None):
+        self.redis = redis_conn
+        self.function_limits = FUNCTION_RATE_LIMITS if function_limits is None else function_limits
+        self.api_key_limits = API_KEY_RATE_LIMITS if api_key_limits is None else api_key_limits
+        self.trigger_limits = TRIGGER_RATE_LIMITS if trigger_limits is None else trigger_limits
+        self.max_depths = MAX_QUEUE_DEPTHS if max_depths is None else max_depths
+        self._admit = redis_conn.register_script(ADMIT)
+
+    def _plan(self, functions, queues, api_key=None, trigger=None):
+        """(keys, args, labels, bursts) for the script, or None when no limit applies"""
+        buckets = []
+
+        def add(kind, name, label, limit, cost):
+            if limit is not None:
+                buckets.append((BUCKET_KEY.format(kind=kind, name=label), f"{kind}:{label}", limit, cost))
+
+        for function_name, jobs in functions.items():
+            add('function', function_name, function_name,
+                self.function_limits.get(function_name, self.function_limits.get('*')), jobs)
+        if trigger is not None:
+            own = trigger.get('rate_limit')
+            add('trigger', trigger['id'], trigger['id'],
+                tuple(own) if own else self.trigger_limits.get(trigger['id'], self.trigger_limits.get('*')), 1)
+        if api_key is not None:
+            add('api_key', api_key, key_label(api_key),
+                self.api_key_limits.get(api_key, self.api_key_limits.get('*')), sum(functions.values()))
+        capped = [(queue_name, self.max_depths.get(queue_name, self.max_depths.get('*', 0)), jobs)
+                  for queue_name, jobs in queues.items()]
+        capped = [entry for entry in capped if entry[1] > 0]
+        if not buckets and not capped:
+            return None
+        keys = [key for key, _, _, _ in buckets] + [f"rq:queue:{name}" for name, _, _ in capped] + [REJECTED_KEY]
+        args = [len(buckets)]
+        for _, _, (rate, burst), cost in buckets:
+            args += [rate, burst, cost]
+        for _, max_depth, jobs in capped:
+            args += [max_depth, jobs]
+        labels = [label for _, label, _, _ in buckets] + [f"queue:{name}" for name, _, _ in capped]
+        limits = [(burst, cost) for _, _, (_, burst), cost in buckets] + [(depth, jobs) for _, depth, jobs in capped]
+        return keys, args, labels, limits
+
+    def _decide(self, plan, reply):
+        _, _, labels, limits = plan
+        status, refused, wait = int(reply[0]), int(reply[1]), float(reply[2])
+        buckets = plan[1][0]
+        levels = [float(level) for level in reply[3:3 + buckets]]
+        depths = [int(depth) for depth in reply[3 + buckets:]]
+        if status != 1:
+            label = labels[refused - 1]
+            retry_after = None
+            if status == 0:
+                retry_after = QUEUE_FULL_RETRY_AFTER if label.startswith('queue:') else wait
+            return Decision(False, label, retry_after, fits=status == 0, backpressure=1.0,
+                            depth=max(depths) if depths else None)
+        fill = [1 - (level - cost) / burst for level, (burst, cost) in zip(levels, limits)]
+        fill += [(depth + jobs) / max_depth for depth, (max_depth, jobs) in zip(depths, limits[buckets:])]
+        decision = Decision(backpressure=min(1.0, max(fill)), depth=max(depths) if depths else None)
+        if levels:
+            tightest = max(range(buckets), key=lambda i: fill[i])
+            decision.burst = limits[tightest][0]
+            decision.remaining = levels[tightest] - limits[tightest][1]
+        return decision
+
+    def check(self, functions, queues, api_key=None, trigger=None):
+        """
+        Admit a request creating functions {name: jobs} onto queues {name:
+        jobs}, taking its tokens, or refuse it. api_key is the caller's key
+        (ANONYMOUS without one), None for internal submissions; trigger is
+        the trigger dict firing it, if any.
+        """
+        plan = self._plan(functions, queues, api_key, trigger)
+        if plan is None:
+            return Decision()
+        return self._decide(plan, self._admit(keys=plan[0], args=plan[1]))
+
+    def stats(self):
+        """Refusals so far per limit label"""
+        return {limit_label(key.decode()): int(count) for key, count in self.redis.hgetall(REJECTED_KEY).items()}
+
+
+class AsyncAdmissionControl(AdmissionControl):
+    """AdmissionControl for a redis.asyncio client"""
+
+    async def check(self, functions, queues, api_key=None, trigger=None):
+        plan = self._plan(functions, queues, api_key, trigger)
+        if plan is None:
+            return Decision()
+        return self._decide(plan, await self._admit(keys=plan[0], args=plan[1]))
@@ -0,0 +1,723 @@
+"""
+State and request handling shared by the Flask (app.py) and ASGI (asgi.py)
+servers: the Redis client and queues, request parsing, enqueueing, and
+the trigger scheduler and archive loops. Importing this module starts no
+threads; each server starts latency_recorder, and the process meant to
+fire cron triggers calls start_scheduler().
+"""
+import os
+import re
+import json
+import logging
+import threading
+import time
+import uuid
+from redis import Redis
+from rq import Queue
+from rq.exceptions import DeserializationError
+from rq.job import Job, JobStatus
+from rq.results import Result
+from rq.utils import utcnow
+from werkzeug.utils import secure_filename
+from executor import run_job
+from mapreduce import (CHUNK_SIZE as MAP_CHUNK_SIZE, chunked, fail_map_chunk, release_parent, run_map, run_map_chunk,
+                       start_map)
+from pipelines import MAX_PIPELINE_STAGES, cancel_downstream, plan_units, run_stages, upstreams
+from result_cache import ResultCache, cache_key
+from queues import QUEUE_NAMES, route
+from scaling import queue_stats
+from job_index import record_enqueued
+from jobmeta import run_info
+from accounting import PRICES, usage_summary
+from admission import AdmissionControl, parse_rate_limit
+from history import ARCHIVE_INTERVAL, GROUP_FIELDS, Archiver, history_range, parse_day
+from joblogs import JOB_LOG_MAX_LINES, END, tail_file
+from telemetry import LatencyRecorder, latency_summary, read_latency, render_prometheus, worker_counts
+from triggers import DUE_BATCH, TriggerStore, LeaderLease, validate_schedule
+from artifacts import NAME_RE, ArtifactWriter, FunctionRegistry, artifact_meta
+import blobs
+from serialization import JSON_CODEC, get_codec
+
+logger = logging.getLogger(__name__)
+
+redis_conn = Redis(host='localhost', port=6379)
+queues = {name: Queue(name, connection=redis_conn) for name in QUEUE_NAMES}
+queue = queues['default']
+result_cache = ResultCache(redis_conn)
+# Request latencies are buffered here and, once started, flushed to Redis every second
+latency_recorder = LatencyRecorder(redis_conn)
+admission = AdmissionControl(redis_conn)
+
+RUNTIMES = ['python', 'node', 'pool', 'legacy']
+BATCH_CHUNK_SIZE = 1000
+MAX_BATCH_SIZE = int(os.environ.get('MAX_BATCH_SIZE', 100000))
+
+# Triggers live in Redis so they survive restarts and are shared by every API process
+trigger_store = TriggerStore(redis_conn)
+scheduler_lease = LeaderLease(redis_conn)
+function_registry = FunctionRegistry(redis_conn)
+archiver = Archiver(redis_conn)
+ARTIFACT_GC_INTERVAL = float(os.environ.get('ARTIFACT_GC_INTERVAL', 3600))
+
+# Jobs a duplicate call can coalesce onto. A finished job's result expires
+# before its claim does, so a duplicate of one runs again, and run_job
+# answers it from the result cache while the result is still cached.
+LIVE_STATUSES = (JobStatus.QUEUED, JobStatus.STARTED, JobStatus.DEFERRED)
+
+def enqueue_function(function_name, payload, meta=None, priority=None):
+    """
+    Enqueue run_job for a function on the queue chosen by route(). Calls to
+    pure (CACHEABLE) functions coalesce onto a queued, started or deferred
+    job for the same function and payload. Registered functions run the artifact of
+    their latest (or meta's 'version') version; raises ValueError for an
+    unknown version. Returns (job_id, deduplicated).
+    """
+    target = queues[route(function_name, priority)]
+    meta = meta or {}
+    meta = artifact_meta(function_name, meta, function_registry.resolve(function_name, meta.get('version')))
+    # Blob references are content-addressed, so equal payloads still share a cache key
+    payload = blobs.offload(payload, codec=get_codec(meta.get('codec')))
+    filename = meta.get('filename') or f"{function_name}.py"
+    cached = cache_key(os.path.join('functions', filename), meta.get('runtime') or 'python', payload)
+    if not cached:
+        job = target.enqueue(run_job, function_name, payload, meta=meta)
+        record_enqueued(redis_conn, job)
+        return job.id, False
+
+    key, ttl = cached
+    job_id = str(uuid.uuid4())
+    claim_ttl = ttl + Queue.DEFAULT_TIMEOUT
+    owner = result_cache.claim(key, job_id, claim_ttl)
+    while owner is not None:
+        if Job(owner, connection=redis_conn).get_status() in LIVE_STATUSES:
+            result_cache.record_coalesced()
+            return owner, True
+        # Another submission may take over the stale claim first; coalesce onto its job then
+        owner = result_cache.replace_claim(key, owner, job_id, claim_ttl)
+    job = target.enqueue(run_job, function_name, payload, meta=meta, job_id=job_id)
+    record_enqueued(redis_conn, job)
+    return job_id, False
+
+def fire_due_triggers():
+    """Enqueue every run that is due, recording how late each was enqueued"""
+    while True:
+        due = trigger_store.take_due(time.time())
+        lateness = []
+        for trig, fires in due:
+            for scheduled in fires:
+                try:
+                    decision = admission.check({trig['function']: 1}, {route(trig['function'], trig.get('priority')): 1},
+                                               trigger=trig)
+                    if not decision.admitted:
+                        logger.warning(f"Skipped run of trigger {trig['id']}: {decision.error()[0]['error']}")
+                        continue
+                    enqueue_function(trig['function'], trig.get('payload', {}),
+                                     meta={'trigger_id': trig['id'], 'scheduled_at': scheduled},
+                                     priority=trig.get('priority'))
+                    lateness.append(time.time() - scheduled)
+                except Exception as e:
+                    logger.error(f"Error firing trigger {trig['id']}: {str(e)}")
+        trigger_store.record_lateness(lateness)
+        if len(due) < DUE_BATCH:
+            return
+
+def collect_artifacts():
+    removed, freed = function_registry.collect_garbage()
+    if removed:
+        logger.info(f"Removed {len(removed)} unreferenced function artifacts ({freed} bytes)")
+    return removed, freed
+
+def held_blobs():
+    """Blob keys in the arguments of queued, deferred, scheduled and started jobs"""
+    job_ids = set()
+    for q in queues.values():
+        job_ids.update(q.get_job_ids())
+        for registry in (q.deferred_job_registry, q.scheduled_job_registry, q.started_job_registry):
+            job_ids.update(registry.get_job_ids())
+    job_ids = list(job_ids)
+    held = set()
+    for start in range(0, len(job_ids), BATCH_CHUNK_SIZE):
+        for job in Job.fetch_many(job_ids[start:start + BATCH_CHUNK_SIZE], connection=redis_conn):
+            if job is None:
+                continue
+            try:
+                held.update(blobs.refs([job.args, job.kwargs]))
+            except DeserializationError:
+                continue
+    return held
+
+def collect_blobs():
+    # Expired blobs are kept while a job that has not run yet still needs them
+    removed, freed = blobs.collect_garbage(held=held_blobs)
+    if removed:
+        logger.info(f"Removed {removed} expired payload/result blobs ({freed} bytes)")
+
+# Background scheduler thread; only the process holding the lease fires cron
+# triggers and collects unreferenced function artifacts and expired blobs,
+# sleeping until the earliest next fire time or a new registration
+def scheduler_loop():
+    renew_interval = scheduler_lease.ttl / 3
+    next_gc = time.time() + ARTIFACT_GC_INTERVAL
+    while True:
+        try:
+            if not scheduler_lease.hold():
+                time.sleep(renew_interval)
+                continue
+            fire_due_triggers()
+            if time.time() >= next_gc:
+                next_gc = time.time() + ARTIFACT_GC_INTERVAL
+                collect_artifacts()
+                collect_blobs()
+            timeout = renew_interval
+            next_fire = trigger_store.next_fire()
+            if next_fire is not None:
+                timeout = min(timeout, next_fire - time.time())
+            trigger_store.wait(timeout)
+        except Exception as e:
+            logger.error(f"Error in trigger scheduler: {str(e)}")
+            time.sleep(1)
+
+# Moves old job records to the Parquet archive, in the process holding the
+# scheduler lease but on a thread of its own so cron triggers fire on time
+def archive_loop():
+    while True:
+        time.sleep(ARCHIVE_INTERVAL)
+        try:
+            if scheduler_lease.hold():
+                archived = archiver.run()
+                if archived:
+                    logger.info(f"Archived {archived} job records")
+        except Exception as e:
+            logger.error(f"Error archiving job records: {str(e)}")
+
+def start_scheduler():
+    """Start the trigger scheduler and archive threads; they do work only while holding the lease"""
+    threading.Thread(target=scheduler_loop, daemon=True).start()
+    threading.Thread(target=archive_loop, daemon=True).start()
+
+def parse_job_request(data):
+    """
+    Validate a {function, payload, runtime, priority, version} request,
+    returning (function, payload, meta, queue_name)
+    """
+    if not isinstance(data, dict):
+        raise ValueError('job must be a JSON object')
+    function_name = data.get('function')
+    payload = data.get('payload', {})
+    runtime = data.get('runtime')
+    if not function_name or not isinstance(function_name, str):
+        raise ValueError('function name required')
+    if not isinstance(payload, dict):
+        raise ValueError('payload must be a JSON object')
+    if runtime and runtime not in RUNTIMES:
+        raise ValueError(f'Invalid runtime {runtime}')
+    version = data.get('version')
+    if version is not None and (not isinstance(version, int) or isinstance(version, bool) or version < 1):
+        raise ValueError('version must be a positive integer')
+    meta = {}
+    if runtime:
+        meta['runtime'] = runtime
+    if version is not None:
+        meta['version'] = version
+    return function_name, payload, meta or None, route(function_name, data.get('priority'))
+
+def resolve_entries(entries):
+    """
+    Point parsed entries for registered functions at their artifacts,
+    with one Redis round trip; raises ValueError for an unknown version
+    """
+    requests = {(entry[0], (entry[2] or {}).get('version')) for entry in entries}
+    records = function_registry.resolve_many(requests)
+    return [(function_name, payload,
+             artifact_meta(function_name, meta, records.get((function_name, (meta or {}).get('version')))),
+             queue_name)
+            for function_name, payload, meta, queue_name in entries]
+
+def query_job_request(args):
+    """parse_job_request for job fields passed as query parameters"""
+    data = dict(args)
+    if 'version' in data:
+        # Anything but digits is passed through for parse_job_request to reject
+        data['version'] = int(data['version']) if data['version'].isdigit() else data['version']
+    return parse_job_request(data)
+
+def parse_encoded_job(args, body, codec):
+    """
+    Validate a job whose payload is body encoded with codec and whose other
+    fields are query parameters. A body over the offload threshold is kept
+    in the blob store as it is, without re-encoding. Returns
+    (function, payload, meta, queue_name) with the codec recorded in meta.
+    """
+    function_name, _, meta, queue_name = query_job_request(args)
+    payload = codec.decode(body)
+    if not isinstance(payload, dict):
+        raise ValueError(f'payload must be a {codec.name} map')
+    if len(body) > blobs.OFFLOAD_BYTES:
+        payload = blobs.put_bytes(body, codec.content_type)
+    return function_name, payload, dict(meta or {}, codec=codec.name), queue_name
+
+def enqueue_batch(entries):
+    """
+    Enqueue parsed (function, payload, meta, queue_name) entries in
+    pipelined chunks, one pipeline per chunk across all queues.
+    Returns job ids in entry order.
+    """
+    job_ids = []
+    for start in range(0, len(entries), BATCH_CHUNK_SIZE):
+        chunk = entries[start:start + BATCH_CHUNK_SIZE]
+        by_queue = {}
+        for position, (function_name, payload, meta, queue_name) in enumerate(chunk):
+            payload = blobs.offload(payload, codec=get_codec((meta or {}).get('codec')))
+            data = Queue.prepare_data(run_job, args=(function_name, payload), meta=meta)
+            by_queue.setdefault(queue_name, []).append((position, data))
+        chunk_ids = [None] * len(chunk)
+        with redis_conn.pipeline() as pipe:
+            for queue_name, items in by_queue.items():
+                jobs = queues[queue_name].enqueue_many([data for _, data in items], pipeline=pipe)
+                for (position, _), job in zip(items, jobs):
+                    chunk_ids[position] = job.id
+                    record_enqueued(redis_conn, job, pipeline=pipe)
+            pipe.execute()
+        job_ids.extend(chunk_ids)
+    return job_ids
+
+def read_ndjson(stream):
+    """Yield one decoded JSON document per non-empty line of a request stream"""
+    for line in stream:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+def with_codec(entry, codec):
+    """A parsed entry whose payload was decoded by codec, recording it in meta"""
+    if codec is None or codec is JSON_CODEC:
+        return entry
+    function_name, payload, meta, queue_name = entry
+    return function_name, payload, dict(meta or {}, codec=codec.name), queue_name
+
+def parse_map_request(data):
+    """
+    Validate a {function, payloads, reduce, reduce_field, chunk_size, runtime,
+    priority, version} map request, returning (function, payloads, meta,
+    queue_name, chunk_size); meta names the reduce function, if any
+    """
+    if not isinstance(data, dict):
+        raise ValueError('map must be a JSON object')
+    function_name, _, meta, queue_name = parse_job_request({k: v for k, v in data.items() if k != 'payloads'})
+    payloads = data.get('payloads')
+    if not isinstance(payloads, list):
+        raise ValueError('payloads must be a list')
+    for position, payload in enumerate(payloads):
+        if not isinstance(payload, dict):
+            raise ValueError(f'payload {position} must be a JSON object')
+    chunk_size = data.get('chunk_size', MAP_CHUNK_SIZE)
+    if not isinstance(chunk_size, int) or isinstance(chunk_size, bool) or chunk_size < 1:
+        raise ValueError('chunk_size must be a positive integer')
+    meta = meta or {}
+    reduce_name = data.get('reduce')
+    if reduce_name is not None:
+        if not reduce_name or not isinstance(reduce_name, str):
+            raise ValueError('reduce must be a function name')
+        reduce_field = data.get('reduce_field', 'numbers')
+        if not isinstance(reduce_field, str):
+            raise ValueError('reduce_field must be a string')
+        meta.update(reduce=reduce_name, reduce_field=reduce_field)
+    return function_name, payloads, meta or None, queue_name, chunk_size
+
+def enqueue_map(function_name, payloads, meta, queue_name, chunk_size):
+    """
+    Queue a map job: a deferred parent job, whose id is returned, and one
+    chunk job per chunk_size payloads, pipelined. The last chunk to finish
+    enqueues the parent (see mapreduce). Raises ValueError for an unknown
+    version of the function.
+    """
+    target = queues[queue_name]
+    meta = meta or {}
+    lookups = {(function_name, meta.get('version'))}
+    if meta.get('reduce'):
+        lookups.add((meta['reduce'], None))
+    records = function_registry.resolve_many(lookups)
+    meta = artifact_meta(function_name, meta, records.get((function_name, meta.get('version'))))
+    reduce_record = records.get((meta.get('reduce'), None))
+    if reduce_record:
+        meta.update(reduce_filename=reduce_record['filename'], reduce_runtime=reduce_record['runtime'])
+    if meta.get('reduce'):
+        # An unregistered reduce function runs where the mapped function does
+        meta.setdefault('reduce_runtime', meta.get('runtime'))
+    codec = get_codec(meta.get('codec'))
+    chunks = chunked(payloads, chunk_size)
+    chunk_meta = {key: meta[key] for key in ('runtime', 'filename', 'version', 'codec') if key in meta}
+
+    map_id = str(uuid.uuid4())
+    parent = target.create_job(run_map, args=(function_name, len(chunks)), job_id=map_id,
+                               status=JobStatus.DEFERRED, description=f"map {function_name} x{len(payloads)}",
+                               meta=dict(meta, map={'items': len(payloads), 'chunks': len(chunks),
+                                                    'chunk_size': chunk_size}))
+    parent.enqueued_at = utcnow()
+    with redis_conn.pipeline() as pipe:
+        start_map(pipe, map_id, len(chunks))
+        parent.save(pipeline=pipe)
+        target.deferred_job_registry.add(parent, pipeline=pipe)
+        record_enqueued(redis_conn, parent, pipeline=pipe)
+        pipe.execute()
+
+    for start in range(0, len(chunks), BATCH_CHUNK_SIZE):
+        jobs = [Queue.prepare_data(run_map_chunk, args=(function_name, map_id, index, blobs.offload(chunk, codec=codec)),
+                                   meta=chunk_meta, description=f"map {map_id} chunk {index}",
+                                   on_failure=fail_map_chunk)
+                for index, chunk in enumerate(chunks[start:start + BATCH_CHUNK_SIZE], start)]
+        with redis_conn.pipeline() as pipe:
+            target.enqueue_many(jobs, pipeline=pipe)
+            pipe.execute()
+    if not chunks:
+        release_parent(map_id)
+    return map_id, len(chunks)
+
+def map_admission(function_name, payloads, queue_name, chunk_size):
+    """admission.check arguments for a map: every payload is a call, every chunk a queued job"""
+    return {function_name: len(payloads)}, {queue_name: -(-len(payloads) // chunk_size)}
+
+def parse_pipeline_request(data):
+    """
+    Validate a {stages: [{id, function, payload, inputs, after, colocate,
+    runtime, priority, version}, ...]} pipeline request into stage dicts
+    with their function, payload, meta and queue_name. inputs maps payload
+    fields to the stages whose results fill them; after lists stages to
+    wait for without reading their results.
+    """
+    if not isinstance(data, dict) or not isinstance(data.get('stages'), list) or not data['stages']:
+        raise ValueError('stages must be a non-empty list')
+    if len(data['stages']) > MAX_PIPELINE_STAGES:
+        raise ValueError(f'a pipeline has at most {MAX_PIPELINE_STAGES} stages')
+    stages = []
+    for position, doc in enumerate(data['stages']):
+        try:
+            function_name, payload, meta, queue_name = parse_job_request(doc)
+        except ValueError as e:
+            raise ValueError(f'stage {position}: {e}') from None
+        stage_id = doc.get('id')
+        inputs = doc.get('inputs', {})
+        after = doc.get('after', [])
+        if not stage_id or not isinstance(stage_id, str):
+            raise ValueError(f'stage {position}: id required')
+        if any(stage['id'] == stage_id for stage in stages):
+            raise ValueError(f'stage {position}: duplicate id {stage_id}')
+        if not isinstance(inputs, dict) or not all(isinstance(v, str) for v in inputs.values()):
+            raise ValueError(f'stage {stage_id}: inputs must map payload fields to stage ids')
+        if not isinstance(after, list) or not all(isinstance(v, str) for v in after):
+            raise ValueError(f'stage {stage_id}: after must be a list of stage ids')
+        stages.append({'id': stage_id, 'function': function_name, 'payload': payload, 'meta': meta,
+                       'queue_name': queue_name, 'inputs': inputs, 'after': after,
+                       'colocate': bool(doc.get('colocate'))})
+    return stages
+
+def enqueue_pipeline(stages):
+    """
+    Queue a pipeline's units (see pipelines), each unit's job depending on
+    the jobs of the units it waits for. Returns (pipeline_id, {stage id:
+    job id}); colocated stages share their unit's job. Raises ValueError
+    for an invalid DAG or an unknown version.
+    """
+    units = plan_units(stages)
+    records = function_registry.resolve_many({(stage['function'], (stage['meta'] or {}).get('version'))
+                                              for stage in stages})
+    pipeline_id = str(uuid.uuid4())
+    job_ids, jobs = {}, []
+    for unit in units:
+        members = [stage['id'] for stage in unit]
+        metas = [artifact_meta(stage['function'], stage['meta'],
+                               records.get((stage['function'], (stage['meta'] or {}).get('version'))))
+                 for stage in unit]
+        specs = [{'id': stage['id'], 'function': stage['function'], 'payload': blobs.offload(stage['payload']),
+                  'inputs': stage['inputs'], 'runtime': meta.get('runtime') or 'python',
+                  'filename': meta.get('filename') or f"{stage['function']}.py"}
+                 for stage, meta in zip(unit, metas)]
+        # Upstreams in other units: inputs are read from their jobs, after only waits for them
+        sources = {upstream: job_ids[upstream] for stage in unit for upstream in stage['inputs'].values()
+                   if upstream not in members}
+        depends_on = list(dict.fromkeys(job_ids[upstream] for stage in unit for upstream in upstreams(stage)
+                                        if upstream not in members))
+        head = unit[0]
+        job = queues[head['queue_name']].enqueue_call(
+            run_stages, args=(head['function'], pipeline_id, specs, sources), depends_on=depends_on or None,
+            meta=dict(metas[0], pipeline=pipeline_id, stages=members),
+            description=f"pipeline {pipeline_id} {'+'.join(members)}")
+        # A deferred job gets enqueued_at only once RQ enqueues it; list it by submission time
+        job.enqueued_at = job.enqueued_at or job.created_at
+        record_enqueued(redis_conn, job)
+        job_ids.update(dict.fromkeys(members, job.id))
+        jobs.append(job)
+    # A unit that failed before its dependents were queued could not cancel them
+    for job in Job.fetch_many([job.id for job in jobs], connection=redis_conn):
+        if job is not None and job.get_status(refresh=False) == JobStatus.FAILED:
+            cancel_downstream(job)
+    return pipeline_id, job_ids
+
+def parse_trigger(data):
+    """Validate a /trigger request body into a trigger dict; raises ValueError"""
+    if not isinstance(data, dict):
+        raise ValueError('trigger must be a JSON object')
+    trig_type = data.get('type')
+    function = data.get('function')
+    priority = data.get('priority')
+    if not trig_type or not function:
+        raise ValueError('type and function required')
+    route(function, priority)
+    trig = {
+        'id': str(uuid.uuid4()),
+        'type': trig_type,
+        'function': function,
+        'payload': data.get('payload', {}),
+        'priority': priority
+    }
+    if trig_type == 'cron':
+        # Either a cron expression (with optional timezone) or a fixed interval in seconds
+        if data.get('cron') is not None:
+            trig['cron'] = data['cron']
+            trig['timezone'] = data.get('timezone', 'UTC')
+        else:
+            trig['interval'] = data.get('interval', 60)
+        trig['catch_up'] = data.get('catch_up', 'once')
+        validate_schedule(trig)
+    if trig_type == 'webhook':
+        trig['event_type'] = data.get('event_type')
+    if data.get('rate_limit') is not None:
+        trig['rate_limit'] = parse_rate_limit(data['rate_limit'])
+    return trig
+
+def store_trigger(trig):
+    """Store a parsed trigger; returns the /trigger response"""
+    trigger_store.add(trig, time.time())
+    logger.info(f"Registered trigger {trig}")
+    result = {'trigger_id': trig['id']}
+    if trig['type'] == 'cron':
+        result['next_fire'] = trigger_store.next_fire(trig['id'])
+    return result
+
+def fire_event(event_type, api_key=None):
+    """
+    Enqueue the function of every webhook trigger registered for event_type
+    that admission control admits. Returns (triggers fired, {trigger id:
+    refusing Decision}).
+    """
+    fired, refused = 0, {}
+    for trig in trigger_store.for_event(event_type):
+        decision = admission.check({trig['function']: 1}, {route(trig['function'], trig.get('priority')): 1},
+                                   api_key, trig)
+        if not decision.admitted:
+            refused[trig['id']] = decision
+            logger.warning(f"Trigger {trig['id']} not fired for event {event_type}: {decision.error()[0]['error']}")
+            continue
+        enqueue_function(trig['function'], trig.get('payload', {}), priority=trig.get('priority'))
+        fired += 1
+        logger.info(f"Triggered function {trig['function']} for event {event_type}")
+    return fired, refused
+
+def event_response(fired, refused):
+    """
+    (body, status, headers) for /event. It is refused with a 429 only if
+    every matching trigger was, so a sender retrying it fires nothing twice.
+    """
+    if refused and not fired:
+        soonest = min(refused.values(), key=lambda decision: decision.retry_after)
+        return ({'error': 'every trigger for the event was rate limited', 'throttled': list(refused),
+                 'retry_after': round(soonest.retry_after, 3)}, 429, soonest.headers())
+    return {'status': 'event processed', 'fired': fired, 'throttled': list(refused)}, 200, {}
+
+STATUS_FIELDS = ('status', 'runtime', 'filename', 'execution_time', 'retries',
+                 'worker_tag', 'cost', 'usage', 'result', 'error')
+MAX_STATUS_IDS = 10000
+
+def prefetch_results(jobs):
+    """
+    Load the latest Result of every finished or failed job in one pipeline,
+    so job.result and job.exc_info below don't cost a round trip per job.
+    """
+    done = [job for job in jobs if job is not None and job.supports_redis_streams
+            and job.get_status(refresh=False) in (JobStatus.FINISHED, JobStatus.FAILED)]
+    with redis_conn.pipeline() as pipe:
+        for job in done:
+            pipe.xrevrange(Result.get_key(job.id), '+', '-', count=1)
+        responses = pipe.execute()
+    for job, response in zip(done, responses):
+        if response:
+            result_id, payload = response[0]
+            job._cached_result = Result.restore(job.id, result_id.decode(), payload,
+                                                connection=redis_conn, serializer=job.serializer)
+
+def describe_job(job, fields=None, max_result_bytes=None, outcome=None):
+    """
+    Status summary of a job, limited to fields if given. Results whose JSON
+    encoding exceeds max_result_bytes are dropped and flagged result_truncated.
+    Results kept in the blob store are returned as a reference with a
+    result_url to download them from.
+    outcome, if given, is the job's already loaded (result, exc_info) so no
+    Redis reads are made.
+    """
+    fields = fields or STATUS_FIELDS
+    status = job.get_status(refresh=False)
+    run = run_info(job.meta)
+    summary = {
+        'job_id': job.id,
+        'status': status,
+        'runtime': job.meta.get('runtime'),
+        'filename': job.meta.get('filename'),
+        'execution_time': run['execution_time'],
+        'retries': run['retries'],
+        'worker_tag': job.meta.get('worker_tag'),
+        'cost': run['cost'],
+        'usage': run['usage'],
+    }
+    summary = {k: v for k, v in summary.items() if k == 'job_id' or k in fields}
+    result, exc_info = outcome if outcome is not None else (None, None)
+    if 'result' in fields:
+        if outcome is None and status == 'finished':
+            result = job.result
+        if status != 'finished':
+            result = None
+        if max_result_bytes is not None and len(json.dumps(result, default=str)) > max_result_bytes:
+            result = None
+            summary['result_truncated'] = True
+        if blobs.is_ref(result):
+            summary['result_url'] = f"/result/{job.id}"
+        summary['result'] = result
+    if 'error' in fields and status == 'failed':
+        summary['error'] = str(job.exc_info if outcome is None else exc_info)
+    return summary
+
+def split_list(value):
+    """'a,b' as ['a', 'b']; lists (from JSON bodies) and None pass through"""
+    return [item for item in value.split(',') if item] if isinstance(value, str) else value
+
+def parse_status_params(params):
+    """Validate /status ids, fields and max_result_bytes; raises ValueError"""
+    if not isinstance(params, dict):
+        raise ValueError('expected a JSON object')
+    job_ids = split_list(params.get('ids')) or []
+    fields = split_list(params.get('fields'))
+    max_result_bytes = params.get('max_result_bytes')
+    if not isinstance(job_ids, list) or not all(isinstance(job_id, str) for job_id in job_ids):
+        raise ValueError('ids must be a list of job ids')
+    if fields is not None and (not isinstance(fields, list) or not set(fields) <= set(STATUS_FIELDS)):
+        raise ValueError(f"fields must be a subset of {', '.join(STATUS_FIELDS)}")
+    try:
+        max_result_bytes = int(max_result_bytes) if max_result_bytes is not None else None
+    except ValueError:
+        raise ValueError('max_result_bytes must be an integer')
+    return job_ids, fields, max_result_bytes
+
+MAX_WAIT = 60
+EVENTS_KEEPALIVE = 15
+END_STATUSES = (JobStatus.FINISHED, JobStatus.FAILED, JobStatus.STOPPED, JobStatus.CANCELED)
+
+MAX_JOBS_PAGE = 500
+
+ALLOWED_EXTENSIONS = {'py', 'js'}
+
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+def check_upload(filename, runtime, priority, name):
+    """Return an error message for an invalid /upload request, else None"""
+    if not runtime or runtime not in RUNTIMES:
+        return 'Invalid or missing runtime'
+    if not allowed_file(filename):
+        return 'Invalid file extension'
+    if runtime == 'pool' and not filename.endswith('.py'):
+        return 'pool runtime requires a .py file'
+    if priority and priority not in QUEUE_NAMES:
+        return f'Invalid priority {priority}'
+    if not NAME_RE.fullmatch(name):
+        return f'Invalid function name {name}'
+    return None
+
+def upload_name(filename, name=None):
+    """Function name for an upload: the name given, else the uploaded file's name"""
+    return name or secure_filename(filename).rsplit('.', 1)[0]
+
+def parse_upload_payload(payload):
+    # Parse payload if present
+    try:
+        return json.loads(payload)
+    except Exception:
+        return {}
+
+def artifact_stream(total_content_length, content_type, filename, content_length=None):
+    # Uploaded files are hashed and spooled straight into the artifact store
+    return ArtifactWriter()
+
+def collect_metrics(prometheus=False):
+    """The /metrics dict, or with prometheus=True its Prometheus text exposition"""
+    now = time.time()
+    per_queue = {name: queue_stats(redis_conn, q, now) for name, q in queues.items()}
+    queue_size = sum(stats['depth'] for stats in per_queue.values())
+    workers = worker_counts(redis_conn, now)
+    total_cost = float(redis_conn.get("total_cost") or 0.0)
+    histograms, totals = read_latency(redis_conn, now)
+    metrics = {
+        "queue_size": queue_size,
+        "queues": per_queue,
+        "active_workers": workers['active'],
+        "workers": workers,
+        "total_cost": round(total_cost, 4),
+        "prices": PRICES,
+        "usage": usage_summary(redis_conn, now),
+        "latency": latency_summary(histograms),
+        "result_cache": result_cache.stats(),
+        "triggers": trigger_store.firing_accuracy(),
+        "admission": {"rejected": admission.stats()}
+    }
+    if prometheus:
+        return render_prometheus(metrics, histograms, totals)
+    return metrics
+
+def parse_history_params(args):
+    """(start, end, function, group_by) from /history query parameters; raises ValueError"""
+    start, end = history_range(parse_day(args.get('from'), None), parse_day(args.get('to'), None))
+    group_by = tuple(split_list(args.get('group_by') or 'function,day'))
+    if not group_by:
+        raise ValueError('group_by needs at least one field')
+    for field in group_by:
+        if field not in GROUP_FIELDS:
+            raise ValueError(f"Cannot group by {field}, expected some of {', '.join(GROUP_FIELDS)}")
+    return start, end, args.get('function'), group_by
+
+MAX_LOG_TAIL = 1000
+
+def read_log_tail(lines=100):
+    """Last lines of the autoscaler log, read back from the end of the file"""
+    log_path = os.path.join('logs', 'autoscaler.log')
+    if not os.path.exists(log_path):
+        return ["No log file found."]
+    return tail_file(log_path, lines)
+
+def parse_log_params(args, last_event_id=None):
+    """
+    (after, tail, follow) from /logs/<job_id> parameters: lines after the
+    entry id ?after= (or a reconnecting stream's Last-Event-ID), else the
+    last ?tail= lines (default 100); ?follow=1 streams new lines
+    """
+    after = last_event_id or args.get('after')
+    if after is not None and not re.fullmatch(r'\d+-\d+', after):
+        raise ValueError('after must be a log entry id')
+    try:
+        tail = int(args.get('tail', 100))
+    except ValueError:
+        raise ValueError('tail must be an integer')
+    if not 0 <= tail <= JOB_LOG_MAX_LINES:
+        raise ValueError(f'tail must be between 0 and {JOB_LOG_MAX_LINES}')
+    return after, tail, args.get('follow') in ('1', 'true')
+
+def format_log_lines(lines):
+    """Server-Sent Events for log lines; the event type is the stream"""
+    return ''.join(f"id: {line['id']}\nevent: {line['stream']}\ndata: {json.dumps(line['line'])}\n\n"
+                   for line in lines)
+
+def job_end_status(status):
+    """A job's status from its hash if it has ended (or expired), else None"""
+    if status is None:
+        return 'expired'
+    return status.decode() if status.decode() in END_STATUSES else None
+
+def format_log_end(status):
+    return f"event: {END}\ndata: {json.dumps(status)}\n\n"
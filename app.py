@@ -1,16 +1,35 @@
 import os
+import re
+import json
+import itertools
 import logging
-from flask import Flask, request, jsonify
-from redis import Redis
-from rq import Queue
-from rq.job import Job
+from collections import Counter
+from flask import Flask, Response, g, request, jsonify, send_file, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+from rq.exceptions import NoSuchJobError
+from rq.job import Job, JobStatus
 from executor import run_job
-
-import threading
+from mapreduce import MAX_MAP_SIZE
+from job_index import INDEXED_FIELDS, record_enqueued, query_jobs
+from admission import api_key_of
+from events import last_event_id, read_events
+from history import query_history
+from joblogs import file_handler, follow_job_log, read_job_log
+from telemetry import API_METRIC, PROMETHEUS_CONTENT_TYPE, wants_prometheus
+from artifacts import CHUNK_SIZE, NAME_RE, artifact_meta, runtime_extension, store_stream
+import blobs
+from serialization import JSON_CODEC, codec_for, get_codec, is_array
 import time
-import uuid
-from datetime import datetime
-from werkzeug.utils import secure_filename
+from werkzeug.formparser import parse_form_data
+from api import (END_STATUSES, EVENTS_KEEPALIVE, MAX_BATCH_SIZE, MAX_JOBS_PAGE, MAX_LOG_TAIL, MAX_STATUS_IDS,
+                 MAX_WAIT, RUNTIMES, admission, artifact_stream, check_upload, collect_artifacts,
+                 collect_metrics, describe_job, enqueue_batch, enqueue_function, enqueue_map, enqueue_pipeline,
+                 event_response, fire_event, format_log_end, format_log_lines, function_registry, job_end_status,
+                 latency_recorder, map_admission, parse_encoded_job, parse_history_params, parse_job_request,
+                 parse_log_params, parse_map_request, parse_pipeline_request, parse_status_params, parse_trigger,
+                 parse_upload_payload, prefetch_results, query_job_request, queues, read_log_tail, read_ndjson,
+                 redis_conn, resolve_entries, split_list, start_scheduler, store_trigger, trigger_store, upload_name,
+                 with_codec)
 
 # Setup logging
 os.makedirs('logs', exist_ok=True)
@@ -18,214 +37,594 @@ logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     handlers=[
-        logging.FileHandler('logs/app.log'),
+        file_handler('logs/app.log'),
         logging.StreamHandler()
     ]
 )
 logger = logging.getLogger(__name__)
 
+class JSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider, also serializing NumPy results of msgpack and Arrow jobs"""
+
+    @staticmethod
+    def default(o):
+        if is_array(o):
+            return o.tolist()
+        return DefaultJSONProvider.default(o)
+
 app = Flask(__name__)
-redis_conn = Redis(host='localhost', port=6379)
-queue = Queue('default', connection=redis_conn)
+app.json = JSONProvider(app)
 
-# In-memory trigger storage
-triggers = []
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
 
-# Background scheduler thread
-def scheduler_loop():
-    while True:
-        now = datetime.now()
-        for trig in triggers:
-            if trig['type'] == 'cron':
-                # Simple cron: run every N seconds
-                interval = trig.get('interval', 60)
-                last_run = trig.get('last_run', 0)
-                if time.time() - last_run >= interval:
-                    queue.enqueue(run_job, trig['function'], trig.get('payload', {}))
-                    trig['last_run'] = time.time()
-        time.sleep(1)
+@app.after_request
+def record_latency(response):
+    # Streams (/events, /wait) are timed to their first byte
+    start = g.get('request_start')
+    if start is not None and request.endpoint:
+        latency_recorder.observe(API_METRIC, (request.endpoint, request.method), time.perf_counter() - start)
+    return response
 
-threading.Thread(target=scheduler_loop, daemon=True).start()
 
+def refuse(decision):
+    """The 429 (or 413) response for a submission admission control refused"""
+    body, status = decision.error()
+    return jsonify(body), status, decision.headers()
 
 @app.route('/submit', methods=['POST'])
 def submit_job():
+    """
+    Submit a job. A JSON body is the whole {function, payload, ...} request.
+    A msgpack or Arrow body (by Content-Type) is the payload alone, with the
+    other fields as query parameters; the job keeps that codec for its
+    payload and result.
+    """
     try:
-        data = request.get_json()
-        function_name = data.get('function')
-        payload = data.get('payload', {})
-        if not function_name:
-            return jsonify({'error': 'function name required'}), 400
-        job = queue.enqueue(run_job, function_name, payload)
-        logger.info(f"Job {job.id} submitted for function {function_name}")
-        return jsonify({'job_id': job.id})
+        codec = codec_for(request.mimetype)
+        try:
+            if codec is None or codec is JSON_CODEC:
+                function_name, payload, meta, queue_name = parse_job_request(request.get_json())
+            else:
+                function_name, payload, meta, queue_name = parse_encoded_job(request.args, request.get_data(), codec)
+            decision = admission.check({function_name: 1}, {queue_name: 1}, api_key_of(request.headers))
+            if not decision.admitted:
+                return refuse(decision)
+            job_id, deduplicated = enqueue_function(function_name, payload, meta, queue_name)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if deduplicated:
+            logger.info(f"Submission for function {function_name} coalesced onto job {job_id}")
+            return jsonify({'job_id': job_id, 'deduplicated': True}), decision.headers()
+        logger.info(f"Job {job_id} submitted for function {function_name}")
+        return jsonify({'job_id': job_id}), decision.headers()
     except Exception as e:
         logger.error(f"Error submitting job: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/submit/batch', methods=['POST'])
+def submit_batch():
+    """
+    Submit many jobs at once. Accepts a JSON list (or {"jobs": [...]}),
+    the same in msgpack, whose jobs then keep the msgpack codec, or an
+    application/x-ndjson stream with one job per line. Every entry is
+    validated before anything is enqueued.
+    """
+    try:
+        codec = codec_for(request.mimetype)
+        if request.mimetype == 'application/x-ndjson':
+            docs = read_ndjson(request.stream)
+        else:
+            try:
+                data = request.get_json() if codec is None or codec is JSON_CODEC else codec.decode(request.get_data())
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            docs = data.get('jobs') if isinstance(data, dict) else data
+            if not isinstance(docs, list):
+                return jsonify({'error': 'expected a list of jobs'}), 400
+
+        entries = []
+        try:
+            for doc in docs:
+                if len(entries) >= MAX_BATCH_SIZE:
+                    return jsonify({'error': f'batch exceeds {MAX_BATCH_SIZE} jobs'}), 413
+                entries.append(with_codec(parse_job_request(doc), codec))
+        except ValueError as e:
+            # JSONDecodeError is a ValueError too
+            return jsonify({'error': f'job {len(entries)}: {e}'}), 400
+        try:
+            entries = resolve_entries(entries)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        decision = admission.check(Counter(entry[0] for entry in entries), Counter(entry[3] for entry in entries),
+                                   api_key_of(request.headers))
+        if not decision.admitted:
+            return refuse(decision)
+
+        job_ids = enqueue_batch(entries)
+        logger.info(f"Batch of {len(job_ids)} jobs submitted")
+        return jsonify({'job_ids': job_ids}), decision.headers()
+    except Exception as e:
+        logger.error(f"Error submitting batch: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/submit/blob', methods=['POST'])
+def submit_blob():
+    """
+    Run a function on a binary payload: the request body is streamed into
+    the blob store and the handler receives it as a read-only memoryview
+    (or, in a container, a file named by PAYLOAD_FILE).
+    e.g. curl --data-binary @image.png ".../submit/blob?function=resize&runtime=legacy"
+    """
+    try:
+        try:
+            function_name, _, meta, queue_name = query_job_request(request.args.to_dict())
+            meta = artifact_meta(function_name, meta,
+                                 function_registry.resolve(function_name, (meta or {}).get('version')))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        # Refused before the body is read
+        decision = admission.check({function_name: 1}, {queue_name: 1}, api_key_of(request.headers))
+        if not decision.admitted:
+            return refuse(decision)
+        payload = blobs.put_stream(iter(lambda: request.stream.read(CHUNK_SIZE), b''))
+        job = queues[queue_name].enqueue(run_job, function_name, payload, meta=meta)
+        record_enqueued(redis_conn, job)
+        logger.info(f"Job {job.id} submitted for function {function_name} with a {payload['size']} byte blob")
+        return jsonify({'job_id': job.id, 'payload': payload}), decision.headers()
+    except Exception as e:
+        logger.error(f"Error submitting blob job: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/map', methods=['POST'])
+def submit_map():
+    """
+    Run a function over many payloads and optionally reduce the results,
+    as one job. Accepts {"function", "payloads": [...], "reduce", ...} as
+    JSON or msgpack, or an application/x-ndjson stream whose first line
+    is the request without payloads and whose other lines are payloads.
+    Returns the parent job's id; its result is the reduced output, or the
+    list of item results without a reduce function.
+    """
+    try:
+        codec = codec_for(request.mimetype)
+        try:
+            if request.mimetype == 'application/x-ndjson':
+                docs = read_ndjson(request.stream)
+                data = next(docs, None)
+                if isinstance(data, dict):
+                    # One past the limit is enough to reject the map
+                    data = dict(data, payloads=list(itertools.islice(docs, MAX_MAP_SIZE + 1)))
+            elif codec is None or codec is JSON_CODEC:
+                data = request.get_json()
+            else:
+                data = codec.decode(request.get_data())
+            function_name, payloads, meta, queue_name, chunk_size = parse_map_request(data)
+            if len(payloads) > MAX_MAP_SIZE:
+                return jsonify({'error': f'map exceeds {MAX_MAP_SIZE} payloads'}), 413
+            if codec is not None and codec is not JSON_CODEC:
+                meta = dict(meta or {}, codec=codec.name)
+            decision = admission.check(*map_admission(function_name, payloads, queue_name, chunk_size),
+                                       api_key_of(request.headers))
+            if not decision.admitted:
+                return refuse(decision)
+            map_id, chunks = enqueue_map(function_name, payloads, meta, queue_name, chunk_size)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        logger.info(f"Map {map_id} submitted: {function_name} over {len(payloads)} payloads in {chunks} chunks")
+        return jsonify({'job_id': map_id, 'items': len(payloads), 'chunks': chunks}), decision.headers()
+    except Exception as e:
+        logger.error(f"Error submitting map: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/pipeline', methods=['POST'])
+def submit_pipeline():
+    """
+    Submit a DAG of stages. Each stage's job is enqueued by RQ once the
+    stages it depends on have finished, and reads their results on the
+    worker. Returns the pipeline id and every stage's job id.
+    """
+    try:
+        try:
+            stages = parse_pipeline_request(request.get_json(silent=True))
+            decision = admission.check(Counter(stage['function'] for stage in stages),
+                                       Counter(stage['queue_name'] for stage in stages), api_key_of(request.headers))
+            if not decision.admitted:
+                return refuse(decision)
+            pipeline_id, job_ids = enqueue_pipeline(stages)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        logger.info(f"Pipeline {pipeline_id} submitted: {len(stages)} stages in {len(set(job_ids.values()))} jobs")
+        return jsonify({'pipeline_id': pipeline_id, 'jobs': job_ids}), decision.headers()
+    except Exception as e:
+        logger.error(f"Error submitting pipeline: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/trigger', methods=['POST'])
 def register_trigger():
     """Register a trigger (cron or webhook)"""
     try:
-        data = request.get_json()
-        trig_type = data.get('type')
-        function = data.get('function')
-        payload = data.get('payload', {})
-        if not trig_type or not function:
-            return jsonify({'error': 'type and function required'}), 400
-        trig = {
-            'id': str(uuid.uuid4()),
-            'type': trig_type,
-            'function': function,
-            'payload': payload
-        }
-        if trig_type == 'cron':
-            trig['interval'] = data.get('interval', 60)  # seconds
-            trig['last_run'] = 0
-        if trig_type == 'webhook':
-            trig['event_type'] = data.get('event_type')
-        triggers.append(trig)
-        logger.info(f"Registered trigger {trig}")
-        return jsonify({'trigger_id': trig['id']})
+        try:
+            trig = parse_trigger(request.get_json())
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify(store_trigger(trig))
     except Exception as e:
         logger.error(f"Error registering trigger: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/trigger/<trigger_id>', methods=['GET'])
+def get_trigger(trigger_id):
+    try:
+        trig = trigger_store.get(trigger_id)
+        if trig is None:
+            return jsonify({'error': 'Trigger not found'}), 404
+        if trig['type'] == 'cron':
+            trig['next_fire'] = trigger_store.next_fire(trigger_id)
+        return jsonify(trig)
+    except Exception as e:
+        logger.error(f"Error getting trigger {trigger_id}: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/trigger/<trigger_id>', methods=['DELETE'])
+def delete_trigger(trigger_id):
+    try:
+        if not trigger_store.remove(trigger_id):
+            return jsonify({'error': 'Trigger not found'}), 404
+        logger.info(f"Deleted trigger {trigger_id}")
+        return jsonify({'status': 'deleted'})
+    except Exception as e:
+        logger.error(f"Error deleting trigger: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/event', methods=['POST'])
 def receive_event():
     """Receive an event and enqueue job if trigger matches"""
     try:
         data = request.get_json()
-        event_type = data.get('event_type')
-        for trig in triggers:
-            if trig['type'] == 'webhook' and trig.get('event_type') == event_type:
-                queue.enqueue(run_job, trig['function'], trig.get('payload', {}))
-                logger.info(f"Triggered function {trig['function']} for event {event_type}")
-        return jsonify({'status': 'event processed'})
+        body, status, headers = event_response(*fire_event(data.get('event_type'), api_key_of(request.headers)))
+        return jsonify(body), status, headers
     except Exception as e:
         logger.error(f"Error processing event: {str(e)}")
         return jsonify({'error': str(e)}), 500
-def submit_job():
-    try:
-        data = request.get_json()
-        function_name = data.get('function')
-        payload = data.get('payload', {})
-        
-        if not function_name:
-            return jsonify({'error': 'function name required'}), 400
-        
-        job = queue.enqueue(run_job, function_name, payload)
-        logger.info(f"Job {job.id} submitted for function {function_name}")
-        
-        return jsonify({'job_id': job.id})
-    
-    except Exception as e:
-        logger.error(f"Error submitting job: {str(e)}")
-        return jsonify({'error': str(e)}), 500
 
 @app.route('/status/<job_id>')
 def get_status(job_id):
     try:
         job = Job.fetch(job_id, connection=redis_conn)
-        
-        status = job.get_status()
-        result = {
-            'job_id': job_id,
-            'status': status,
-            'runtime': job.meta.get('runtime'),
-            'filename': job.meta.get('filename'),
-            'execution_time': job.meta.get('execution_time'),
-            'retries': job.meta.get('retries', 0),
-            'worker_tag': job.meta.get('worker_tag'),
-            'cost': job.meta.get('cost', None),
-            'result': job.result if status == 'finished' else None
-        }
-        
-        if status == 'failed':
-            result['error'] = str(job.exc_info)
-            
-        return jsonify(result)
+        return jsonify(describe_job(job))
     
     except Exception as e:
         logger.error(f"Error getting status for job {job_id}: {str(e)}")
         return jsonify({'error': 'Job not found'}), 404
 
-ALLOWED_EXTENSIONS = {'py', 'js'}
+@app.route('/status', methods=['GET', 'POST'])
+def get_statuses():
+    """
+    Bulk status lookup: ?ids=a,b,c (or a POST body {"ids": [...]}), with
+    optional fields=status,cost,... and max_result_bytes. All jobs are
+    read with one Job.fetch_many pipeline plus one pipeline for results.
+    Unknown ids come back with an error, in request order.
+    """
+    try:
+        params = request.get_json(silent=True) if request.method == 'POST' else request.args.to_dict()
+        try:
+            job_ids, fields, max_result_bytes = parse_status_params(params)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if len(job_ids) > MAX_STATUS_IDS:
+            return jsonify({'error': f'at most {MAX_STATUS_IDS} ids per request'}), 413
 
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+        jobs = Job.fetch_many(job_ids, connection=redis_conn)
+        if fields is None or {'result', 'error'} & set(fields):
+            prefetch_results(jobs)
+        return jsonify({'jobs': [
+            describe_job(job, fields, max_result_bytes) if job is not None
+            else {'job_id': job_id, 'error': 'Job not found'}
+            for job_id, job in zip(job_ids, jobs)
+        ]})
+    except Exception as e:
+        logger.error(f"Error getting statuses: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/wait/<job_id>')
+def wait_for_job(job_id):
+    """
+    Long-poll until the job finishes or fails, for at most ?timeout= seconds
+    (default 30, max 60). Returns the job status like /status/<job_id>, or
+    202 with the current status if the job is still running.
+    """
+    try:
+        try:
+            timeout = min(float(request.args.get('timeout', 30)), MAX_WAIT)
+        except ValueError:
+            return jsonify({'error': 'timeout must be a number'}), 400
+        # Take the stream position first so an event published meanwhile isn't missed
+        last_id = last_event_id(redis_conn)
+        try:
+            job = Job.fetch(job_id, connection=redis_conn)
+        except NoSuchJobError:
+            return jsonify({'error': 'Job not found'}), 404
+        deadline = time.time() + timeout
+        while job.get_status(refresh=False) not in END_STATUSES:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return jsonify({'job_id': job_id, 'status': job.get_status(refresh=False)}), 202
+            events, last_id = read_events(redis_conn, last_id, int(remaining * 1000))
+            if any(event['job_id'] == job_id for _, event in events):
+                job = Job.fetch(job_id, connection=redis_conn)
+        return jsonify(describe_job(job))
+    except Exception as e:
+        logger.error(f"Error waiting for job {job_id}: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/events')
+def stream_events():
+    """
+    Server-Sent Events stream of job completions, optionally limited to
+    ?job_ids=a,b,c and/or ?function=name. Reconnecting clients resume
+    from their Last-Event-ID.
+    """
+    job_ids = set(split_list(request.args.get('job_ids')) or [])
+    function_name = request.args.get('function')
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    if not last_id or not re.fullmatch(r'\d+(-\d+)?', last_id):
+        last_id = last_event_id(redis_conn)
+
+    def generate(last_id):
+        last_sent = time.time()
+        while True:
+            events, last_id = read_events(redis_conn, last_id, EVENTS_KEEPALIVE * 1000)
+            for event_id, event in events:
+                if job_ids and event['job_id'] not in job_ids:
+                    continue
+                if function_name and event['function'] != function_name:
+                    continue
+                last_sent = time.time()
+                yield f"id: {event_id}\nevent: {event['status']}\ndata: {json.dumps(event)}\n\n"
+            if time.time() - last_sent >= EVENTS_KEEPALIVE:
+                last_sent = time.time()
+                yield ': keepalive\n\n'
+
+    return Response(stream_with_context(generate(last_id)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/result/<job_id>')
+def download_result(job_id):
+    """
+    A finished job's result: blob results are streamed from the blob store
+    with their content type, others are encoded with the job's codec.
+    """
+    try:
+        try:
+            job = Job.fetch(job_id, connection=redis_conn)
+        except NoSuchJobError:
+            return jsonify({'error': 'Job not found'}), 404
+        status = job.get_status(refresh=False)
+        if status != JobStatus.FINISHED:
+            return jsonify({'job_id': job_id, 'status': status, 'error': 'Job has no result'}), 409
+        result = job.result
+        if not blobs.is_ref(result):
+            codec = get_codec(job.meta.get('codec'))
+            if codec is JSON_CODEC:
+                return jsonify(result)
+            return Response(codec.encode(result), mimetype=codec.content_type)
+        try:
+            return send_file(blobs.blob_path(result), mimetype=result['content_type'],
+                             download_name=f"{job_id}.{blobs.EXTENSIONS[result['content_type']]}")
+        except FileNotFoundError:
+            return jsonify({'error': 'Result has expired from the blob store'}), 410
+    except Exception as e:
+        logger.error(f"Error downloading result for job {job_id}: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/jobs')
+def list_jobs():
+    """
+    List jobs newest first, optionally filtered by status, function and
+    worker_tag. Pass the returned next_cursor as ?cursor= for the next page.
+    """
+    try:
+        filters = {field: request.args.get(field) for field in INDEXED_FIELDS}
+        try:
+            limit = min(int(request.args.get('limit', 50)), MAX_JOBS_PAGE)
+            if limit < 1:
+                raise ValueError
+        except ValueError:
+            return jsonify({'error': 'limit must be a positive integer'}), 400
+        try:
+            jobs, next_cursor = query_jobs(redis_conn, filters, request.args.get('cursor'), limit)
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+        return jsonify({'jobs': jobs, 'next_cursor': next_cursor})
+    except Exception as e:
+        logger.error(f"Error listing jobs: {str(e)}")
+        return jsonify({'error': str(e)}), 500
 
 @app.route('/upload', methods=['POST'])
 def upload_function():
+    """
+    Upload a function file and run it. The file is stored by content hash
+    and registered as the latest version of the form's name (default: the
+    file name); uploading unchanged code reuses the current version.
+    """
+    files = {}
     try:
-        if 'file' not in request.files:
+        _, form, files = parse_form_data(request.environ, stream_factory=artifact_stream)
+        if 'file' not in files:
             return jsonify({'error': 'No file part'}), 400
-        file = request.files['file']
-        runtime = request.form.get('runtime')
-        payload = request.form.get('payload', '{}')
+        file = files['file']
+        runtime = form.get('runtime')
+        payload = form.get('payload', '{}')
+        priority = form.get('priority')
 
         if not file or file.filename == '':
             return jsonify({'error': 'No selected file'}), 400
-        if not runtime or runtime not in ['python', 'node']:
-            return jsonify({'error': 'Invalid or missing runtime'}), 400
-        if not allowed_file(file.filename):
-            return jsonify({'error': 'Invalid file extension'}), 400
+        name = upload_name(file.filename, form.get('name'))
+        error = check_upload(file.filename, runtime, priority, name)
+        if error:
+            return jsonify({'error': error}), 400
 
-        ext = file.filename.rsplit('.', 1)[1].lower()
-        unique_name = f"{uuid.uuid4().hex}.{ext}"
-        save_path = os.path.join('functions', secure_filename(unique_name))
-        file.save(save_path)
-
-        # Parse payload if present
-        try:
-            import json
-            payload_dict = json.loads(payload)
-        except Exception:
-            payload_dict = {}
+        filename = file.stream.commit(file.filename.rsplit('.', 1)[1].lower())
+        record, _ = function_registry.register(name, filename, runtime, file.stream.size)
+        payload_dict = blobs.offload(parse_upload_payload(payload))
 
         # Enqueue job with metadata
-        job = queue.enqueue(
+        job = queues[priority or 'default'].enqueue(
             run_job,
-            unique_name.rsplit('.', 1)[0],  # function_name (without extension)
+            name,
             payload_dict,
-            meta={'runtime': runtime, 'filename': unique_name, 'payload': payload_dict}
+            meta={'runtime': runtime, 'filename': filename, 'version': record['version']}
         )
-        logger.info(f"Uploaded and enqueued job {job.id} for file {unique_name} with runtime {runtime}")
-        return jsonify({'job_id': job.id, 'filename': unique_name})
+        record_enqueued(redis_conn, job)
+        logger.info(f"Uploaded and enqueued job {job.id} for {name} v{record['version']} ({filename}) with runtime {runtime}")
+        return jsonify({'job_id': job.id, 'filename': filename, 'function': name, 'version': record['version']})
 
     except Exception as e:
         logger.error(f"Error in /upload: {str(e)}")
         return jsonify({'error': str(e)}), 500
+    finally:
+        for file in files.values():
+            file.close()
+
+@app.route('/functions/<name>', methods=['PUT'])
+def put_function(name):
+    """
+    Register the request body as a new version of function name, e.g.
+    curl -T resize.py ".../functions/resize?runtime=pool". The body is
+    streamed to disk in chunks.
+    """
+    try:
+        runtime = request.args.get('runtime', 'python')
+        if runtime not in RUNTIMES:
+            return jsonify({'error': f'Invalid runtime {runtime}'}), 400
+        if not NAME_RE.fullmatch(name):
+            return jsonify({'error': f'Invalid function name {name}'}), 400
+        chunks = iter(lambda: request.stream.read(CHUNK_SIZE), b'')
+        filename, size = store_stream(chunks, runtime_extension(runtime))
+        if not size:
+            return jsonify({'error': 'Empty function body'}), 400
+        record, created = function_registry.register(name, filename, runtime, size)
+        logger.info(f"Registered {name} v{record['version']} ({filename})")
+        return jsonify({**record, 'created': created}), 201 if created else 200
+    except Exception as e:
+        logger.error(f"Error registering function {name}: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/functions/<name>', methods=['GET'])
+def get_function(name):
+    try:
+        versions = function_registry.versions(name)
+        if not versions:
+            return jsonify({'error': 'Function not found'}), 404
+        return jsonify({'function': name, 'versions': versions})
+    except Exception as e:
+        logger.error(f"Error getting function {name}: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/functions/<name>', methods=['DELETE'])
+def delete_function(name):
+    """Drop every version of a function; its artifacts are collected once unreferenced"""
+    try:
+        if not function_registry.remove(name):
+            return jsonify({'error': 'Function not found'}), 404
+        logger.info(f"Deleted function {name}")
+        return jsonify({'status': 'deleted'})
+    except Exception as e:
+        logger.error(f"Error deleting function {name}: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/functions/gc', methods=['POST'])
+def collect_functions():
+    """Delete unreferenced artifacts now rather than at the next scheduled collection"""
+    try:
+        removed, freed = collect_artifacts()
+        return jsonify({'removed': removed, 'freed_bytes': freed})
+    except Exception as e:
+        logger.error(f"Error collecting artifacts: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/metrics')
 def metrics():
+    """JSON, or the Prometheus text format for ?format=prometheus or an Accept of text/plain"""
     try:
-        queue_size = queue.count
-        active_workers = int(redis_conn.get("active_workers") or 0)
-        total_cost = float(redis_conn.get("total_cost") or 0.0)
-        return jsonify({
-            "queue_size": queue_size,
-            "active_workers": active_workers,
-            "total_cost": round(total_cost, 4)
-        })
+        if wants_prometheus(request.args.get('format'), request.headers.get('Accept', '')):
+            return Response(collect_metrics(prometheus=True), content_type=PROMETHEUS_CONTENT_TYPE)
+        return jsonify(collect_metrics())
     except Exception as e:
         logger.error(f"Error in /metrics: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/history')
+def get_history():
+    """
+    Cost and latency of archived jobs per function and day (or other
+    group_by fields) between ?from= and ?to= (YYYY-MM-DD, the last 7 days
+    by default), read from the Parquet archive
+    """
+    try:
+        try:
+            start, end, function, group_by = parse_history_params(request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        rows = query_history(start=start, end=end, function=function, group_by=group_by)
+        return jsonify({'from': start.isoformat(), 'to': end.isoformat(), 'group_by': list(group_by), 'rows': rows})
+    except Exception as e:
+        logger.error(f"Error in /history: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/logs/<job_id>')
+def get_job_log(job_id):
+    """
+    A job's stdout and stderr: the last ?tail= lines, or those after
+    ?after=<cursor>, as JSON with the cursor for the next call. With
+    ?follow=1, a Server-Sent Events stream of its lines until it ends.
+    """
+    try:
+        try:
+            after, tail, follow = parse_log_params(request.args, request.headers.get('Last-Event-ID'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        lines, cursor, end = read_job_log(redis_conn, job_id, after, tail)
+        if end is None:
+            # Jobs that never ran, such as canceled ones, have no end entry
+            status = redis_conn.hget(Job.key_for(job_id), 'status')
+            if status is None and not lines:
+                return jsonify({'error': 'Job not found'}), 404
+            end = job_end_status(status)
+        if not follow:
+            return jsonify({'job_id': job_id, 'lines': lines, 'cursor': cursor, 'end': end})
+    except Exception as e:
+        logger.error(f"Error reading log of job {job_id}: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+    def generate(lines, cursor, end):
+        yield format_log_lines(lines)
+        while end is None:
+            lines, cursor, end = follow_job_log(redis_conn, job_id, cursor, EVENTS_KEEPALIVE * 1000)
+            yield format_log_lines(lines)
+            if end is None and not lines:
+                end = job_end_status(redis_conn.hget(Job.key_for(job_id), 'status'))
+                if end is None:
+                    yield ': keepalive\n\n'
+        yield format_log_end(end)
+
+    return Response(stream_with_context(generate(lines, cursor, end)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/logs')
 def get_logs():
-    """Return the last 100 lines of the autoscaler log."""
+    """Return the last ?lines= (default 100) lines of the autoscaler log."""
     try:
-        log_path = os.path.join('logs', 'autoscaler.log')
-        if not os.path.exists(log_path):
-            return jsonify({"logs": ["No log file found."]})
-        with open(log_path, 'r') as f:
-            lines = f.readlines()
-        # Return the last 100 lines
-        return jsonify({"logs": lines[-100:]})
+        lines = min(max(request.args.get('lines', 100, type=int), 0), MAX_LOG_TAIL)
+        return jsonify({"logs": read_log_tail(lines)})
     except Exception as e:
         logger.error(f"Error reading logs: {str(e)}")
         return jsonify({"logs": [f"Error: {str(e)}"]})
 
 if __name__ == '__main__':
     logger.info("Starting Flask app")
+    latency_recorder.start()
+    start_scheduler()
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,252 @@
+import os
+import re
+import json
+import time
+import hashlib
+import tempfile
+
+ARTIFACTS_DIR = 'functions'
+VERSIONS_KEY = 'functions:versions:{name}'  # version -> JSON record
+CURRENT_KEY = 'functions:current'           # function name -> JSON record of its latest version
+REFS_KEY = 'functions:refs'                 # artifact filename -> number of versions using it
+RELEASED_KEY = 'functions:released'         # unreferenced artifacts scored by when they were released
+
+# Older versions beyond this many per function are dropped, releasing their artifacts
+KEEP_VERSIONS = int(os.environ.get('FUNCTION_KEEP_VERSIONS', 10))
+# Unreferenced artifacts are kept this long so queued jobs can still run them
+GC_GRACE = float(os.environ.get('ARTIFACT_GC_GRACE', 3600))
+CHUNK_SIZE = 64 * 1024
+
+NAME_RE = re.compile(r'[A-Za-z0-9_][A-Za-z0-9_.-]{0,127}')
+ARTIFACT_RE = re.compile(r'[0-9a-f]{64}\.(py|js)')
+UPLOAD_PREFIX = '.upload-'
+
+
+def runtime_extension(runtime):
+    return 'js' if runtime == 'node' else 'py'
+
+
+class ArtifactWriter:
+    """
+    Writable file that hashes uploaded bytes while spooling them to a
+    temporary file beside the artifacts, so an upload is never held in
+    memory. commit() moves it to its content address.
+    """
+
+    def __init__(self, directory=ARTIFACTS_DIR):
+        self.directory = directory
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._file = tempfile.NamedTemporaryFile(dir=directory, prefix=UPLOAD_PREFIX, suffix='.tmp', delete=False)
+
+    def write(self, data):
+        self._hash.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def seek(self, *args):
+        return self._file.seek(*args)
+
+    def commit(self, ext):
+        """
+        Store the upload as <sha256>.<ext>; returns the artifact filename.
+        Identical bytes stored before are kept and the upload is dropped.
+        """
+        self._file.close()
+        filename = f"{self._hash.hexdigest()}.{ext}"
+        path = os.path.join(self.directory, filename)
+        if os.path.exists(path):
+            os.remove(self._file.name)
+            # Restart the GC grace period until the new reference is registered
+            os.utime(path)
+        else:
+            os.replace(self._file.name, path)
+        return filename
+
+    def close(self):
+        """Drop the upload unless it was committed"""
+        self._file.close()
+        if os.path.exists(self._file.name):
+            os.remove(self._file.name)
+
+
+def store_stream(chunks, ext, directory=ARTIFACTS_DIR):
+    """Write an iterable of byte chunks to the artifact store; returns (filename, size)"""
+    writer = ArtifactWriter(directory)
+    try:
+        for chunk in chunks:
+            writer.write(chunk)
+        return writer.commit(ext), writer.size
+    finally:
+        writer.close()
+
+
+def artifact_meta(function_name, meta, record):
+    """
+    Job meta for running function_name: a registered function runs the
+    artifact of its record (and its runtime unless one was asked for).
+    Raises ValueError for a version that does not exist.
+    """
+    meta = dict(meta or {})
+    if record is None:
+        if meta.get('version') is not None:
+            raise ValueError(f"Function {function_name} has no version {meta['version']}")
+        return meta
+    meta.update(filename=record['filename'], version=record['version'])
+    meta.setdefault('runtime', record['runtime'])
+    return meta
+
+
+class FunctionRegistry:
+    """
+    Named, versioned functions whose code lives in a content-addressed
+    store: functions/<sha256>.<ext>. Identical uploads share one file,
+    and a new version is only created when a function's code changes.
+    Artifacts no version refers to are deleted by collect_garbage().
+    """
+
+    def __init__(self, redis_conn, directory=ARTIFACTS_DIR, keep_versions=KEEP_VERSIONS):
+        self.redis = redis_conn
+        self.directory = directory
+        self.keep_versions = keep_versions
+
+    def register(self, name, filename, runtime, size, now=None):
+        """
+        Make the artifact filename the latest version of name. Returns
+        (record, created); created is False if it already was.
+        """
+        now = time.time() if now is None else now
+        versions_key = VERSIONS_KEY.format(name=name)
+
+        def register_version(pipe):
+            raw = pipe.hget(CURRENT_KEY, name)
+            current = json.loads(raw) if raw else None
+            if current and current['filename'] == filename and current['runtime'] == runtime:
+                return current, False
+            record = {'name': name, 'version': current['version'] + 1 if current else 1,
+                      'filename': filename, 'runtime': runtime, 'size': size, 'created_at': now}
+            versions = {int(version): json.loads(raw) for version, raw in pipe.hgetall(versions_key).items()}
+            pruned = sorted(versions)[:max(0, len(versions) + 1 - self.keep_versions)]
+            deltas = {filename: 1}
+            for version in pruned:
+                released = versions[version]['filename']
+                deltas[released] = deltas.get(released, 0) - 1
+            refs = dict(zip(deltas, pipe.hmget(REFS_KEY, list(deltas))))
+
+            pipe.multi()
+            pipe.hset(versions_key, record['version'], json.dumps(record))
+            pipe.hset(CURRENT_KEY, name, json.dumps(record))
+            if pruned:
+                pipe.hdel(versions_key, *pruned)
+            self._apply_refs(pipe, refs, deltas, now)
+            return record, True
+
+        return self.redis.transaction(register_version, CURRENT_KEY, versions_key, REFS_KEY,
+                                      value_from_callable=True)
+
+    def _apply_refs(self, pipe, refs, deltas, now):
+        for filename, delta in deltas.items():
+            count = int(refs[filename] or 0) + delta
+            if count > 0:
+                pipe.hset(REFS_KEY, filename, count)
+                pipe.zrem(RELEASED_KEY, filename)
+            else:
+                pipe.hdel(REFS_KEY, filename)
+                pipe.zadd(RELEASED_KEY, {filename: now})
+
+    def remove(self, name, now=None):
+        """Drop every version of name; returns False if it is not registered"""
+        now = time.time() if now is None else now
+        versions_key = VERSIONS_KEY.format(name=name)
+
+        def remove_versions(pipe):
+            versions = [json.loads(raw) for raw in pipe.hvals(versions_key)]
+            if not versions:
+                return False
+            deltas = {}
+            for record in versions:
+                deltas[record['filename']] = deltas.get(record['filename'], 0) - 1
+            refs = dict(zip(deltas, pipe.hmget(REFS_KEY, list(deltas))))
+            pipe.multi()
+            pipe.delete(versions_key)
+            pipe.hdel(CURRENT_KEY, name)
+            self._apply_refs(pipe, refs, deltas, now)
+            return True
+
+        return self.redis.transaction(remove_versions, CURRENT_KEY, versions_key, REFS_KEY,
+                                      value_from_callable=True)
+
+    def resolve_many(self, requests):
+        """Records for (name, version or None for the latest) pairs; unknown ones are left out"""
+        requests = list(requests)
+        with self.redis.pipeline(transaction=False) as pipe:
+            for name, version in requests:
+                if version is None:
+                    pipe.hget(CURRENT_KEY, name)
+                else:
+                    pipe.hget(VERSIONS_KEY.format(name=name), version)
+            responses = pipe.execute()
+        return {request: json.loads(raw) for request, raw in zip(requests, responses) if raw}
+
+    def resolve(self, name, version=None):
+        return self.resolve_many([(name, version)]).get((name, version))
+
+    def versions(self, name):
+        """Every kept version of name, oldest first"""
+        records = [json.loads(raw) for raw in self.redis.hvals(VERSIONS_KEY.format(name=name))]
+        return sorted(records, key=lambda record: record['version'])
+
+    def collect_garbage(self, now=None, grace=GC_GRACE):
+        """
+        Delete artifacts no version refers to once they have been unreferenced
+        (or, if never registered, untouched) for grace seconds, along with
+        abandoned partial uploads. Returns (removed filenames, bytes freed).
+        """
+        now = time.time() if now is None else now
+        referenced = {filename.decode() for filename in self.redis.hkeys(REFS_KEY)}
+        released = {filename.decode(): score for filename, score in
+                    self.redis.zrange(RELEASED_KEY, 0, -1, withscores=True)}
+        removed, freed = [], 0
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith(UPLOAD_PREFIX):
+                idle_since = entry.stat().st_mtime
+            elif ARTIFACT_RE.fullmatch(entry.name) and entry.name not in referenced:
+                idle_since = max(entry.stat().st_mtime, released.get(entry.name, 0))
+            else:
+                continue
+            # A registration may have raced the scan above
+            if now - idle_since < grace or self.redis.hexists(REFS_KEY, entry.name):
+                continue
+            size = entry.stat().st_size
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                continue
+            removed.append(entry.name)
+            freed += size
+        stale = [filename for filename in released if filename in removed
+                 or not os.path.exists(os.path.join(self.directory, filename))]
+        if stale:
+            self.redis.zrem(RELEASED_KEY, *stale)
+        return removed, freed
+
+
+class AsyncFunctionRegistry:
+    """FunctionRegistry lookups for a redis.asyncio client"""
+
+    def __init__(self, redis_conn):
+        self.redis = redis_conn
+
+    async def resolve_many(self, requests):
+        requests = list(requests)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for name, version in requests:
+                if version is None:
+                    pipe.hget(CURRENT_KEY, name)
+                else:
+                    pipe.hget(VERSIONS_KEY.format(name=name), version)
+            responses = await pipe.execute()
+        return {request: json.loads(raw) for request, raw in zip(requests, responses) if raw}
+
+    async def resolve(self, name, version=None):
+        return (await self.resolve_many([(name, version)])).get((name, version))
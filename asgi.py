@@ -0,0 +1,886 @@
+import os
+import re
+import json
+import time
+import uuid
+import asyncio
+import logging
+import itertools
+from collections import Counter
+from contextlib import asynccontextmanager
+
+from redis.asyncio import BlockingConnectionPool, Redis as AsyncRedis
+from rq import Queue
+from rq.job import Job, JobStatus
+from rq.results import Result
+from starlette.applications import Starlette
+from starlette.responses import FileResponse, JSONResponse as BaseJSONResponse, Response, StreamingResponse
+from starlette.middleware import Middleware
+from starlette.routing import Route
+
+from api import (BATCH_CHUNK_SIZE, END_STATUSES, EVENTS_KEEPALIVE, LIVE_STATUSES, MAX_BATCH_SIZE, MAX_JOBS_PAGE,
+                 MAX_LOG_TAIL, MAX_STATUS_IDS, MAX_WAIT, RUNTIMES, check_upload, collect_artifacts,
+                 collect_metrics, describe_job, enqueue_map, enqueue_pipeline, event_response, fire_event,
+                 format_log_end, format_log_lines, function_registry, job_end_status, latency_recorder,
+                 map_admission, parse_encoded_job, parse_history_params, parse_job_request, parse_log_params,
+                 parse_map_request, parse_pipeline_request, parse_status_params, parse_trigger, parse_upload_payload,
+                 query_job_request, queues, read_log_tail, redis_conn, split_list, start_scheduler, store_trigger,
+                 trigger_store, upload_name, with_codec)
+from admission import AsyncAdmissionControl, api_key_of
+from artifacts import (CHUNK_SIZE, NAME_RE, ArtifactWriter, AsyncFunctionRegistry, artifact_meta,
+                       runtime_extension)
+from events import last_event_id_async, read_events_async
+import blobs
+from executor import run_job
+from job_index import INDEXED_FIELDS, query_jobs, record_enqueued
+from history import query_history
+from mapreduce import MAX_MAP_SIZE
+from joblogs import file_handler, follow_job_log_async, read_job_log_async
+from result_cache import AsyncResultCache, cache_key
+from serialization import JSON_CODEC, codec_for, get_codec, json_default
+from telemetry import API_METRIC, PROMETHEUS_CONTENT_TYPE, wants_prometheus
+
+# Same routes as app.py, served by uvicorn: `uvicorn asgi:app --port 5000`.
+# Submit, status, wait and events talk to Redis through one shared async
+# connection pool; the rarely hit routes reuse api.py's code in a thread.
+os.makedirs('logs', exist_ok=True)
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        # uvicorn --workers runs several of these processes
+        file_handler(f'logs/asgi-{os.getpid()}.log'),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+REDIS_MAX_CONNECTIONS = int(os.environ.get('ASGI_REDIS_MAX_CONNECTIONS', 100))
+# Fire cron triggers and archive job records from this process, for
+# deployments without the Flask server; only the lease holder does the work
+RUN_SCHEDULER = os.environ.get('ASGI_RUN_SCHEDULER') == '1'
+# Requests queue for a free connection instead of opening one each
+pool = BlockingConnectionPool(host='localhost', port=6379, max_connections=REDIS_MAX_CONNECTIONS)
+aredis = AsyncRedis(connection_pool=pool)
+result_cache = AsyncResultCache(aredis)
+registry = AsyncFunctionRegistry(aredis)
+admission = AsyncAdmissionControl(aredis)
+
+# Cap on events buffered for one /events client before it is dropped
+MAX_PENDING_EVENTS = 10000
+
+
+class JSONResponse(BaseJSONResponse):
+    """Starlette's JSONResponse, also serializing NumPy results of msgpack and Arrow jobs"""
+
+    def render(self, content):
+        return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(',', ':'),
+                          default=json_default).encode('utf-8')
+
+
+def request_codec(request):
+    return codec_for(request.headers.get('content-type', '').split(';')[0].strip())
+
+
+def refuse(decision):
+    body, status = decision.error()
+    return JSONResponse(body, status, headers=decision.headers())
+
+
+async def read_json(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+async def read_ndjson(request):
+    """Yield one decoded JSON document per non-empty line of the request body, as the body arrives"""
+    partial = b''
+    async for chunk in request.stream():
+        *lines, partial = (partial + chunk).split(b'\n')
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+    if partial.strip():
+        yield json.loads(partial)
+
+
+async def iterate(items):
+    for item in items:
+        yield item
+
+
+def job_data(function_name, payload, meta, job_id=None):
+    """Queue.prepare_data for a run_job call"""
+    return Queue.prepare_data(run_job, args=(function_name, payload), meta=meta, job_id=job_id)
+
+
+async def enqueue_jobs(entries):
+    """
+    Queue.enqueue_many for [(queue_name, job_data), ...] across queues,
+    with RQ's writes buffered on one async pipeline; returns the jobs
+    """
+    jobs = []
+    async with aredis.pipeline() as pipe:
+        for queue_name, group in itertools.groupby(entries, key=lambda entry: entry[0]):
+            jobs.extend(queues[queue_name].enqueue_many([data for _, data in group], pipeline=pipe))
+        for job in jobs:
+            record_enqueued(None, job, pipeline=pipe)
+        await pipe.execute()
+    return jobs
+
+
+async def enqueue_function(function_name, payload, meta, queue_name):
+    """api.enqueue_function on the async client; returns (job_id, deduplicated)"""
+    meta = meta or {}
+    meta = artifact_meta(function_name, meta, await registry.resolve(function_name, meta.get('version')))
+    payload = blobs.offload(payload, codec=get_codec(meta.get('codec')))
+    filename = meta.get('filename') or f"{function_name}.py"
+    cached = cache_key(os.path.join('functions', filename), meta.get('runtime') or 'python', payload)
+    if not cached:
+        job, = await enqueue_jobs([(queue_name, job_data(function_name, payload, meta))])
+        return job.id, False
+
+    key, ttl = cached
+    job_id = str(uuid.uuid4())
+    claim_ttl = ttl + Queue.DEFAULT_TIMEOUT
+    owner = await result_cache.claim(key, job_id, claim_ttl)
+    while owner is not None:
+        status = await aredis.hget(Job.key_for(owner), 'status')
+        if status is not None and status.decode() in LIVE_STATUSES:
+            await result_cache.record_coalesced()
+            return owner, True
+        owner = await result_cache.replace_claim(key, owner, job_id, claim_ttl)
+    await enqueue_jobs([(queue_name, job_data(function_name, payload, meta, job_id))])
+    return job_id, False
+
+
+async def fetch_jobs(job_ids):
+    """Job.fetch_many on the async client: one pipeline, None for unknown ids"""
+    async with aredis.pipeline(transaction=False) as pipe:
+        for job_id in job_ids:
+            pipe.hgetall(Job.key_for(job_id))
+        responses = await pipe.execute()
+    jobs = []
+    for job_id, data in zip(job_ids, responses):
+        job = None
+        if data:
+            job = Job(job_id, connection=redis_conn)
+            job.restore(data)
+        jobs.append(job)
+    return jobs
+
+
+async def fetch_outcomes(jobs):
+    """
+    (result, exc_info) of every job, with the latest Result of finished and
+    failed jobs read in one pipeline, for describe_job's outcome argument.
+    """
+    done = [job for job in jobs if job is not None
+            and job.get_status(refresh=False) in (JobStatus.FINISHED, JobStatus.FAILED)]
+    async with aredis.pipeline(transaction=False) as pipe:
+        for job in done:
+            pipe.xrevrange(Result.get_key(job.id), '+', '-', count=1)
+        responses = await pipe.execute()
+    # Jobs without a Result entry fall back to the fields restored from their hash
+    outcomes = {job.id: (job._result, job._exc_info) for job in jobs if job is not None}
+    for job, response in zip(done, responses):
+        if response:
+            result_id, payload = response[0]
+            result = Result.restore(job.id, result_id.decode(), payload,
+                                    connection=redis_conn, serializer=job.serializer)
+            outcomes[job.id] = (result.return_value, result.exc_string)
+    return outcomes
+
+
+class EventHub:
+    """
+    Tails the events stream with a single XREAD loop and hands each event
+    to the /wait and /events requests interested in it, so long-polls cost
+    a future or a queue each instead of a Redis connection.
+    """
+
+    def __init__(self, redis_conn):
+        self.redis = redis_conn
+        self.waiters = {}       # job id -> futures of /wait requests
+        self.streams = set()    # queues of /events clients
+
+    async def run(self):
+        last_id = await last_event_id_async(self.redis)
+        while True:
+            try:
+                events, last_id = await read_events_async(self.redis, last_id, EVENTS_KEEPALIVE * 1000, count=1000)
+            except Exception as e:
+                logger.error(f"Error reading events: {str(e)}")
+                await asyncio.sleep(1)
+                continue
+            for event_id, event in events:
+                for future in self.waiters.pop(event['job_id'], ()):
+                    if not future.done():
+                        future.set_result(event)
+                for stream in list(self.streams):
+                    try:
+                        stream.put_nowait((event_id, event))
+                    except asyncio.QueueFull:
+                        # The client drains what it has, then reconnects from its Last-Event-ID
+                        self.streams.discard(stream)
+
+    def watch(self, job_id):
+        """Future resolved with the next event for job_id"""
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.setdefault(job_id, set()).add(future)
+        return future
+
+    def unwatch(self, job_id, future):
+        futures = self.waiters.get(job_id)
+        if futures is not None:
+            futures.discard(future)
+            if not futures:
+                del self.waiters[job_id]
+
+    def subscribe(self):
+        stream = asyncio.Queue(MAX_PENDING_EVENTS)
+        self.streams.add(stream)
+        return stream
+
+
+hub = EventHub(aredis)
+
+
+class LatencyMiddleware:
+    """Records each request's latency, to its response headers, under its endpoint and method"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+
+        async def timed_send(message):
+            endpoint = scope.get('endpoint')
+            if message['type'] == 'http.response.start' and endpoint is not None:
+                latency_recorder.observe(API_METRIC, (endpoint.__name__, scope['method']),
+                                         time.perf_counter() - start)
+            await send(message)
+
+        await self.app(scope, receive, timed_send)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Queue.enqueue_many reads the server version once per queue on the sync client
+    await asyncio.gather(*(asyncio.to_thread(queue.get_redis_server_version) for queue in queues.values()))
+    latency_recorder.start()
+    if RUN_SCHEDULER:
+        start_scheduler()
+    task = asyncio.create_task(hub.run())
+    yield
+    task.cancel()
+    await aredis.aclose()
+
+
+async def submit_job(request):
+    """/submit: a JSON request, or a msgpack or Arrow payload with query parameters"""
+    try:
+        codec = request_codec(request)
+        try:
+            if codec is None or codec is JSON_CODEC:
+                function_name, payload, meta, queue_name = parse_job_request(await read_json(request))
+            else:
+                # Decoding and offloading a large body would stall the event loop
+                function_name, payload, meta, queue_name = await asyncio.to_thread(
+                    parse_encoded_job, request.query_params, await request.body(), codec)
+            decision = await admission.check({function_name: 1}, {queue_name: 1}, api_key_of(request.headers))
+            if not decision.admitted:
+                return refuse(decision)
+            job_id, deduplicated = await enqueue_function(function_name, payload, meta, queue_name)
+        except ValueError as e:
+            return JSONResponse({'error': str(e)}, 400)
+        if deduplicated:
+            logger.info(f"Submission for function {function_name} coalesced onto job {job_id}")
+            return JSONResponse({'job_id': job_id, 'deduplicated': True}, headers=decision.headers())
+        logger.info(f"Job {job_id} submitted for function {function_name}")
+        return JSONResponse({'job_id': job_id}, headers=decision.headers())
+    except Exception as e:
+        logger.error(f"Error submitting job: {str(e)}")
+        return JSONResponse({'error': str(e)}, 500)
+
+
+async def resolve_entries(entries):
+    """api.resolve_entries on the async client"""
+    requests = {(entry[0], (entry[2] or {}).get('version')) for entry in entries}
+    records = await registry.resolve_many(requests)
+    return [(function_name, payload,
+             artifact_meta(function_name, meta, records.get((function_name, (meta or {}).get('version')))),
+             queue_name)
+            for function_name, payload, meta, queue_name in entries]
+
+
+async def submit_batch(request):
+    """/submit/batch: a JSON or msgpack list (or {"jobs": [...]}) or an application/x-ndjson body"""
+    try:
+        codec = request_codec(request)
+        if request.headers.get('content-type', '').startswith('application/x-ndjson'):
+            docs = read_ndjson(request)
+        else:
+            if codec is None or codec is JSON_CODEC:
+                data = await read_json(request)
+            else:
+                try:
+                    data = codec.decode(await request.body())
+                except ValueError as e:
+                    return JSONResponse({'error': str(e)}, 400)
+            docs = data.get('jobs') if isinstance(data, dict) else data
+            if not isinstance(docs, list):
+                return JSONResponse({'error': 'expected a list of jobs'}, 400)
+            docs = iterate(docs)
+
+        entries = []
+        try:
+            async for doc in docs:
+                if len(entries) >= MAX_BATCH_SIZE:
+                    return JSONResponse({'error': f'batch exceeds {MAX_BATCH_SIZE} jobs'}, 413)
+                entries.append(with_codec(parse_job_request(doc), codec))
+        except ValueError as e:
+            return JSONResponse({'error': f'job {len(entries)}: {e}'}, 400)
+        try:
+            entries = await resolve_entries(entries)
+        except ValueError as e:
+            return JSONResponse({'error': str(e)}, 400)
+        decision = await admission.check(Counter(entry[0] for entry in entries),
+                                         Counter(entry[3] for entry in entries), api_key_of(request.headers))
+        if not decision.admitted:
+            return refuse(decision)
+
+        job_ids = []
+        for start in range(0, len(entries), BATCH_CHUNK_SIZE):
+            jobs = await enqueue_jobs([
+                (queue_name, job_data(function_name, blobs.offload(payload, codec=get_codec((meta or {}).get('codec'))),
+                                      meta))
+                for function_name, payload, meta, queue_name in entries[start:start + BATCH_CHUNK_SIZE]])
+            job_ids.extend(job.id for job in jobs)
+        logger.info(f"Batch of {len(job_ids)} jobs submitted")
+        return JSONResponse({'job_ids': job_ids}, headers=decision.headers())
+    except Exception as e:
+        logger.error(f"Error submitting batch: {str(e)}")
+        return JSONResponse({'error': str(e)}, 500)
+
+
+async def submit_blob(request):
+    """Run a function on a binary payload streamed into the blob store, as /submit/blob in app.py"""
+    try:
+        try:
+            function_name, _, meta, queue_name = query_job_request(request.query_params)
+            meta = artifact_meta(function_name, meta,
+                                 await registry.resolve(function_name, (meta or {}).get('version')))
+        except ValueError as e:
+            return JSONResponse({'error': str(e)}, 400)
+        decision = await admission.check({function_name: 1}, {queue_name: 1}, api_key_of(request.headers))
+        if not decision.admitted:
+            return refuse(decision)
+        writer = ArtifactWriter(blobs.BLOB_DIR)
+        try:
+            async for chunk in request.stream():
+                writer.write(chunk)
+            key = writer.commit(blobs.EXTENSIONS[blobs.BINARY])
+        finally:
+            writer.close()
+        payload = {blobs.REF_KEY: key, 'size': writer.size, 'content_type': blobs.BINARY}
+        job, = await enqueue_jobs([(queue_name, job_data(function_name, payload, meta))])
+        logger.info(f"Job {job.id} submitted for function {function_name} with a {payload['size']} byte blob")
+        return JSONResponse({'job_id': job.id, 'payload': payload}, headers=decision.headers())
+    except Exception as e:
+        logger.error(f"Error submitting blob job: {str(e)}")
+        return JSONResponse({'error': str(e)}, 500)
+
+
+async def submit_map(request):
+    """/map: a JSON, msgpack or application/x-ndjson map request, as in app.py"""
+    try:
+        codec = request_codec(request)
+        try:
+            if request.headers.get('content-type', '').startswith('application/x-ndjson'):
+                docs = read_ndjson(request)
+                data = await anext(docs, None)
+                if isinstance(data, dict):
+                    payloads = []
+                    async for payload in docs:
+                        payloads.append(payload)
+                        # One past the limit is enough to reject the map
+                        if len(payloads) > MAX_MAP_SIZE:
+                            break
+                    data = dict(data, payloads=payloads)
+            elif codec is None or codec is JSON_CODEC:
+                data = await read_json(request)
+            else:
+                data = codec.decode(await request.body())
+            function_name, payloads, meta, queue_name, chunk_size = parse_map_request(data)
+            if len(payloads) > MAX_MAP_SIZE:
+                return JSONResponse({'error': f'map exceeds {MAX_MAP_SIZE} payloads'}, 413)
+            if codec is not None and codec is not JSON_CODEC:
+                meta = dict(meta or {}, codec=codec.name)
+            decision = await admission.check(*map_admission(function_name, payloads, queue_name, chunk_size),
+                                             api_key_of(request.headers))
+            if not decision.admitted:
+                return refuse(decision)
+            # Offloading chunks and queueing them is blocking and proportional to the map
+            map_id, chunks = await asyncio.to_thread(enqueue_map, function_name, payloads, meta,
+                                                     queue_name, chunk_size)
+        except ValueError as e:
+            return JSONResponse({'error': str(e)}, 400)
+        logger.info(f"Map {map_id} submitted: {function_name} over {len(payloads)} payloads in {chunks} chunks")
+        return JSONResponse({'job_id': map_id, 'items': len(payloads), 'chunks': chunks}, headers=decision.headers())
+    except Exception as e:
+        logger.error(f"Error submitting map: {str(e)}")
+        return JSONResponse({'error': str(e)}, 500)
+
+
+
+async def submit_pipeline(request):
+    """/pipeline, as in app.py; queueing units one by one is blocking, so it runs in a thread"""
+    try:
+        data = await read_json(request)
+        try:
+            stages = parse_pipeline_request(data)
+            decision = await admission.check(Counter(stage['function'] for stage in stages),
+                                             Counter(stage['queue_name'] for stage in stages),
+                                             api_key_of(request.headers))
+            if not decision.admitted:
+                return refuse(decision)
+            pipeline_id, job_ids = await asyncio.to_thread(enqueue_pipeline, stages)
+        except ValueError as e:
+            return JSONResponse({'error': str(e)}, 400)
+        logger.info(f"Pipeline {pipeline_id} submitted: {len(stages)} stages in {len(set(job_ids.values()))} jobs")
+        return JSONResponse({'pipeline_id': pipeline_id, 'jobs': job_ids}, headers=decision.headers())
+    except Exception as e:
+        logger.error(f"Error submitting pipeline: {str(e)}")
+        return JSONResponse({'error': str(e)}, 500)
+
+async def get_status(request):
+    job_id = request.path_params['job_id']
+    try:
+        job, = await fetch_jobs([job_id])
+        if job is None:
+            return JSONResponse({'error': 'Job not found'}, 404)
+        outcomes = await fetch_outcomes([job])
+        return JSONResponse(describe_job(job, outcome=outcomes[job.id]))
+    except Exception as e:
+        logger.error(f"Error getting status for job {job_id}: {str(e)}")
+        return JSONResponse({'error': 'Job not found'}, 404)
+
+
+async def get_statuses(request):
+    """Bulk status lookup, as /status in app.py"""
+    try:
+        params = await read_json(request) if request.method == 'POST' else dict(request.query_params)
+        try:
+            job_ids, fields, max_result_bytes = parse_status_params(params)
+        except ValueError as e:
+            return JSONResponse({'error': str(e)}, 400)
+        if len(job_ids) > MAX_STATUS_IDS:
+            return JSONResponse({'error': f'at most {MAX_STATUS_IDS} ids per request'}, 413)
+
+        jobs = await fetch_jobs(job_ids)
+        outcomes = {}
+        if fields is None or {'result', 'error'} & set(fields):
+            outcomes = await fetch_outcomes(jobs)
+        return JSONResponse({'jobs': [
+            describe_job(job, fields, max_result_bytes, outcomes.get(job.id, (None, None)))
+            if job is not None else {'job_id': job_id, 'error': 'Job not found'}
+            for job_id, job in zip(job_ids, jobs)
+        ]})
+    except Exception as e:
+        logger.error(f"Error getting statuses: {str(e)}")
+        return JSONResponse({'error': str(e)}, 500)
+
+
+async def wait_for_job(request):
+    """Long-poll until the job finishes or fails, as /wait/<job_id> in app.py"""
+    job_id = request.path_params['job_id']
+    try:
+        try:
+            timeout = min(float(request.query_params.get('timeout', 30)), MAX_WAIT)
+        except ValueError:
+            return JSONResponse({'error': 'timeout must be a number'}, 400)
+        # Watch before reading the status so an event published meanwhile isn't missed
+        future = hub.watch(job_id)
+        try:
+            deadline = time.time() + timeout
+            job, = await fetch_jobs([job_id])
+            if job is None:
+                return JSONResponse({'error': 'Job not found'}, 404)
+            while job.get_status(refresh=False) not in END_STATUSES:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return JSONResponse({'job_id': job_id, 'status': job.get_status(refresh=False)}, 202)
+                try:
+                    await asyncio.wait_for(asyncio.shield(future), remaining)
+                except asyncio.TimeoutError:
+                    continue
+                future = hub.watch(job_id)
+                job, = await fetch_jobs([job_id])
+                if job is None:
+                    return JSONResponse({'error': 'Job not found'}, 404)
+        finally:
+            hub.unwatch(job_id, future)
+        outcomes = await fetch_outcomes([job])
+        return JSONResponse(describe_job(job, outcome=outcomes[job.id]))
+    except Exception as e:
+        logger.error(f"Error waiting for job {job_id}: {str(e)}")
+        return JSONResponse({'error': str(e)}, 500)
+
+
+async def download_result(request):
+    """A finished job's result, streamed from the blob store if it was offloaded, as /result in app.py"""
+    job_id = request.path_params['job_id']
+    try:
+        job, = await fetch_jobs([job_id])
+        if job is None:
+            return JSONResponse({'error': 'Job not found'}, 404)
+        status = job.get_status(refresh=False)
+        if status != JobStatus.FINISHED:
+            return JSONResponse({'job_id': job_id, 'status': status, 'error': 'Job has no result'}, 409)
+        result, _ = (await fetch_outcomes([job]))[job.id]
+        if not blobs.is_ref(result):
+            codec = get_codec(job.meta.get('codec'))
+            if codec is JSON_CODEC:
+                return JSONResponse(result)
+            return Response(codec.encode(result), media_type=codec.content_type)
+        path = blobs.blob_path(result)
+        if not os.path.exists(path):
+            return JSONResponse({'error': 'Result has expired from the blob store'}, 410)
+        return FileResponse(path, media_type=result['content_type'],
+                            filename=f"{job_id}.{blobs.EXTENSIONS[result['content_type']]}")
+    except Exception as e:
+        logger.error(f"Error downloading result for job {job_id}: {str(e)}")
+        return JSONResponse({'error': str(e)}, 500)
+
+
+def _stream_position(event_id):
+    milliseconds, _, sequence = event_id.partition('-')
+    return int(milliseconds), int(sequence or 0)
+
+
+async def stream_events(request):
+    """Server-Sent Events stream of job completions, as /events in app.py"""
+    job_ids = set(split_list(request.query_params.get('job_ids')) or [])
+    function_name = request.query_params.get('function')
+    last_id = request.headers.get('Last-Event-ID') or request.query_params.get('last_event_id')
+    if not last_id or not re.fullmatch(r'\d+(-\d+)?', last_id):
+        last_id = None
+
+    def format_event(event_id, event):
+        if job_ids and event['job_id'] not in job_ids:
+            return None
+        if function_name and event['function'] != function_name:
+            return None
+        return f"id: {event_id}\nevent: {event['status']}\ndata: {json.dumps(event)}\n\n"
+
+    async def generate(stream, last_id):
+        try:
+            # Replay what the client missed; the hub may deliver some of it again
+            position = (0, 0)
+            while last_id is not None:
+                events, next_id = await read_events_async(aredis, last_id, 1, count=1000)
+                if not events:
+                    break
+                for event_id, event in events:
+                    message = format_event(event_id, event)
+                    if message:
+                        yield message
+                last_id, position = next_id, _stream_position(next_id)
+            while True:
+                try:
+                    event_id, event = await asyncio.wait_for(stream.get(), EVENTS_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    if stream not in hub.streams:
+                        return
+                    yield ': keepalive\n\n'
+                    continue
+                if _stream_position(event_id) <= position:
+                    continue
+                message = format_event(event_id, event)
+                if message:
+                    yield message
+        finally:
+            hub.streams.discard(stream)
+
+    return StreamingResponse(generate(hub.subscribe(), last_id), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+async def list_jobs(request):
+    try:
+        params = request.query_params
+        filters = {field: params.get(field) for field in INDEXED_FIELDS}
+        try:
+            limit = min(int(params.get('limit', 50)), MAX_JOBS_PAGE)
+            if limit < 1:
+                raise ValueError
+        except ValueError:
+            return JSONResponse({'error': 'limit must be a positive integer'}, 400)
+        try:
+            jobs, next_cursor = await asyncio.to_thread(query_jobs, redis_conn, filters, params.get('cursor'), limit)
+        except ValueError:
+            return JSONResponse({'error': 'Invalid cursor'}, 400)
+        return JSONResponse({'jobs': jobs, 'next_cursor': next_cursor})
+    except Exception as e:
+        logger.error(f"Error listing jobs: {str(e)}")
+        return JSONResponse({'error': str(e)}, 500)
+
+
+async def register_trigger(request):
+    try:
+        try:
+            trig = parse_trigger(await read_json(request))
+        except ValueError as e:
+            return JSONResponse({'error': str(e)}, 400)
+        return JSONResponse(await asyncio.to_thread(store_trigger, trig))
+    except Exception as e:
+        logger.error(f"Error registering trigger: {str(e)}")
+        return JSONResponse({'error': str(e)}, 500)
+
+
+async def get_trigger(request):
+    trigger_id = request.path_params['trigger_id']
+    try:
+        trig = await asyncio.to_thread(trigger_store.get, trigger_id)
+        if trig is None:
+            return JSONResponse({'error': 'Trigger not found'}, 404)
+        if trig['type'] == 'cron':
+            trig['next_fire'] = await asyncio.to_thread(trigger_store.next_fire, trigger_id)
+        return JSONResponse(trig)
+    except Exception as e:
+        logger.error(f"Error getting trigger {trigger_id}: {str(e)}")
+        return JSONResponse({'error': str(e)}, 500)
+
+
+async def delete_trigger(request):
+    trigger_id = request.path_params['trigger_id']
+    try:
+        if not await asyncio.to_thread(trigger_store.remove, trigger_id):
+            return JSONResponse({'error': 'Trigger not found'}, 404)
+        logger.info(f"Deleted trigger {trigger_id}")
+        return JSONResponse({'status': 'deleted'})
+    except Exception as e:
+        logger.error(f"Error deleting trigger: {str(e)}")
+        return JSONResponse({'error': str(e)}, 500)
+
+
+async def receive_event(request):
+    try:
+        data = await read_json(request)
+        fired, refused = await asyncio.to_thread(fire_event, data.get('event_type'), api_key_of(request.headers))
+        body, status, headers = event_response(fired, refused)
+        return JSONResponse(body, status, headers=headers)
+    except Exception as e:
+        logger.error(f"Error processing event: {str(e)}")
+        return JSONResponse({'error': str(e)}, 500)
+
+
+def store_upload(source, ext):
+    """Copy an uploaded file into the artifact store chunk by chunk; returns (filename, size)"""
+    writer = ArtifactWriter()
+    try:
+        for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+            writer.write(chunk)
+        return writer.commit(ext), writer.size
+    finally:
+        writer.close()
+
+
+async def upload_function(request):
+    """Upload a function file and run it, as /upload in app.py"""
+    try:
+        form = await request.form()
+        file = form.get('file')
+        runtime = form.get('runtime')
+        payload = form.get('payload', '{}')
+        priority = form.get('priority')
+
+        if file is None or isinstance(file, str):
+            return JSONResponse({'error': 'No file part'}, 400)
+        if not file.filename:
+            return JSONResponse({'error': 'No selected file'}, 400)
+        name = upload_name(file.filename, form.get('name'))
+        error = check_upload(file.filename, runtime, priority, name)
+        if error:
+            return JSONResponse({'error': error}, 400)
+
+        # Starlette has already spooled the file (to disk past 1 MB); copy it over in chunks
+        filename, size = await asyncio.to_thread(store_upload, file.file, file.filename.rsplit('.', 1)[1].lower())
+        record, _ = await asyncio.to_thread(function_registry.register, name, filename, runtime, size)
+        payload_dict = blobs.offload(parse_upload_payload(payload))
+
+        meta = {'runtime': runtime, 'filename': filename, 'version': record['version']}
+        job, = await enqueue_jobs([(priority or 'default', job_data(name, payload_dict, meta))])
+        logger.info(f"Uploaded and enqueued job {job.id} for {name} v{record['version']} ({filename}) with runtime {runtime}")
+        return JSONResponse({'job_id': job.id, 'filename': filename, 'function': name, 'version': record['version']})
+    except Exception as e:
+        logger.error(f"Error in /upload: {str(e)}")
+        return JSONResponse({'error': str(e)}, 500)
+
+
+async def put_function(request):
+    """Register the request body as a new version of a function, streamed to disk in chunks"""
+    name = request.path_params['name']
+    try:
+        runtime = request.query_params.get('runtime', 'python')
+        if runtime not in RUNTIMES:
+            return JSONResponse({'error': f'Invalid runtime {runtime}'}, 400)
+        if not NAME_RE.fullmatch(name):
+            return JSONResponse({'error': f'Invalid function name {name}'}, 400)
+        writer = ArtifactWriter()
+        try:
+            async for chunk in request.stream():
+                writer.write(chunk)
+            filename, size = writer.commit(runtime_extension(runtime)), writer.size
+        finally:
+            writer.close()
+        if not size:
+            return JSONResponse({'error': 'Empty function body'}, 400)
+        record, created = await asyncio.to_thread(function_registry.register, name, filename, runtime, size)
+        logger.info(f"Registered {name} v{record['version']} ({filename})")
+        return JSONResponse({**record, 'created': created}, 201 if created else 200)
+    except Exception as e:
+        logger.error(f"Error registering function {name}: {str(e)}")
+        return JSONResponse({'error': str(e)}, 500)
+
+
+async def get_function(request):
+    name = request.path_params['name']
+    try:
+        versions = await asyncio.to_thread(function_registry.versions, name)
+        if not versions:
+            return JSONResponse({'error': 'Function not found'}, 404)
+        return JSONResponse({'function': name, 'versions': versions})
+    except Exception as e:
+        logger.error(f"Error getting function {name}: {str(e)}")
+        return JSONResponse({'error': str(e)}, 500)
+
+
+async def delete_function(request):
+    name = request.path_params['name']
+    try:
+        if not await asyncio.to_thread(function_registry.remove, name):
+            return JSONResponse({'error': 'Function not found'}, 404)
+        logger.info(f"Deleted function {name}")
+        return JSONResponse({'status': 'deleted'})
+    except Exception as e:
+        logger.error(f"Error deleting function {name}: {str(e)}")
+        return JSONResponse({'error': str(e)}, 500)
+
+
+async def collect_functions(request):
+    try:
+        removed, freed = await asyncio.to_thread(collect_artifacts)
+        return JSONResponse({'removed': removed, 'freed_bytes': freed})
+    except Exception as e:
+        logger.error(f"Error collecting artifacts: {str(e)}")
+        return JSONResponse({'error': str(e)}, 500)
+
+
+async def metrics(request):
+    """JSON, or the Prometheus text format for ?format=prometheus or an Accept of text/plain"""
+    try:
+        if wants_prometheus(request.query_params.get('format'), request.headers.get('accept', '')):
+            return Response(await asyncio.to_thread(collect_metrics, True), media_type=PROMETHEUS_CONTENT_TYPE)
+        return JSONResponse(await asyncio.to_thread(collect_metrics))
+    except Exception as e:
+        logger.error(f"Error in /metrics: {str(e)}")
+        return JSONResponse({"error": str(e)}, 500)
+
+
+async def get_history(request):
+    """/history: aggregates over the Parquet archive, read in a thread"""
+    try:
+        try:
+            start, end, function, group_by = parse_history_params(request.query_params)
+        except ValueError as e:
+            return JSONResponse({'error': str(e)}, 400)
+        rows = await asyncio.to_thread(query_history, start=start, end=end, function=function, group_by=group_by)
+        return JSONResponse({'from': start.isoformat(), 'to': end.isoformat(), 'group_by': list(group_by),
+                             'rows': rows})
+    except Exception as e:
+        logger.error(f"Error in /history: {str(e)}")
+        return JSONResponse({'error': str(e)}, 500)
+
+
+async def get_job_log(request):
+    """A job's stdout and stderr, as /logs/<job_id> in app.py"""
+    job_id = request.path_params['job_id']
+    try:
+        try:
+            after, tail, follow = parse_log_params(request.query_params, request.headers.get('Last-Event-ID'))
+        except ValueError as e:
+            return JSONResponse({'error': str(e)}, 400)
+        lines, cursor, end = await read_job_log_async(aredis, job_id, after, tail)
+        if end is None:
+            # Jobs that never ran, such as canceled ones, have no end entry
+            status = await aredis.hget(Job.key_for(job_id), 'status')
+            if status is None and not lines:
+                return JSONResponse({'error': 'Job not found'}, 404)
+            end = job_end_status(status)
+        if not follow:
+            return JSONResponse({'job_id': job_id, 'lines': lines, 'cursor': cursor, 'end': end})
+    except Exception as e:
+        logger.error(f"Error reading log of job {job_id}: {str(e)}")
+        return JSONResponse({'error': str(e)}, 500)
+
+    async def generate(lines, cursor, end):
+        yield format_log_lines(lines)
+        while end is None:
+            lines, cursor, end = await follow_job_log_async(aredis, job_id, cursor, EVENTS_KEEPALIVE * 1000)
+            yield format_log_lines(lines)
+            if end is None and not lines:
+                end = job_end_status(await aredis.hget(Job.key_for(job_id), 'status'))
+                if end is None:
+                    yield ': keepalive\n\n'
+        yield format_log_end(end)
+
+    return StreamingResponse(generate(lines, cursor, end), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+async def get_logs(request):
+    """Return the last ?lines= (default 100) lines of the autoscaler log."""
+    try:
+        try:
+            lines = min(max(int(request.query_params.get('lines', 100)), 0), MAX_LOG_TAIL)
+        except ValueError:
+            lines = 100
+        return JSONResponse({"logs": await asyncio.to_thread(read_log_tail, lines)})
+    except Exception as e:
+        logger.error(f"Error reading logs: {str(e)}")
+        return JSONResponse({"logs": [f"Error: {str(e)}"]})
+
+
+app = Starlette(routes=[
+    Route('/submit', submit_job, methods=['POST']),
+    Route('/submit/batch', submit_batch, methods=['POST']),
+    Route('/submit/blob', submit_blob, methods=['POST']),
+    Route('/map', submit_map, methods=['POST']),
+    Route('/pipeline', submit_pipeline, methods=['POST']),
+    Route('/trigger', register_trigger, methods=['POST']),
+    Route('/trigger/{trigger_id}', get_trigger, methods=['GET']),
+    Route('/trigger/{trigger_id}', delete_trigger, methods=['DELETE']),
+    Route('/event', receive_event, methods=['POST']),
+    Route('/status/{job_id}', get_status),
+    Route('/status', get_statuses, methods=['GET', 'POST']),
+    Route('/wait/{job_id}', wait_for_job),
+    Route('/result/{job_id}', download_result),
+    Route('/events', stream_events),
+    Route('/jobs', list_jobs),
+    Route('/upload', upload_function, methods=['POST']),
+    Route('/functions/gc', collect_functions, methods=['POST']),
+    Route('/functions/{name}', put_function, methods=['PUT']),
+    Route('/functions/{name}', get_function, methods=['GET']),
+    Route('/functions/{name}', delete_function, methods=['DELETE']),
+    Route('/metrics', metrics),
+    Route('/history', get_history),
+    Route('/logs/{job_id}', get_job_log),
+    Route('/logs', get_logs),
+], middleware=[Middleware(LatencyMiddleware)], lifespan=lifespan)
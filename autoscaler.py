@@ -1,10 +1,15 @@
 import os
+import math
 import time
 import signal
 import logging
 import subprocess
 from redis import Redis
 from rq import Queue
+from scaling import POLICIES, observe
+from queues import QUEUE_NAMES, parse_weights
+from joblogs import file_handler
+from telemetry import queue_capacity
 
 # Setup logging
 os.makedirs('logs', exist_ok=True)
@@ -12,27 +17,99 @@ logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     handlers=[
-        logging.FileHandler('logs/autoscaler.log'),
+        file_handler('logs/autoscaler.log'),
         logging.StreamHandler()
     ]
 )
 logger = logging.getLogger(__name__)
 
+
+def queue_limits(spec):
+    """Parse 'high:1,default:2' into {'high': 1, 'default': 2}"""
+    return {name: int(limit) for name, limit in parse_weights(spec).items()}
+
+
 class Autoscaler:
-    def __init__(self):
-        self.redis_conn = Redis(host='localhost', port=6379)
-        self.queue = Queue('default', connection=self.redis_conn)
+    """
+    Scales a separate pool of workers for each queue. min_workers and
+    max_workers bound the whole fleet, as they did with a single pool;
+    queue_min_workers and queue_max_workers bound each queue's pool. The
+    fleet floor is held by the 'default' queue unless queue floors are
+    given, and when the queues together want more than max_workers the
+    higher-priority queues (first in queue_names) are served first.
+    Cooldowns apply per queue, and each queue has its own policy instance.
+    Policies ask for job slots; workers with WORKER_SLOTS > 1 run that many
+    jobs at once, so the slots are divided by the slots per worker that
+    the queue's workers report in their heartbeats.
+    """
+
+    def __init__(self, redis_conn=None, policy_class=None, queue_names=None, min_workers=None,
+                 max_workers=None, queue_min_workers=None, queue_max_workers=None, scale_up_cooldown=None,
+                 scale_down_cooldown=None, interval=None, worker_slots=None, worker_class=None, clock=time.time):
+        self.redis_conn = redis_conn or Redis(host='localhost', port=6379)
+        env = os.environ
+        if queue_names is None:
+            queue_names = env.get('AUTOSCALER_QUEUES', ','.join(QUEUE_NAMES)).split(',')
+        self.queues = {name: Queue(name, connection=self.redis_conn) for name in queue_names}
         self.cloud_providers = ['aws', 'gcp']
         self.worker_counter = {'aws': 0, 'gcp': 0}
         self.workers = []
         self.running = True
-        
-    def get_desired_workers(self, queue_size):
-        """Calculate desired number of workers based on queue size"""
-        return min(5, max(1, queue_size // 10 + 1))
-    
-    def spawn_worker(self):
-        """Spawn a new worker process with cloud provider tag"""
+        policy_class = policy_class or POLICIES[env.get('AUTOSCALER_POLICY', 'littles_law')]
+        self.policies = {name: policy_class() for name in self.queues}
+        self.min_workers = min_workers if min_workers is not None else int(env.get('AUTOSCALER_MIN_WORKERS', 1))
+        self.max_workers = max_workers if max_workers is not None else int(env.get('AUTOSCALER_MAX_WORKERS', 5))
+        if queue_min_workers is None and env.get('AUTOSCALER_QUEUE_MIN_WORKERS'):
+            queue_min_workers = queue_limits(env['AUTOSCALER_QUEUE_MIN_WORKERS'])
+        if queue_min_workers is None:
+            floor_queue = 'default' if 'default' in self.queues else next(iter(self.queues))
+            queue_min_workers = {floor_queue: self.min_workers}
+        self.queue_min_workers = {name: queue_min_workers.get(name, 0) for name in self.queues}
+        if queue_max_workers is None and env.get('AUTOSCALER_QUEUE_MAX_WORKERS'):
+            queue_max_workers = queue_limits(env['AUTOSCALER_QUEUE_MAX_WORKERS'])
+        self.queue_max_workers = {name: (queue_max_workers or {}).get(name, self.max_workers) for name in self.queues}
+        self.scale_up_cooldown = (scale_up_cooldown if scale_up_cooldown is not None
+                                  else float(env.get('AUTOSCALER_SCALE_UP_COOLDOWN', 0)))
+        self.scale_down_cooldown = (scale_down_cooldown if scale_down_cooldown is not None
+                                    else float(env.get('AUTOSCALER_SCALE_DOWN_COOLDOWN', 10)))
+        self.interval = interval if interval is not None else float(env.get('AUTOSCALER_INTERVAL', 5))
+        # Slots of the workers this process spawns (passed on in their environment)
+        self.worker_slots = worker_slots if worker_slots is not None else int(env.get('WORKER_SLOTS', 1))
+        # 'simple' keeps each worker's warm pool and module cache across jobs; 'fork' isolates jobs
+        self.worker_class = worker_class or env.get('WORKER_CLASS', 'simple')
+        self.clock = clock
+        self.last_scale_up = {name: float('-inf') for name in self.queues}
+        self.last_scale_down = {name: float('-inf') for name in self.queues}
+
+    def slots_per_worker(self, queue_name):
+        """Mean slots of the queue's live workers, or this autoscaler's WORKER_SLOTS before any report"""
+        workers, slots = queue_capacity(self.redis_conn, queue_name)
+        return slots / workers if workers else self.worker_slots
+
+    def get_desired_workers(self, queue_name, observation):
+        """Workers to provide the slots a queue's policy asks for, clamped to the queue's min/max"""
+        desired_slots = self.policies[queue_name].desired_workers(observation)
+        desired = math.ceil(desired_slots / self.slots_per_worker(queue_name))
+        return min(self.queue_max_workers[queue_name], max(self.queue_min_workers[queue_name], desired))
+
+    def allocate(self, desired):
+        """
+        Trim {queue: desired workers} to max_workers in total: every queue
+        keeps its floor, then the rest goes to queues in priority order
+        """
+        allocated = {name: min(desired[name], self.queue_min_workers[name]) for name in desired}
+        budget = self.max_workers - sum(allocated.values())
+        for name in self.queues:
+            extra = max(0, min(desired[name] - allocated[name], budget))
+            allocated[name] += extra
+            budget -= extra
+        return allocated
+
+    def workers_for(self, queue_name):
+        return [worker_info for worker_info in self.workers if worker_info['queue'] == queue_name]
+
+    def spawn_worker(self, queue_name):
+        """Spawn a new worker process for a queue with cloud provider tag"""
         try:
             cloud = self.cloud_providers[len(self.workers) % len(self.cloud_providers)]
             self.worker_counter[cloud] += 1
@@ -40,19 +117,24 @@ class Autoscaler:
             
             env = os.environ.copy()
             env['WORKER_TAG'] = worker_tag
+            env['WORKER_QUEUES'] = queue_name
+            env['WORKER_SLOTS'] = str(self.worker_slots)
+            env['WORKER_CLASS'] = self.worker_class
             
             process = subprocess.Popen(['python', 'worker.py'], env=env)
-            self.workers.append({'process': process, 'tag': worker_tag})
-            logger.info(f"Spawned worker {worker_tag} PID {process.pid}")
+            self.workers.append({'process': process, 'tag': worker_tag, 'queue': queue_name})
+            logger.info(f"Spawned worker {worker_tag} PID {process.pid} for queue {queue_name}")
             return process
         except Exception as e:
             logger.error(f"Failed to spawn worker: {str(e)}")
             return None
     
-    def kill_worker(self):
-        """Kill the oldest worker process"""
-        if len(self.workers) > 1:  # Keep at least 1 worker
-            worker_info = self.workers.pop(0)
+    def kill_worker(self, queue_name):
+        """Kill the oldest worker process of a queue"""
+        pool = self.workers_for(queue_name)
+        if len(pool) > self.queue_min_workers[queue_name]:
+            worker_info = pool[0]
+            self.workers.remove(worker_info)
             worker = worker_info['process']
             tag = worker_info['tag']
             try:
@@ -77,42 +159,60 @@ class Autoscaler:
         self.workers = alive_workers
     
     def scale_workers(self):
-        """Scale workers based on queue size"""
-        queue_size = len(self.queue)
-        current_workers = len(self.workers)
-        desired_workers = self.get_desired_workers(queue_size)
-        
-        logger.info(f"Queue: {queue_size}, Workers: {current_workers}, Desired: {desired_workers}")
-        
+        """Scale each queue's workers according to its scaling policy, within the fleet's max_workers"""
+        now = self.clock()
+        observations = {name: observe(self.redis_conn, queue, now) for name, queue in self.queues.items()}
+        desired = self.allocate({name: self.get_desired_workers(name, observation)
+                                 for name, observation in observations.items()})
+        for queue_name in self.queues:
+            logger.info(f"Queue {queue_name}: {observations[queue_name].queue_size}, "
+                        f"Workers: {len(self.workers_for(queue_name))}, Desired: {desired[queue_name]}")
+        # Scale down first, so the workers it frees count towards other queues' scale ups
+        for queue_name in sorted(self.queues, key=lambda name: desired[name] > len(self.workers_for(name))):
+            self.scale_queue(queue_name, desired[queue_name], now)
+
+    def scale_queue(self, queue_name, desired_workers, now):
+        current_workers = len(self.workers_for(queue_name))
+
         if desired_workers > current_workers:
-            for _ in range(desired_workers - current_workers):
-                self.spawn_worker()
-                time.sleep(1) 
+            if now - self.last_scale_up[queue_name] < self.scale_up_cooldown:
+                return
+            # Popen does not wait for the worker to start, so spawn them all at once. Workers
+            # other queues are still owed a scale down for count against max_workers
+            for _ in range(min(desired_workers - current_workers, self.max_workers - len(self.workers))):
+                self.spawn_worker(queue_name)
+            self.last_scale_up[queue_name] = now
         elif desired_workers < current_workers:
+            last_change = max(self.last_scale_up[queue_name], self.last_scale_down[queue_name])
+            if now - last_change < self.scale_down_cooldown:
+                return
             for _ in range(current_workers - desired_workers):
-                self.kill_worker()
-    
+                self.kill_worker(queue_name)
+            self.last_scale_down[queue_name] = now
+
     def run(self):
         """Main autoscaler loop"""
         logger.info("Starting autoscaler")
         
-        if not self.workers:
-            self.spawn_worker()
+        for queue_name in self.queues:
+            for _ in range(self.queue_min_workers[queue_name] - len(self.workers_for(queue_name))):
+                self.spawn_worker(queue_name)
         
         while self.running:
             try:
                 self.cleanup_dead_workers()
                 self.scale_workers()
-                time.sleep(5)
+                time.sleep(self.interval)
             except KeyboardInterrupt:
                 logger.info("Received shutdown signal")
                 self.running = False
             except Exception as e:
                 logger.error(f"Autoscaler error: {str(e)}")
-                time.sleep(5)
+                time.sleep(self.interval)
         
         logger.info("Shutting down workers")
-        for worker in self.workers:
+        for worker_info in self.workers:
+            worker = worker_info['process']
             try:
                 worker.terminate()
                 worker.wait(timeout=5)
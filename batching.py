@@ -0,0 +1,165 @@
+import os
+import time
+import logging
+import traceback
+from rq import SimpleWorker
+from rq.timeouts import JobTimeoutException
+from rq.utils import current_timestamp, utcnow
+from rq.worker import WorkerStatus
+
+from executor import run_batch
+from scaling import record_completion
+from accounting import record_usage
+from job_index import IndexedJob, record_finished
+from events import NotifyingWorkerMixin, publish
+from telemetry import record_job
+from jobmeta import run_info
+
+logger = logging.getLogger(__name__)
+
+BATCHABLE_RUNTIMES = ('legacy', 'pool')
+
+# KEYS: the queue list, then its started job registry. ARGV: the registry
+# score, then candidate job ids. Moves every candidate still queued into
+# the registry in one step, so a worker that dies mid-claim leaves its jobs
+# where RQ's registry cleanup finds them. Returns the ids claimed.
+CLAIM = """
+local claimed = {}
+for i = 2, #ARGV do
+    if redis.call('LREM', KEYS[1], 1, ARGV[i]) == 1 then
+        redis.call('ZADD', KEYS[2], ARGV[1], ARGV[i])
+        claimed[#claimed + 1] = ARGV[i]
+    end
+end
+return claimed
+"""
+
+
+def batch_key(job):
+    """Jobs sharing a key can run in the same batch; None means never batch"""
+    if job.func_name != 'executor.run_job' or len(job.args) != 2 or job.kwargs:
+        return None
+    if job._success_callback_name or job._failure_callback_name:
+        return None
+    runtime = job.meta.get('runtime')
+    if runtime not in BATCHABLE_RUNTIMES:
+        return None
+    return (job.args[0], runtime, job.meta.get('filename'), job.meta.get('codec'))
+
+
+class BatchingWorker(NotifyingWorkerMixin, SimpleWorker):
+    """
+    Worker that drains up to batch_size queued jobs for the same function
+    within a short linger window and runs them in one runtime call.
+    Results and meta for the whole batch are written in a single pipeline;
+    each job keeps its own id, status and result.
+    """
+    job_class = IndexedJob
+
+    def __init__(self, *args, batch_size=32, linger=0.005, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.batch_size = batch_size
+        self.linger = linger
+        self._claim = self.connection.register_script(CLAIM)
+
+    def execute_job(self, job, queue):
+        key = batch_key(job)
+        batch = [job]
+        if key is not None and self.batch_size > 1:
+            batch += self.claim_jobs(queue, key, self.batch_size - 1)
+        if len(batch) == 1:
+            return super().execute_job(job, queue)
+        self.set_state(WorkerStatus.BUSY)
+        self.perform_batch(batch, queue)
+        self.set_state(WorkerStatus.IDLE)
+
+    def claim_jobs(self, queue, key, limit):
+        """
+        Move up to limit queued jobs matching key from the queue to its
+        started job registry. The script is atomic, so a job is only ever
+        claimed by one worker and is always in the queue or the registry.
+        """
+        deadline = time.monotonic() + self.linger
+        claimed = []
+        while len(claimed) < limit:
+            job_ids = queue.get_job_ids(0, limit * 4)
+            candidates = [
+                job for job in self.job_class.fetch_many(job_ids, connection=self.connection,
+                                                         serializer=self.serializer)
+                if job is not None and batch_key(job) == key
+            ][:limit - len(claimed)]
+            if candidates:
+                # perform_batch refreshes the score with each job's heartbeat
+                score = current_timestamp() + max(self.get_heartbeat_ttl(job) for job in candidates)
+                ids = {job_id.decode() for job_id in self._claim(
+                    keys=[queue.key, queue.started_job_registry.key], args=[score, *(job.id for job in candidates)])}
+                claimed.extend(job for job in candidates if job.id in ids)
+            if time.monotonic() >= deadline:
+                break
+            if not candidates:
+                time.sleep(0.001)
+        return claimed
+
+    def perform_batch(self, jobs, queue):
+        started_job_registry = queue.started_job_registry
+        heartbeat_ttl = self.get_heartbeat_ttl(jobs[0])
+        worker_tag = os.environ.get('WORKER_TAG', 'unknown-worker')
+        with self.connection.pipeline() as pipeline:
+            self.set_current_job_id(jobs[0].id, pipeline=pipeline)
+            self.heartbeat(heartbeat_ttl, pipeline=pipeline)
+            if len(self.queues) == 1:
+                # Only the job RQ dequeued itself went through the intermediate queue
+                pipeline.lrem(queue.intermediate_queue_key, 1, jobs[0].id)
+            for job in jobs:
+                job.heartbeat(utcnow(), heartbeat_ttl, pipeline=pipeline)
+                # Also marks the job started in /jobs (job_index.IndexedJob)
+                job.prepare_for_execution(self.name, pipeline=pipeline)
+            pipeline.execute()
+
+        timeout = max(job.timeout or self.queue_class.DEFAULT_TIMEOUT for job in jobs)
+        try:
+            with self.death_penalty_class(timeout, JobTimeoutException, job_id=jobs[0].id):
+                outcomes, total_cost = run_batch(jobs)
+        except Exception:
+            outcomes, total_cost = [(False, traceback.format_exc())] * len(jobs), 0.0
+        ended_at = utcnow()
+
+        succeeded, failed, dependents_checks = [], [], []
+        with self.connection.pipeline() as pipeline:
+            for job, (ok, value) in zip(jobs, outcomes):
+                job.ended_at = ended_at
+                pipeline.hset(job.key, 'meta', job.serializer.dumps(job.meta))
+                run = run_info(job.meta)
+                record_completion(self.connection, job.origin, job.args[0], run['execution_time'],
+                                  run['queue_wait'], pipeline=pipeline)
+                record_usage(self.connection, job.args[0], worker_tag, run['usage'], run['cost'],
+                             success=ok, pipeline=pipeline)
+                record_finished(self.connection, job, 'finished' if ok else 'failed', pipeline=pipeline)
+                record_job(self.connection, job, pipeline=pipeline)
+                if not ok:
+                    failed.append((job, value))
+                    continue
+                job._result = value
+                result_ttl = job.get_result_ttl(self.default_result_ttl)
+                if result_ttl != 0:
+                    job._handle_success(result_ttl, pipeline=pipeline)
+                job.cleanup(result_ttl, pipeline=pipeline, remove_from_queue=False)
+                started_job_registry.remove(job, pipeline=pipeline)
+                self.increment_successful_job_count(pipeline=pipeline)
+                self.increment_total_working_time(job.ended_at - job.started_at, pipeline)
+                publish(self.connection, job, 'finished', pipeline=pipeline)
+                dependents_checks.append(len(pipeline))
+                pipeline.exists(job.dependents_key)
+                succeeded.append(job)
+            pipeline.incrbyfloat("total_cost", total_cost)
+            self.set_current_job_id(None, pipeline=pipeline)
+            results = pipeline.execute()
+
+        # Dependents are rare for batched jobs; enqueue them outside the pipeline
+        for job, index in zip(succeeded, dependents_checks):
+            if results[index]:
+                queue.enqueue_dependents(job)
+        for job, exc_string in failed:
+            self.handle_job_failure(job, queue, started_job_registry, exc_string=exc_string)
+
+        logger.info(f"Batch of {len(jobs)} jobs: {len(succeeded)} succeeded, {len(failed)} failed")
@@ -0,0 +1,62 @@
+"""
+Cost of admission control on a submission.
+
+Times AdmissionControl.check() against a Redis PING, the floor for any
+round trip: a /submit-shaped check (function and API key buckets and a
+queue depth cap) and a batch-shaped one over --functions functions. Runs
+in Redis database --db, which is flushed first and afterwards.
+
+Usage:
+    python benchmarks/bench_admission.py --checks 20000 --db 15
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from redis import Redis  # noqa: E402
+from admission import AdmissionControl  # noqa: E402
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1e6)
+    samples.sort()
+    return samples[len(samples) // 2], samples[int(0.99 * (len(samples) - 1))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--checks', type=int, default=20000)
+    parser.add_argument('--functions', type=int, default=10, help='distinct functions in the batch-shaped check')
+    parser.add_argument('--db', type=int, default=15)
+    args = parser.parse_args()
+
+    conn = Redis(host='localhost', port=6379, db=args.db)
+    conn.flushdb()
+    # Limits far above the request rate, so every check is admitted and writes its buckets
+    limit = (1e9, 1e9)
+    admission = AdmissionControl(conn, function_limits={'*': limit}, api_key_limits={'*': limit},
+                                 max_depths={'*': 10 ** 9})
+    batch = {f"fn_{i}": 100 for i in range(args.functions)}
+    cases = [
+        ('PING', conn.ping),
+        ('submit check', lambda: admission.check({'sample_add': 1}, {'default': 1}, 'bench-key')),
+        (f"batch check, {args.functions} functions", lambda: admission.check(batch, {'default': 1000}, 'bench-key')),
+    ]
+    try:
+        for label, fn in cases:
+            timed(fn, min(1000, args.checks))  # warm up, loading the script
+            p50, p99 = timed(fn, args.checks)
+            print(f"{label:<28} p50 {p50:7.1f} us  p99 {p99:7.1f} us")
+    finally:
+        conn.flushdb()
+
+
+if __name__ == '__main__':
+    main()
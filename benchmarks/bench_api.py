@@ -0,0 +1,174 @@
+"""
+Requests/sec and latency of the Flask API (app.py) versus the asyncio API
+(asgi.py) under the same load and the same Redis.
+
+Starts each server in turn on its own port, both pointing at the Redis on
+localhost:6379, which is flushed before each run, so use a scratch Redis
+or pass --fake-redis to start a fakeredis TCP server there. Scenarios:
+  submit  --requests /submit calls with distinct payloads
+  status  --requests /status/<id> calls over the submitted jobs
+  wait    --waiters concurrent /wait calls, all answered by one burst of
+          completions; latency is measured from the burst
+
+Usage:
+    pip install httpx uvicorn fakeredis
+    python benchmarks/bench_api.py --fake-redis --requests 5000 --concurrency 64 --waiters 1000
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+try:
+    import httpx
+except ImportError:
+    sys.exit("bench_api.py needs httpx: pip install httpx")
+
+from redis import Redis  # noqa: E402
+from rq.job import Job, JobStatus  # noqa: E402
+from events import publish  # noqa: E402
+
+SERVERS = {
+    # threaded is Flask's default, spelled out; debug and the reloader stay off
+    'flask': lambda port: [sys.executable, '-c', "from app import app, latency_recorder; latency_recorder.start(); "
+                                                   f"app.run(port={port}, threaded=True)"],
+    'asgi': lambda port: [sys.executable, '-m', 'uvicorn', 'asgi:app', '--port', str(port),
+                          '--log-level', 'warning', '--no-access-log'],
+}
+
+
+def percentile(samples, q):
+    samples = sorted(samples)
+    return samples[int(q * (len(samples) - 1))] if samples else float('nan')
+
+
+def report(server, scenario, latencies, errors, elapsed):
+    print(f"{server:>6} {scenario:>7}: {len(latencies) / elapsed:8.0f} req/s  "
+          f"p50={percentile(latencies, 0.5) * 1000:7.1f}ms  p99={percentile(latencies, 0.99) * 1000:7.1f}ms  "
+          f"errors={errors}")
+
+
+async def hammer(client, requests, concurrency):
+    """Run (method, path, json) requests with concurrency in flight; returns (latencies, errors, elapsed, bodies)"""
+    latencies, bodies, errors = [], [], 0
+    pending = iter(requests)
+
+    async def run():
+        nonlocal errors
+        for method, path, body in pending:
+            start = time.perf_counter()
+            try:
+                resp = await client.request(method, path, json=body)
+                resp.raise_for_status()
+                bodies.append(resp.json())
+                latencies.append(time.perf_counter() - start)
+            except httpx.HTTPError:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - start, bodies
+
+
+async def bench_wait(client, conn, waiters, timeout):
+    resp = await client.post('/submit/batch', json=[{'function': 'sample_sum', 'payload': {'waiter': i}}
+                                                     for i in range(waiters)])
+    job_ids = resp.json()['job_ids']
+    done_at = {}
+
+    async def wait(job_id):
+        resp = await client.get(f"/wait/{job_id}", params={'timeout': timeout})
+        if resp.status_code != 200:
+            return None
+        return time.perf_counter() - done_at['burst']
+
+    tasks = [asyncio.create_task(wait(job_id)) for job_id in job_ids]
+    # Give every waiter time to connect before finishing the jobs
+    await asyncio.sleep(min(timeout / 2, 2 + waiters / 500))
+    done_at['burst'] = time.perf_counter()
+    await asyncio.to_thread(finish_jobs, conn, job_ids)
+    results = await asyncio.gather(*tasks)
+    latencies = [latency for latency in results if latency is not None]
+    return latencies, len(results) - len(latencies), time.perf_counter() - done_at['burst']
+
+
+def finish_jobs(conn, job_ids):
+    """Mark jobs finished and announce them the way a worker does"""
+    with conn.pipeline() as pipe:
+        for job in Job.fetch_many(job_ids, connection=conn):
+            job.set_status(JobStatus.FINISHED, pipeline=pipe)
+            publish(conn, job, JobStatus.FINISHED, pipeline=pipe)
+        pipe.execute()
+
+
+async def bench_server(server, port, args, conn):
+    limits = httpx.Limits(max_connections=max(args.concurrency, args.waiters))
+    async with httpx.AsyncClient(base_url=f"http://localhost:{port}", limits=limits, timeout=120) as client:
+        submits = [('POST', '/submit', {'function': 'sample_add',
+                                        'payload': {'a': random.random(), 'b': i}})
+                   for i in range(args.requests)]
+        latencies, errors, elapsed, bodies = await hammer(client, submits, args.concurrency)
+        report(server, 'submit', latencies, errors, elapsed)
+
+        job_ids = [body['job_id'] for body in bodies]
+        statuses = [('GET', f"/status/{random.choice(job_ids)}", None) for _ in range(args.requests)]
+        latencies, errors, elapsed, _ = await hammer(client, statuses, args.concurrency)
+        report(server, 'status', latencies, errors, elapsed)
+
+        latencies, errors, elapsed = await bench_wait(client, conn, args.waiters, args.wait_timeout)
+        report(server, 'wait', latencies, errors, elapsed)
+
+
+def wait_until_up(port, proc):
+    for _ in range(100):
+        if proc.poll() is not None:
+            sys.exit(f"server on port {port} exited with {proc.returncode}")
+        try:
+            httpx.get(f"http://localhost:{port}/jobs?limit=1").raise_for_status()
+            return
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    sys.exit(f"server on port {port} did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--servers', default='flask,asgi')
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--waiters', type=int, default=1000)
+    parser.add_argument('--wait-timeout', type=float, default=30)
+    parser.add_argument('--port', type=int, default=5100)
+    parser.add_argument('--fake-redis', action='store_true')
+    args = parser.parse_args()
+
+    processes = []
+    if args.fake_redis:
+        processes.append(subprocess.Popen([sys.executable, '-c', "from fakeredis import TcpFakeServer; "
+                                           "TcpFakeServer(('localhost', 6379)).serve_forever()"]))
+        time.sleep(1)
+    conn = Redis(host='localhost', port=6379)
+    try:
+        for offset, server in enumerate(args.servers.split(',')):
+            conn.flushall()
+            port = args.port + offset
+            proc = subprocess.Popen(SERVERS[server](port), cwd=ROOT, stdout=subprocess.DEVNULL,
+                                    stderr=subprocess.DEVNULL)
+            processes.append(proc)
+            wait_until_up(port, proc)
+            asyncio.run(bench_server(server, port, args, conn))
+            proc.terminate()
+            proc.wait()
+    finally:
+        for proc in processes:
+            proc.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Throughput of the array-aware sample handlers against list implementations.
+
+For each of sample_sum, add, subtract, multiply, divide and power, over
+--elements operands:
+  list       the handler as it was: Python's sum(), or an element by
+             element loop over lists for the binary ops
+  array      the handler given NumPy arrays (a msgpack or Arrow payload)
+  from list  the handler given JSON lists, converted to arrays inside
+and, for the binary ops, --batch scalar payloads through handler one by
+one versus handler_batch, as the micro-batching worker calls it.
+
+Usage:
+    python benchmarks/bench_arrays.py --elements 1000000 --batch 100000
+"""
+import os
+import sys
+import time
+import operator
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from module_cache import ModuleCache, call_batch  # noqa: E402
+
+BINARY = {
+    'sample_add': (operator.add, 'a', 'b'),
+    'sample_subtract': (operator.sub, 'a', 'b'),
+    'sample_multiply': (operator.mul, 'a', 'b'),
+    'sample_divide': (operator.truediv, 'a', 'b'),
+    'sample_power': (operator.pow, 'base', 'exp'),
+}
+
+
+def best_of(call, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        call()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def row(name, count, timings):
+    base = timings[0]
+    cells = ''.join(f"{count / seconds / 1e6:>12.1f}" if seconds else f"{'-':>12}" for seconds in timings)
+    speedups = ''.join(f"{base / seconds:>9.1f}x" if seconds else f"{'-':>10}" for seconds in timings[1:])
+    print(f"{name:<18}{cells}{speedups}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--elements', type=int, default=1000000)
+    parser.add_argument('--batch', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    cache = ModuleCache()
+    rng = np.random.default_rng(0)
+    # Positive operands keep divide and power free of zeros and overflow
+    a = rng.integers(1, 100, args.elements)
+    b = rng.integers(1, 4, args.elements)
+    a_list, b_list = a.tolist(), b.tolist()
+
+    print(f"{args.elements} elements, million operands/s (best of {args.repeat})")
+    print(f"{'function':<18}{'list':>12}{'array':>12}{'from list':>12}{'array':>10}{'from list':>10}")
+    module, _ = cache.load('sample_sum', 'functions/sample_sum.py')
+    row('sample_sum', args.elements, [
+        best_of(lambda: sum(a_list), args.repeat),
+        best_of(lambda: module.handler({'numbers': a}), args.repeat),
+        best_of(lambda: module.handler({'numbers': np.asarray(a_list)}), args.repeat),
+    ])
+    for name, (op, first, second) in BINARY.items():
+        module, _ = cache.load(name, f"functions/{name}.py")
+        row(name, args.elements, [
+            best_of(lambda: [op(x, y) for x, y in zip(a_list, b_list)], args.repeat),
+            best_of(lambda: module.handler({first: a, second: b}), args.repeat),
+            best_of(lambda: module.handler({first: a_list, second: b_list}), args.repeat),
+        ])
+
+    payloads = [{'a': x, 'b': y} for x, y in zip(a_list[:args.batch], b_list[:args.batch])]
+    print(f"\n{len(payloads)} scalar payloads, million payloads/s")
+    print(f"{'function':<18}{'handler':>12}{'batch':>12}{'batch':>10}")
+    for name in ('sample_add', 'sample_subtract', 'sample_multiply', 'sample_divide'):
+        module, _ = cache.load(name, f"functions/{name}.py")
+        row(name, len(payloads), [
+            best_of(lambda: [module.handler(payload) for payload in payloads], args.repeat),
+            best_of(lambda: call_batch(module, payloads), args.repeat),
+        ])
+
+
+if __name__ == '__main__':
+    main()
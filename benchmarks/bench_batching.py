@@ -0,0 +1,57 @@
+"""
+Throughput of tiny jobs with and without worker micro-batching.
+
+Enqueues --jobs sample_sum jobs onto a scratch queue in a local Redis and
+drains them with a burst worker at batch size 1 and --batch-size.
+
+Usage:
+    python benchmarks/bench_batching.py --jobs 5000 --batch-size 64 --runtime legacy
+"""
+import os
+import sys
+import time
+import argparse
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from redis import Redis  # noqa: E402
+from rq import Queue  # noqa: E402
+from batching import BatchingWorker  # noqa: E402
+from executor import run_job  # noqa: E402
+
+
+def drain(conn, jobs, batch_size, runtime):
+    queue = Queue('bench-batching', connection=conn)
+    queue.empty()
+    job_datas = [
+        Queue.prepare_data(run_job, args=('sample_sum', {'numbers': [i, 1]}), meta={'runtime': runtime})
+        for i in range(jobs)
+    ]
+    for start in range(0, jobs, 1000):
+        queue.enqueue_many(job_datas[start:start + 1000])
+
+    worker = BatchingWorker([queue], connection=conn, batch_size=batch_size)
+    start = time.perf_counter()
+    worker.work(burst=True, logging_level='WARNING')
+    elapsed = time.perf_counter() - start
+    print(f"batch_size={batch_size:<4} {jobs} jobs in {elapsed:7.2f}s  {jobs / elapsed:10.0f} jobs/sec")
+    queue.finished_job_registry.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--jobs', type=int, default=5000)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--runtime', default='legacy', choices=['legacy', 'pool'])
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    conn = Redis(host='localhost', port=6379)
+    drain(conn, args.jobs, 1, args.runtime)
+    drain(conn, args.jobs, args.batch_size, args.runtime)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Cost of moving large numeric array payloads under each codec.
+
+For each array size, times encoding and decoding {"data": array} with
+the json, msgpack and arrow codecs, reports the encoded size, and times a
+full warm pool round trip (encode, pipe, decode, run sample_length and
+back). JSON goes through lists the way a JSON client's payload would.
+
+Usage:
+    pip install msgpack
+    python benchmarks/bench_codecs.py --sizes 10000,100000,1000000 --iterations 20
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from serialization import CODECS, msgpack  # noqa: E402
+from warm_pool import WarmPool  # noqa: E402
+
+
+def per_call_ms(call, iterations):
+    call()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        call()
+    return (time.perf_counter() - start) / iterations * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', default='10000,100000,1000000')
+    parser.add_argument('--dtype', default='float64')
+    parser.add_argument('--iterations', type=int, default=20)
+    args = parser.parse_args()
+
+    codecs = [codec for name, codec in CODECS.items() if name != 'msgpack' or msgpack is not None]
+    if len(codecs) < len(CODECS):
+        print("msgpack is not installed; skipping it (pip install msgpack)")
+    # Pool processes default to a 512 MB address space; large JSON payloads need more
+    pool = WarmPool(size=1, memory_limit_mb=4096, max_rss_growth_mb=4096)
+    pool.start()
+    try:
+        print(f"{'elements':>10} {'codec':<8}{'size (MB)':>10}{'encode (ms)':>13}{'decode (ms)':>13}{'pool (ms)':>11}")
+        for size in (int(size) for size in args.sizes.split(',')):
+            payload = {'data': np.random.default_rng(0).random(size).astype(args.dtype)}
+            for codec in codecs:
+                encoded = codec.encode(payload)
+                encode = per_call_ms(lambda: codec.encode(payload), args.iterations)
+                decode = per_call_ms(lambda: codec.decode(encoded), args.iterations)
+                round_trip = per_call_ms(lambda: pool.call('sample_length', payload, codec.name), args.iterations)
+                print(f"{size:>10} {codec.name:<8}{len(encoded) / 2 ** 20:>10.2f}{encode:>13.2f}"
+                      f"{decode:>13.2f}{round_trip:>11.2f}")
+    finally:
+        pool.shutdown()
+
+
+if __name__ == '__main__':
+    main()
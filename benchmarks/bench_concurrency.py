@@ -0,0 +1,88 @@
+"""
+Throughput and memory of I/O-bound jobs: one process per concurrent job
+versus one multi-slot worker process.
+
+Enqueues --jobs sample_sleep jobs (legacy runtime) onto a scratch queue in
+a local Redis, then drains them with --concurrency burst SimpleWorker
+processes, and again with a single ConcurrentWorker process with that
+many slots. Each run reports jobs/sec, including process startup, and the
+peak RSS of its worker processes in total and per concurrent job.
+
+Usage:
+    python benchmarks/bench_concurrency.py --jobs 400 --concurrency 16 --sleep 0.2
+"""
+import os
+import sys
+import time
+import argparse
+import logging
+import resource
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from redis import Redis  # noqa: E402
+from rq import Queue, SimpleWorker  # noqa: E402
+from accounting import RSS_UNIT  # noqa: E402
+from executor import run_job  # noqa: E402
+from slots import ConcurrentWorker  # noqa: E402
+
+QUEUE_NAME = 'bench-concurrency'
+
+
+def work(slots, peaks):
+    """Child process: drain the queue with one worker, then report peak RSS in bytes"""
+    logging.disable(logging.INFO)
+    conn = Redis(host='localhost', port=6379)
+    if slots > 1:
+        worker = ConcurrentWorker([QUEUE_NAME], connection=conn, slots=slots)
+    else:
+        worker = SimpleWorker([QUEUE_NAME], connection=conn)
+    worker.work(burst=True, logging_level='WARNING')
+    peaks.put(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * RSS_UNIT)
+
+
+def drain(conn, label, processes, slots, jobs, sleep):
+    queue = Queue(QUEUE_NAME, connection=conn)
+    queue.empty()
+    job_datas = [Queue.prepare_data(run_job, args=('sample_sleep', {'seconds': sleep}), meta={'runtime': 'legacy'})
+                 for _ in range(jobs)]
+    for start in range(0, jobs, 1000):
+        queue.enqueue_many(job_datas[start:start + 1000])
+
+    context = multiprocessing.get_context('spawn')
+    peaks = context.Queue()
+    start = time.perf_counter()
+    children = [context.Process(target=work, args=(slots, peaks)) for _ in range(processes)]
+    for child in children:
+        child.start()
+    rss = [peaks.get() for _ in children]
+    for child in children:
+        child.join()
+    elapsed = time.perf_counter() - start
+
+    concurrency = processes * slots
+    total_mb = sum(rss) / 2 ** 20
+    print(f"{label:<22} {jobs} jobs in {elapsed:6.2f}s {jobs / elapsed:8.1f} jobs/sec  "
+          f"rss {total_mb:7.1f} MB total {total_mb / concurrency:6.1f} MB per concurrent job")
+    queue.finished_job_registry.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--jobs', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--sleep', type=float, default=0.2, help='seconds each sample_sleep job waits')
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    conn = Redis(host='localhost', port=6379)
+    ideal = args.concurrency / args.sleep
+    print(f"{args.concurrency} concurrent {args.sleep}s jobs: at most {ideal:.0f} jobs/sec")
+    drain(conn, f"{args.concurrency} processes", args.concurrency, 1, args.jobs, args.sleep)
+    drain(conn, f"1 process x {args.concurrency} slots", 1, args.concurrency, args.jobs, args.sleep)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Latency of /jobs page fetches against a large job history.
+
+Populates --jobs job records through the same job_index helpers the API
+and workers use (in Redis database --db, which is flushed first and
+afterwards), then times filtered first pages and deep cursor walks.
+
+Usage:
+    python benchmarks/bench_job_index.py --jobs 1000000 --db 15
+"""
+import os
+import sys
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from redis import Redis  # noqa: E402
+from job_index import record_enqueued, record_started, record_finished, query_jobs  # noqa: E402
+
+# function -> share of jobs; sample_power is the rare one
+FUNCTIONS = {'sample_add': 40, 'sample_upper': 30, 'sample_sleep': 20, 'sample_reverse': 9, 'sample_power': 1}
+WORKERS = [f"worker-{i}" for i in range(8)]
+
+
+def populate(conn, jobs, seed):
+    rng = random.Random(seed)
+    start = datetime(2026, 1, 1)
+    names, weights = list(FUNCTIONS), list(FUNCTIONS.values())
+    began = time.perf_counter()
+    for offset in range(0, jobs, 5000):
+        with conn.pipeline(transaction=False) as pipe:
+            for i in range(offset, min(offset + 5000, jobs)):
+                job = SimpleNamespace(
+                    id=f"job-{i:08d}", args=[rng.choices(names, weights)[0]], origin='default',
+                    enqueued_at=start + timedelta(milliseconds=i * 10),
+                    meta={'runtime': 'legacy', 'execution_time': rng.random(), 'cost': 0.01},
+                )
+                record_enqueued(conn, job, pipeline=pipe)
+                if i < jobs - 1000:  # the newest jobs are still queued
+                    record_started(conn, job, rng.choice(WORKERS), pipeline=pipe)
+                    record_finished(conn, job, 'failed' if rng.random() < 0.02 else 'finished', pipeline=pipe)
+            pipe.execute()
+    print(f"populated {jobs} jobs in {time.perf_counter() - began:.1f}s, "
+          f"used_memory={conn.info('memory')['used_memory_human']}")
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return samples[len(samples) // 2], samples[int(0.99 * (len(samples) - 1))]
+
+
+def walk(conn, filters, pages, limit):
+    cursor = None
+    for _ in range(pages):
+        _, cursor = query_jobs(conn, filters, cursor, limit)
+        if cursor is None:
+            break
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--jobs', type=int, default=1000000)
+    parser.add_argument('--db', type=int, default=15)
+    parser.add_argument('--limit', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    conn = Redis(host='localhost', port=6379, db=args.db)
+    conn.flushdb()
+    try:
+        populate(conn, args.jobs, args.seed)
+        cases = [
+            ('all', {}),
+            ('status=finished', {'status': 'finished'}),
+            ('status=queued', {'status': 'queued'}),
+            ('function=sample_add', {'function': 'sample_add'}),
+            ('worker_tag=worker-3', {'worker_tag': 'worker-3'}),
+            ('function=sample_power,status=failed', {'function': 'sample_power', 'status': 'failed'}),
+            ('function=sample_add,worker_tag=worker-3', {'function': 'sample_add', 'worker_tag': 'worker-3'}),
+        ]
+        for label, filters in cases:
+            p50, p99 = timed(lambda: query_jobs(conn, filters, None, args.limit), args.repeat)
+            print(f"first page  {label:<42} p50={p50:7.2f}ms p99={p99:7.2f}ms")
+        for label, filters in cases[:2]:
+            p50, p99 = timed(lambda: walk(conn, filters, 100, args.limit), max(1, args.repeat // 20))
+            print(f"100 pages   {label:<42} p50={p50:7.2f}ms p99={p99:7.2f}ms")
+    finally:
+        conn.flushdb()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Per-job overhead of loading sample_* handlers with and without the module cache.
+
+"before" re-imports the module for every job the way run_job used to;
+"after" goes through executor.module_cache.
+
+Usage:
+    python benchmarks/bench_module_cache.py --iterations 2000
+"""
+import os
+import sys
+import glob
+import time
+import argparse
+import importlib.util
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from module_cache import ModuleCache  # noqa: E402
+
+
+def import_uncached(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def per_call_us(load, name, path, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        load(name, path)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args()
+
+    cache = ModuleCache()
+    print(f"{'function':<18}{'before (us)':>12}{'after (us)':>12}{'speedup':>10}")
+    for path in sorted(glob.glob('functions/sample_*.py')):
+        name = os.path.basename(path)[:-3]
+        if not hasattr(import_uncached(name, path), 'handler'):
+            continue
+        before = per_call_us(import_uncached, name, path, args.iterations)
+        after = per_call_us(cache.load, name, path, args.iterations)
+        print(f"{name:<18}{before:>12.2f}{after:>12.2f}{before / after:>9.1f}x")
+    print(f"cache stats: {cache.stats()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Compare per-call latency of the Docker, legacy import and warm pool runtimes.
+
+Usage:
+    python benchmarks/bench_runtimes.py --function sample_add --iterations 200
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from executor import _run_docker, _run_legacy  # noqa: E402
+from warm_pool import WarmPool  # noqa: E402
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def measure(label, call, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        call()
+        samples.append((time.perf_counter() - start) * 1000)
+    print(f"{label:<8} n={iterations:<5} p50={percentile(samples, 50):9.3f}ms "
+          f"p99={percentile(samples, 99):9.3f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--function', default='sample_add')
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--docker-iterations', type=int, default=10)
+    args = parser.parse_args()
+    payload = {'a': 1, 'b': 2}
+
+    measure('legacy', lambda: _run_legacy(args.function, payload), args.iterations)
+
+    pool = WarmPool(size=1)
+    pool.start()
+    try:
+        measure('pool', lambda: pool.call(args.function, payload), args.iterations)
+    finally:
+        pool.shutdown()
+
+    if shutil.which('docker'):
+        filename = f"{args.function}.py"
+        measure('docker', lambda: _run_docker("python:3.11", "python", filename, payload, "Python"),
+                args.docker_iterations)
+    else:
+        print("docker   skipped (docker not found)")
+
+
+if __name__ == '__main__':
+    main()
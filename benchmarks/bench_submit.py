@@ -0,0 +1,70 @@
+"""
+Jobs/sec for single /submit calls versus /submit/batch against a running API.
+
+Usage:
+    python app.py &
+    python benchmarks/bench_submit.py --jobs 5000 --batch-size 500 --concurrency 8
+"""
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def job(i):
+    return {'function': 'sample_add', 'payload': {'a': i, 'b': 1}}
+
+
+def run_single(url, jobs, concurrency):
+    session = requests.Session()
+
+    def submit(i):
+        session.post(f"{url}/submit", json=job(i)).raise_for_status()
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(submit, range(jobs)))
+
+
+def run_batch(url, jobs, batch_size, concurrency, ndjson=False):
+    session = requests.Session()
+
+    def submit(start):
+        batch = [job(i) for i in range(start, min(start + batch_size, jobs))]
+        if ndjson:
+            body = '\n'.join(json.dumps(entry) for entry in batch)
+            resp = session.post(f"{url}/submit/batch", data=body,
+                                headers={'Content-Type': 'application/x-ndjson'})
+        else:
+            resp = session.post(f"{url}/submit/batch", json=batch)
+        resp.raise_for_status()
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(submit, range(0, jobs, batch_size)))
+
+
+def report(label, jobs, fn):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<14} {jobs} jobs in {elapsed:7.2f}s  {jobs / elapsed:10.0f} jobs/sec")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--jobs', type=int, default=5000)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args()
+
+    report('single', args.jobs, lambda: run_single(args.url, args.jobs, args.concurrency))
+    report('batch', args.jobs,
+           lambda: run_batch(args.url, args.jobs, args.batch_size, args.concurrency))
+    report('batch-ndjson', args.jobs,
+           lambda: run_batch(args.url, args.jobs, args.batch_size, args.concurrency, ndjson=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Per-tick cost of the trigger scheduler as the number of registered triggers grows.
+
+For each size, registers that many cron triggers (next fire times spread so
+about --due-per-tick fall due each simulated second) and as many webhook
+triggers (--due-per-tick per event type) in Redis database --db, which is
+flushed first and afterwards. It then times scheduler ticks and /event
+lookups, next to the old in-memory list scan for reference.
+
+Usage:
+    python benchmarks/bench_triggers.py --sizes 1000,10000,100000 --db 15
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from redis import Redis  # noqa: E402
+from triggers import TriggerStore  # noqa: E402
+
+
+def populate(conn, store, size, due_per_tick):
+    for start in range(0, size, 5000):
+        with conn.pipeline(transaction=False) as pipe:
+            for i in range(start, min(start + 5000, size)):
+                store.add({'id': f"cron-{i}", 'type': 'cron', 'function': 'sample_add',
+                           'payload': {}, 'interval': size / due_per_tick}, i / due_per_tick, pipeline=pipe)
+                store.add({'id': f"hook-{i}", 'type': 'webhook', 'function': 'sample_add', 'payload': {},
+                           'event_type': f"event-{i // due_per_tick}"}, 0, pipeline=pipe)
+            pipe.execute()
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return samples[len(samples) // 2], samples[int(0.99 * (len(samples) - 1))]
+
+
+def bench(conn, size, args):
+    conn.flushdb()
+    store = TriggerStore(conn)
+    populate(conn, store, size, args.due_per_tick)
+
+    ticks, fired = [], 0
+    for now in range(1, args.ticks + 1):
+        start = time.perf_counter()
+        fired += len(store.take_due(now))
+        ticks.append((time.perf_counter() - start) * 1000)
+
+    lookups = []
+    for i in range(args.ticks):
+        start = time.perf_counter()
+        store.for_event(f"event-{i % (size // args.due_per_tick)}")
+        lookups.append((time.perf_counter() - start) * 1000)
+
+    # The previous scheduler scanned every trigger in a Python list each second
+    legacy = [{'type': 'cron', 'interval': 60, 'last_run': time.time()} for _ in range(size)]
+    start = time.perf_counter()
+    for trig in legacy:
+        if trig['type'] == 'cron' and time.time() - trig.get('last_run', 0) >= trig.get('interval', 60):
+            pass
+    scan = (time.perf_counter() - start) * 1000
+
+    tick_p50, tick_p99 = percentiles(ticks)
+    lookup_p50, lookup_p99 = percentiles(lookups)
+    print(f"{size:>8} triggers  tick p50={tick_p50:6.2f}ms p99={tick_p99:6.2f}ms "
+          f"({fired / args.ticks:.1f} due/tick)  event p50={lookup_p50:6.2f}ms p99={lookup_p99:6.2f}ms  "
+          f"list scan={scan:7.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', default='1000,10000,100000')
+    parser.add_argument('--due-per-tick', type=int, default=10)
+    parser.add_argument('--ticks', type=int, default=200)
+    parser.add_argument('--db', type=int, default=15)
+    args = parser.parse_args()
+
+    conn = Redis(host='localhost', port=6379, db=args.db)
+    try:
+        for size in (int(size) for size in args.sizes.split(',')):
+            bench(conn, size, args)
+    finally:
+        conn.flushdb()
+
+
+if __name__ == '__main__':
+    main()
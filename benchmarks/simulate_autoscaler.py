@@ -0,0 +1,160 @@
+"""
+Replay a synthetic bursty arrival trace against fakeredis and compare the
+original queue-length autoscaling against the Little's law policy.
+
+Workers are simulated: each takes --startup seconds to come up and then
+pulls jobs from the queue, reporting completions the same way run_job does.
+The legacy run also reproduces the old 1 s sleep between spawns.
+
+Usage:
+    pip install fakeredis
+    python benchmarks/simulate_autoscaler.py --duration 600 --seed 1
+"""
+import os
+import sys
+import random
+import argparse
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import fakeredis
+except ImportError:
+    sys.exit("simulate_autoscaler.py needs fakeredis: pip install fakeredis")
+
+from rq import Queue  # noqa: E402
+from autoscaler import Autoscaler  # noqa: E402
+from executor import run_job  # noqa: E402
+from scaling import QueueLengthPolicy, LittlesLawPolicy, record_completion  # noqa: E402
+
+# function -> mean execution time in seconds
+FUNCTIONS = {'sample_add': 0.05, 'sample_upper': 0.05, 'sample_sleep': 2.0}
+TICK = 0.1
+
+
+def arrival_trace(duration, seed):
+    """(time, function) pairs: a steady trickle plus a 20 s burst every 2 minutes"""
+    rng = random.Random(seed)
+    arrivals, now = [], 0.0
+    while now < duration:
+        rate = 40.0 if (now % 120) < 20 else 2.0
+        now += rng.expovariate(rate)
+        name = rng.choices(list(FUNCTIONS), weights=[4, 4, 2])[0]
+        arrivals.append((now, name))
+    return arrivals
+
+
+class SimWorker:
+    def __init__(self, ready_at):
+        self.ready_at = ready_at
+        self.busy_until = ready_at
+        self.service_time = 0.0
+        self.current = None
+
+
+class Simulation:
+    def __init__(self, seed, startup):
+        self.now = 0.0
+        self.startup = startup
+        self.conn = fakeredis.FakeRedis()
+        self.queue = Queue('default', connection=self.conn)
+        self.rng = random.Random(seed + 1)
+        self.jobs = {}  # job id -> (function, arrival time)
+        self.delays = []
+        self.started = set()
+        self.worker_seconds = 0.0
+
+
+class SimulatedAutoscaler(Autoscaler):
+    def __init__(self, sim, spawn_stagger=0.0, **kwargs):
+        super().__init__(redis_conn=sim.conn, queue_names=['default'], clock=lambda: sim.now, **kwargs)
+        self.sim = sim
+        self.spawn_stagger = spawn_stagger
+        self.pending_spawns = 0
+
+    def spawn_worker(self, queue_name):
+        # The old autoscaler slept spawn_stagger seconds between spawns
+        ready_at = self.sim.now + self.pending_spawns * self.spawn_stagger + self.sim.startup
+        self.pending_spawns += 1
+        self.workers.append({'queue': queue_name, 'sim': SimWorker(ready_at)})
+
+    def kill_worker(self, queue_name):
+        if len(self.workers) > self.min_workers:
+            worker = self.workers.pop(0)['sim']
+            if worker.current is not None:
+                self.sim.queue.push_job_id(worker.current, at_front=True)
+
+    def cleanup_dead_workers(self):
+        self.pending_spawns = 0
+
+
+def run(policy_class, spawn_stagger, trace, args, **kwargs):
+    duration = args.duration
+    sim = Simulation(args.seed, args.startup)
+    scaler = SimulatedAutoscaler(sim, policy_class=policy_class, spawn_stagger=spawn_stagger, **kwargs)
+    scaler.spawn_worker('default')
+    scaler.workers[0]['sim'].ready_at = 0.0
+    next_arrival, next_scale = 0, 0.0
+
+    while sim.now < duration or sim.queue.count or any(w['sim'].current for w in scaler.workers):
+        while next_arrival < len(trace) and trace[next_arrival][0] <= sim.now:
+            arrived_at, name = trace[next_arrival]
+            job = sim.queue.enqueue(run_job, name, {})
+            sim.jobs[job.id] = (name, arrived_at)
+            next_arrival += 1
+
+        for worker in [worker_info['sim'] for worker_info in scaler.workers]:
+            if worker.current is not None and worker.busy_until <= sim.now:
+                name, _ = sim.jobs[worker.current]
+                record_completion(sim.conn, 'default', name, worker.service_time)
+                worker.current = None
+            if worker.current is None and worker.ready_at <= sim.now:
+                job_id = sim.conn.lpop(sim.queue.key)
+                if job_id:
+                    job_id = job_id.decode()
+                    name, arrived_at = sim.jobs[job_id]
+                    if job_id not in sim.started:
+                        sim.started.add(job_id)
+                        sim.delays.append(sim.now - arrived_at)
+                    worker.current = job_id
+                    worker.service_time = sim.rng.expovariate(1 / FUNCTIONS[name])
+                    worker.busy_until = sim.now + worker.service_time
+
+        if sim.now >= next_scale:
+            scaler.cleanup_dead_workers()
+            scaler.scale_workers()
+            next_scale = sim.now + scaler.interval
+
+        sim.worker_seconds += len(scaler.workers) * TICK
+        sim.now += TICK
+    return sim
+
+
+def report(label, sim):
+    delays = sorted(sim.delays)
+    p95 = delays[int(0.95 * (len(delays) - 1))]
+    print(f"{label:<14} jobs={len(delays):<6} mean_wait={sum(delays) / len(delays):7.2f}s "
+          f"p95_wait={p95:7.2f}s max_wait={delays[-1]:7.2f}s worker_seconds={sim.worker_seconds:9.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--duration', type=float, default=600)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--startup', type=float, default=2.0, help='worker startup time in seconds')
+    parser.add_argument('--max-workers', type=int, default=20)
+    parser.add_argument('--interval', type=float, default=5.0, help='autoscaler evaluation interval')
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    trace = arrival_trace(args.duration, args.seed)
+    print(f"{len(trace)} arrivals over {args.duration:.0f}s, max {args.max_workers} workers")
+    report('queue_length', run(QueueLengthPolicy, 1.0, trace, args, max_workers=args.max_workers,
+                               scale_down_cooldown=0, interval=args.interval))
+    report('littles_law', run(LittlesLawPolicy, 0.0, trace, args, max_workers=args.max_workers,
+                              interval=args.interval))
+
+
+if __name__ == '__main__':
+    main()
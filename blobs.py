@@ -0,0 +1,137 @@
+import os
+import re
+import json
+import mmap
+import time
+
+from artifacts import UPLOAD_PREFIX, ArtifactWriter
+from serialization import BINARY, CODECS, JSON_CODEC, codec_for
+
+# Shared by the API and the workers on a host, like functions/
+BLOB_DIR = os.path.abspath(os.environ.get('BLOB_DIR', 'blobs'))
+# Payloads and results whose encoding is larger than this are stored as blobs
+OFFLOAD_BYTES = int(os.environ.get('BLOB_OFFLOAD_BYTES', 64 * 1024))
+# Blobs untouched for this long are deleted unless an unfinished job's
+# arguments still reference them; keep it above RESULT_CACHE_TTL
+BLOB_TTL = float(os.environ.get('BLOB_TTL', 86400))
+
+REF_KEY = '$blob'
+EXTENSIONS = {BINARY: 'bin', **{codec.content_type: codec.extension for codec in CODECS.values()}}
+BLOB_RE = re.compile(r'[0-9a-f]{64}\.(%s)' % '|'.join(EXTENSIONS.values()))
+
+os.makedirs(BLOB_DIR, exist_ok=True)
+
+
+def is_ref(value):
+    return isinstance(value, dict) and REF_KEY in value
+
+
+def refs(value):
+    """Keys of the blob references in value and the lists and dicts nested in it"""
+    if is_ref(value):
+        yield value[REF_KEY]
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from refs(item)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            yield from refs(item)
+
+
+def blob_path(ref, directory=BLOB_DIR):
+    """Path of a blob reference's file; raises ValueError for a malformed reference"""
+    key = ref[REF_KEY]
+    if not isinstance(key, str) or not BLOB_RE.fullmatch(key):
+        raise ValueError(f"Invalid blob key {key!r}")
+    return os.path.join(directory, key)
+
+
+def put_stream(chunks, content_type=BINARY, directory=BLOB_DIR):
+    """Store byte chunks under their content hash; returns a reference to them"""
+    writer = ArtifactWriter(directory)
+    try:
+        for chunk in chunks:
+            writer.write(chunk)
+        key = writer.commit(EXTENSIONS[content_type])
+    finally:
+        writer.close()
+    return {REF_KEY: key, 'size': writer.size, 'content_type': content_type}
+
+
+def put_bytes(data, content_type=BINARY, directory=BLOB_DIR):
+    return put_stream([memoryview(data).cast('B')], content_type, directory)
+
+
+def open_blob(ref, directory=BLOB_DIR):
+    """Read-only memoryview of a blob, memory-mapped rather than read into memory"""
+    with open(blob_path(ref, directory), 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return memoryview(b'')
+        return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def load(value, directory=BLOB_DIR):
+    """
+    Resolve a blob reference for a handler: blobs written by a codec are
+    decoded with it, binary ones come back as a memory-mapped memoryview.
+    Other values pass through.
+    """
+    if not is_ref(value):
+        return value
+    codec = codec_for(value.get('content_type'))
+    if codec is JSON_CODEC:
+        with open(blob_path(value, directory), 'rb') as f:
+            return json.load(f)
+    if codec is None:
+        return open_blob(value, directory)
+    # Arrays decoded from the mapping are views of it, not copies
+    return codec.decode(open_blob(value, directory))
+
+
+def offload(value, threshold=OFFLOAD_BYTES, directory=BLOB_DIR, codec=JSON_CODEC):
+    """
+    Return value, or a reference to it in the blob store: bytes always go to
+    the store as they are, other values once their encoding with the job's
+    codec exceeds threshold.
+    """
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return put_bytes(value, BINARY, directory)
+    if is_ref(value) or value is None or isinstance(value, (bool, int, float)):
+        return value
+    try:
+        encoded = codec.encode(value)
+    except (TypeError, ValueError):
+        # Left for RQ to pickle, as before
+        return value
+    if len(encoded) <= threshold:
+        return value
+    return put_bytes(encoded, codec.content_type, directory)
+
+
+def collect_garbage(now=None, ttl=BLOB_TTL, directory=BLOB_DIR, held=None):
+    """
+    Delete blobs and abandoned uploads untouched for ttl seconds; returns
+    (count, bytes freed). held, if given, is called once there is something
+    to delete and returns the keys to keep regardless of age, such as those
+    of queued jobs' payloads.
+    """
+    now = time.time() if now is None else now
+    expired = [entry for entry in os.scandir(directory)
+               if (BLOB_RE.fullmatch(entry.name) or entry.name.startswith(UPLOAD_PREFIX))
+               and now - entry.stat().st_mtime >= ttl]
+    keep = set(held()) if expired and held is not None else set()
+    removed, freed = 0, 0
+    for entry in expired:
+        if entry.name in keep:
+            continue
+        try:
+            # A new reference to identical bytes refreshes the mtime while held() runs
+            stat = os.stat(entry.path)
+            if now - stat.st_mtime < ttl:
+                continue
+            os.remove(entry.path)
+        except FileNotFoundError:
+            continue
+        removed += 1
+        freed += stat.st_size
+    return removed, freed
@@ -11,8 +11,6 @@ if "autorefresh" not in st.session_state:
 from streamlit_autorefresh import st_autorefresh
 st_autorefresh(interval=5000, key="autorefresh")
 
-if "recent_job_ids" not in st.session_state:
-    st.session_state.recent_job_ids = []
 if "metrics_history" not in st.session_state:
     st.session_state.metrics_history = []
 
@@ -20,6 +18,7 @@ st.sidebar.header("Upload Function & Submit Job")
 with st.sidebar.form("upload_form"):
     file = st.file_uploader("Code file (.py or .js)", type=["py", "js"])
     runtime = st.selectbox("Runtime", ["python", "node"])
+    name = st.text_input("Function name (optional)")
     payload = st.text_area("Payload (JSON)", value="{}", height=100)
     submit_upload = st.form_submit_button("Upload & Submit Job")
 
@@ -58,14 +57,13 @@ upload_result = None
 if submit_upload and file:
     files = {"file": (file.name, file, "application/octet-stream")}
     data = {"runtime": runtime, "payload": payload}
+    if name:
+        data["name"] = name
     try:
         resp = requests.post("http://localhost:5000/upload", files=files, data=data)
         upload_result = resp.json()
         job_id = upload_result.get("job_id")
-        st.sidebar.success(f"Job submitted! Job ID: {job_id}")
-        # Store job_id in session state
-        if job_id:
-            st.session_state.recent_job_ids = [job_id] + st.session_state.recent_job_ids[:19]
+        st.sidebar.success(f"{upload_result.get('function')} v{upload_result.get('version')} submitted! Job ID: {job_id}")
     except Exception as e:
         st.sidebar.error(f"Upload failed: {e}")
 
@@ -91,23 +89,23 @@ else:
 
 # --- Recent Jobs Table ---
 st.header("Recent Jobs")
-N = 10
 recent_jobs = []
-for jid in st.session_state.recent_job_ids[:N]:
-    try:
-        resp = requests.get(f"http://localhost:5000/status/{jid}")
-        if resp.ok:
-            job = resp.json()
-            recent_jobs.append({
-                "job_id": jid,
+try:
+    resp = requests.get("http://localhost:5000/jobs", params={"limit": 10})
+    if resp.ok:
+        recent_jobs = [
+            {
+                "job_id": job["job_id"],
+                "function": job.get("function", ""),
                 "runtime": job.get("runtime", ""),
                 "status": job.get("status", ""),
-                "retries": job.get("retries", 0),
                 "execution_time": job.get("execution_time", 0),
                 "cost": job.get("cost", 0.0),
-            })
-    except Exception:
-        continue
+            }
+            for job in resp.json().get("jobs", [])
+        ]
+except Exception:
+    pass
 
 if recent_jobs:
     st.dataframe(recent_jobs)
@@ -0,0 +1,89 @@
+import os
+
+from rq.job import JobStatus
+
+from jobmeta import run_info
+
+EVENTS_KEY = 'jobs:events'
+# The stream is trimmed to roughly this many events
+MAX_EVENTS = int(os.environ.get('EVENTS_MAX_LEN', 10000))
+NUMERIC_FIELDS = ('execution_time', 'cost')
+
+
+def publish(redis_conn, job, status, pipeline=None):
+    """Append a completion event for job to the events stream"""
+    conn = pipeline if pipeline is not None else redis_conn
+    run = run_info(job.meta)
+    conn.xadd(EVENTS_KEY, {
+        'job_id': job.id,
+        'status': status,
+        'function': job.args[0] if job.args else '',
+        'queue': job.origin,
+        'execution_time': round(run['execution_time'] or 0.0, 6),
+        'cost': run['cost'] or 0.0,
+    }, maxlen=MAX_EVENTS, approximate=True)
+
+
+def _newest_id(newest):
+    return newest[0][0].decode() if newest else '0-0'
+
+
+def last_event_id(redis_conn):
+    """Id of the newest event, to read only events published after this call"""
+    return _newest_id(redis_conn.xrevrange(EVENTS_KEY, '+', '-', count=1))
+
+
+def decode_events(entries, last_id):
+    """Turn raw stream entries into ([(event_id, event), ...], new_last_id)"""
+    events = []
+    for event_id, fields in entries:
+        event = {k.decode(): v.decode() for k, v in fields.items()}
+        for field in NUMERIC_FIELDS:
+            event[field] = float(event[field])
+        last_id = event_id.decode()
+        events.append((last_id, event))
+    return events, last_id
+
+
+def read_events(redis_conn, last_id, block_ms, count=100):
+    """
+    Block up to block_ms for events after last_id.
+    Returns ([(event_id, event), ...], new_last_id).
+    """
+    response = redis_conn.xread({EVENTS_KEY: last_id}, count=count, block=max(1, block_ms))
+    return decode_events(response[0][1] if response else [], last_id)
+
+
+async def last_event_id_async(redis_conn):
+    """last_event_id for a redis.asyncio client"""
+    return _newest_id(await redis_conn.xrevrange(EVENTS_KEY, '+', '-', count=1))
+
+
+async def read_events_async(redis_conn, last_id, block_ms, count=100):
+    """read_events for a redis.asyncio client"""
+    response = await redis_conn.xread({EVENTS_KEY: last_id}, count=count, block=max(1, block_ms))
+    return decode_events(response[0][1] if response else [], last_id)
+
+
+class NotifyingWorkerMixin:
+    """
+    Worker mixin that publishes an event once a job's outcome is stored,
+    so listeners never see an event before the job's result or status.
+    """
+
+    def handle_job_success(self, job, queue, started_job_registry):
+        super().handle_job_success(job, queue, started_job_registry)
+        publish(self.connection, job, JobStatus.FINISHED)
+
+    def handle_job_failure(self, job, queue, started_job_registry=None, exc_string=''):
+        super().handle_job_failure(job, queue, started_job_registry=started_job_registry, exc_string=exc_string)
+        # A job with retries left is requeued rather than failed
+        if job.get_status(refresh=False) == JobStatus.FAILED:
+            publish(self.connection, job, JobStatus.FAILED)
+
+
+def notifying(worker_class):
+    """Return worker_class with completion events, subclassing it if needed"""
+    if issubclass(worker_class, NotifyingWorkerMixin):
+        return worker_class
+    return type(f"Notifying{worker_class.__name__}", (NotifyingWorkerMixin, worker_class), {})
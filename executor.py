@@ -1,21 +1,149 @@
 import json
 import os
 import time
+import uuid
 import logging
-import importlib.util
+import traceback
+import threading
 import subprocess
 from rq import get_current_job
 from redis import Redis
+from warm_pool import get_pool
+from module_cache import ModuleCache, call_batch, call_handler
+from result_cache import ResultCache, cache_key
+from scaling import record_completion
+from job_index import INDEXED_FUNCTIONS, record_finished
+from blobs import BLOB_DIR, blob_path, is_ref, load, offload
+from serialization import BINARY, JSON, get_codec, json_default
+from accounting import DockerStatsSampler, Usage, measure, price, record_usage
+from joblogs import JobLog, capture_output
+from jobmeta import pack_run, run_info
+from telemetry import record_job
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 redis_conn = Redis(host='localhost', port=6379)
+module_cache = ModuleCache(maxsize=int(os.environ.get('MODULE_CACHE_SIZE', 128)))
+result_cache = ResultCache(redis_conn)
+
+def _decode_stdout(stdout):
+    """A container's result: its stdout parsed as JSON, or the text itself if it is not JSON"""
+    text = stdout.strip()
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+def _pump(pipe, chunks, stream, log):
+    """Collect a container's output from pipe, copying each line to log as it arrives"""
+    for line in pipe:
+        chunks.append(line)
+        if log is not None:
+            log.write(stream, line)
+
+def _run_docker(image, interpreter, filename, payload, label, usage=None, log=None):
+    """
+    Run functions/<filename> in a fresh container and return its result.
+    Containers only speak JSON: offloaded payloads are mounted read-only
+    as a JSON file named by PAYLOAD_FILE instead of being passed inline in
+    PAYLOAD, and payloads from other codecs are transcoded first. The
+    container's sampled resource usage is added to usage, and its stdout
+    and stderr are written to log while it runs, if given.
+    """
+    container = f"job-{uuid.uuid4().hex[:12]}"
+    docker_cmd = ["docker", "run", "--rm", "--name", container, "-v", f"{os.path.abspath('functions')}:/app"]
+    if is_ref(payload) and payload.get('content_type') not in (JSON, BINARY):
+        payload = offload(load(payload), threshold=0)
+    if is_ref(payload):
+        docker_cmd += ["-v", f"{BLOB_DIR}:/blobs:ro",
+                       "-e", f"PAYLOAD_FILE=/blobs/{os.path.basename(blob_path(payload))}"]
+    else:
+        docker_cmd += ["-e", f"PAYLOAD={json.dumps(payload, default=json_default)}"]
+    docker_cmd += [image, interpreter, f"/app/{filename}"]
+    stdout, stderr = [], []
+    with DockerStatsSampler(container) as sampler:
+        proc = subprocess.Popen(docker_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        readers = [threading.Thread(target=_pump, args=(proc.stdout, stdout, 'stdout', log), daemon=True),
+                   threading.Thread(target=_pump, args=(proc.stderr, stderr, 'stderr', log), daemon=True)]
+        for reader in readers:
+            reader.start()
+        try:
+            proc.wait(timeout=300)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+            raise
+        finally:
+            for reader in readers:
+                reader.join()
+    if usage is not None:
+        # A container that exited before it could be sampled used unknown CPU
+        # and memory; they are reported as unmeasured rather than guessed
+        usage.add(sampler.usage if sampler.samples else Usage(unmeasured=True))
+    if proc.returncode != 0:
+        raise RuntimeError(f"{label} Docker execution failed: {''.join(stderr)}")
+    return _decode_stdout(''.join(stdout))
+
+def _run_legacy(module_name, payload):
+    """
+    Import functions/<module_name>.py in-process and call its handler.
+    Registered functions are named by content hash, so their compiled
+    modules are shared by every version and name with the same code.
+    Returns (result, cache_hit).
+    """
+    module_path = f"functions/{module_name}.py"
+    if not os.path.exists(module_path):
+        raise ImportError(f"Function {module_name} not found")
+    module, cache_hit = module_cache.load(module_name, module_path)
+    if not hasattr(module, 'handler'):
+        raise AttributeError(f"Function {module_name} missing handler function")
+    return call_handler(module.handler, payload), cache_hit
+
+def _record_meta(job, execution_time, success, runtime, filename, worker_tag, usage=None, **details):
+    """
+    Fill in the job.meta bookkeeping shared by every runtime, packed by
+    jobmeta.pack_run with details (queue_wait, batch_size, cache hits);
+    returns the job cost, priced from usage (wall time alone if it was
+    not measured)
+    """
+    usage = usage or Usage(wall=execution_time)
+    cost = price(usage)
+    retries = getattr(job, 'retry_count', 0) if success else getattr(job, 'retries_left', 0)
+    pack_run(job.meta, execution_time, round(cost, 4), retries, usage.as_dict(), **details)
+    job.meta['worker_tag'] = worker_tag
+    job.meta['runtime'] = runtime
+    job.meta['filename'] = filename
+    return cost
+
+def _record_outcome(pipeline, job, function_name, worker_tag, success, cost, execution_time, queue_wait, log=None):
+    """
+    Add everything recorded when a job ends to pipeline: its meta, usage,
+    scaling stats, /jobs record (for jobs the API lists), latency
+    histograms and the end of its log
+    """
+    status = 'finished' if success else 'failed'
+    pipeline.hset(job.key, 'meta', job.serializer.dumps(job.meta))
+    record_usage(redis_conn, function_name, worker_tag, run_info(job.meta)['usage'], cost, success=success,
+                 pipeline=pipeline)
+    record_completion(redis_conn, job.origin, function_name, execution_time, queue_wait, pipeline=pipeline)
+    if job.func_name in INDEXED_FUNCTIONS:
+        record_finished(redis_conn, job, status, pipeline=pipeline)
+    record_job(redis_conn, job, pipeline=pipeline)
+    if log is not None:
+        log.close(status, pipeline=pipeline)
+
+def _queue_wait(job):
+    """Seconds between enqueue and start, or None if either is unknown"""
+    if job.enqueued_at is None or job.started_at is None:
+        return None
+    return max(0.0, (job.started_at - job.enqueued_at).total_seconds())
 
 def run_job(function_name, payload, **kwargs):
     """
     Execute a function with the given payload.
-    Supports both Python and Node runtimes.
+    Supports Python and Node Docker runtimes, the warm process
+    pool runtime ('pool') and legacy in-process import.
     """
     worker_tag = os.environ.get('WORKER_TAG', 'unknown-worker')
     job = get_current_job()
@@ -24,94 +152,147 @@ def run_job(function_name, payload, **kwargs):
     # Get runtime and filename from job meta or kwargs
     runtime = None
     filename = None
+    codec = None
     if hasattr(job, 'meta'):
         runtime = job.meta.get('runtime')
         filename = job.meta.get('filename')
+        codec = job.meta.get('codec')
     if not runtime:
         runtime = kwargs.get('runtime', 'python')
     if not filename:
         filename = kwargs.get('filename', f"{function_name}.py")
 
     logger.info(f"Starting job {job.id} for function {function_name} (runtime={runtime}, filename={filename})")
-
-    base_cost = 0.01  # base cost per job
-    time_rate = 0.05  # cost per second
+    # The worker marked it started in /jobs (job_index.IndexedJob); the rest
+    # of its bookkeeping is written in one round trip when it ends
+    queue_wait = _queue_wait(job)
+    details = {'queue_wait': queue_wait}
+    cached = None
+    usage = None
+    # stdout and stderr, readable at /logs/<job_id> while the job runs
+    log = JobLog(redis_conn, job.id)
     try:
         result = None
         file_path = os.path.join("functions", filename)
         if not os.path.exists(file_path):
             raise ImportError(f"Function file {filename} not found")
-        if runtime == "python":
-            docker_cmd = [
-                "docker", "run", "--rm",
-                "-v", f"{os.path.abspath('functions')}:/app",
-                "-e", f"PAYLOAD={json.dumps(payload)}",
-                "python:3.11",
-                "python", f"/app/{filename}"
-            ]
-            proc = subprocess.run(
-                docker_cmd,
-                capture_output=True,
-                text=True,
-                timeout=300
-            )
-            if proc.returncode != 0:
-                raise RuntimeError(f"Python Docker execution failed: {proc.stderr}")
-            result = proc.stdout.strip()
-        elif runtime == "node":
-            docker_cmd = [
-                "docker", "run", "--rm",
-                "-v", f"{os.path.abspath('functions')}:/app",
-                "-e", f"PAYLOAD={json.dumps(payload)}",
-                "node:18",
-                "node", f"/app/{filename}"
-            ]
-            proc = subprocess.run(
-                docker_cmd,
-                capture_output=True,
-                text=True,
-                timeout=300
-            )
-            if proc.returncode != 0:
-                raise RuntimeError(f"Node Docker execution failed: {proc.stderr}")
-            result = proc.stdout.strip()
-        else:
-            # Default: Python import-based execution (legacy)
-            module_path = f"functions/{function_name}.py"
-            if not os.path.exists(module_path):
-                raise ImportError(f"Function {function_name} not found")
-            spec = importlib.util.spec_from_file_location(function_name, module_path)
-            module = importlib.util.module_from_spec(spec)
-            spec.loader.exec_module(module)
-            if not hasattr(module, 'handler'):
-                raise AttributeError(f"Function {function_name} missing handler function")
-            result = module.handler(payload)
+        # Pure functions (CACHEABLE = True) are served from the result cache
+        cached = cache_key(file_path, runtime, payload)
+        cache_hit = False
+        if cached:
+            cache_hit, result = result_cache.get(cached[0])
+            details['result_cache_hit'] = cache_hit
+        # CPU, memory and I/O of the run, wherever it happens
+        with measure() as usage:
+            if cache_hit:
+                logger.info(f"Job {job.id} served from result cache")
+            elif runtime == "python":
+                result = _run_docker("python:3.11", "python", filename, payload, "Python", usage, log)
+            elif runtime == "node":
+                result = _run_docker("node:18", "node", filename, payload, "Node", usage, log)
+            elif runtime == "pool":
+                result = get_pool().call(filename.rsplit('.', 1)[0], payload, codec, usage, log)
+            else:
+                # Default: Python import-based execution (legacy)
+                with capture_output(log):
+                    result, details['module_cache_hit'] = _run_legacy(filename.rsplit('.', 1)[0], load(payload))
+        # Large results are kept out of the job hash, encoded with the job's
+        # codec; /status returns a reference
+        result = offload(result, codec=get_codec(codec))
 
         execution_time = time.time() - start_time
-        cost = base_cost + execution_time * time_rate
-        # Store metadata
-        job.meta['execution_time'] = execution_time
-        job.meta['worker_tag'] = worker_tag
-        job.meta['retries'] = getattr(job, 'retry_count', 0)
-        job.meta['success'] = True
-        job.meta['cost'] = round(cost, 4)
-        job.meta['runtime'] = runtime
-        job.meta['filename'] = filename
-        job.save_meta()
-        redis_conn.incrbyfloat("total_cost", cost)
+        cost = _record_meta(job, execution_time, True, runtime, filename, worker_tag, usage, **details)
+        with redis_conn.pipeline(transaction=False) as pipe:
+            pipe.incrbyfloat("total_cost", cost)
+            _record_outcome(pipe, job, function_name, worker_tag, True, cost, execution_time, queue_wait, log)
+            pipe.execute()
+        if cached:
+            if not cache_hit:
+                result_cache.put(cached[0], result, cached[1])
+            result_cache.settle(cached[0], job.id, cached[1])
         logger.info(f"Job {job.id} completed in {execution_time:.3f}s, cost: ${cost:.4f}")
         return result
 
     except Exception as e:
         execution_time = time.time() - start_time
-        cost = base_cost + execution_time * time_rate
-        job.meta['execution_time'] = execution_time
-        job.meta['retries'] = getattr(job, 'retries_left', 0)
-        job.meta['success'] = False
-        job.meta['worker_tag'] = worker_tag
-        job.meta['cost'] = round(cost, 4)
-        job.meta['runtime'] = runtime
-        job.meta['filename'] = filename
-        job.save_meta()
+        cost = _record_meta(job, execution_time, False, runtime, filename, worker_tag, usage, **details)
+        with redis_conn.pipeline(transaction=False) as pipe:
+            _record_outcome(pipe, job, function_name, worker_tag, False, cost, execution_time, queue_wait, log)
+            pipe.execute()
+        if cached:
+            result_cache.release(cached[0], job.id)
         logger.error(f"Job {job.id} failed after {execution_time:.3f}s, cost: ${cost:.4f}: {str(e)}")
-        raise
\ No newline at end of file
+        raise
+
+def run_payloads(runtime, filename, payloads, codec=None, offload_results=True, usage=None, log=None):
+    """
+    Run functions/<filename> over payloads: in one runtime call for the
+    pool and legacy runtimes, one container each for Docker. Large results
+    are offloaded unless offload_results is false. Usage of the pool
+    process or containers is added to usage, if given; in-process work is
+    left to the caller's measure(). Output goes to log, if given. Returns
+    [(ok, result_or_traceback), ...] in payload order.
+    """
+    module_name = filename.rsplit('.', 1)[0]
+    if runtime == "pool":
+        outcomes = get_pool().call_batch(module_name, payloads, codec, usage, log)
+    elif runtime in ("python", "node"):
+        image, interpreter, label = ("python:3.11", "python", "Python") if runtime == "python" \
+            else ("node:18", "node", "Node")
+        outcomes = []
+        for payload in payloads:
+            try:
+                outcomes.append((True, _run_docker(image, interpreter, filename, offload(payload), label,
+                                                   usage, log)))
+            except Exception:
+                outcomes.append((False, traceback.format_exc()))
+    else:
+        module_path = f"functions/{module_name}.py"
+        if not os.path.exists(module_path):
+            raise ImportError(f"Function {module_name} not found")
+        module, _ = module_cache.load(module_name, module_path)
+        with capture_output(log):
+            outcomes = call_batch(module, [load(payload) for payload in payloads])
+    if not offload_results:
+        return outcomes
+    return [(ok, offload(result, codec=get_codec(codec)) if ok else result) for ok, result in outcomes]
+
+def run_batch(jobs):
+    """
+    Execute queued run_job jobs for the same function in one runtime call.
+    Used by the batching worker; each job's meta is filled in but not saved.
+    Returns ([(ok, result_or_traceback), ...], total_cost) in job order.
+    """
+    worker_tag = os.environ.get('WORKER_TAG', 'unknown-worker')
+    function_name = jobs[0].args[0]
+    runtime = jobs[0].meta.get('runtime')
+    filename = jobs[0].meta.get('filename') or f"{function_name}.py"
+    # Batches never mix codecs (see batching.batch_key)
+    codec = jobs[0].meta.get('codec')
+    payloads = [job.args[1] for job in jobs]
+    start_time = time.time()
+
+    with measure() as usage:
+        try:
+            outcomes = run_payloads(runtime, filename, payloads, codec, usage=usage)
+        except Exception:
+            outcomes = [(False, traceback.format_exc())] * len(jobs)
+
+    # Per-job time and usage are the batch's split evenly across its jobs
+    execution_time = (time.time() - start_time) / len(jobs)
+    share = usage.share(len(jobs))
+    total_cost = 0.0
+    file_path = os.path.join("functions", filename)
+    for job, (ok, result) in zip(jobs, outcomes):
+        cost = _record_meta(job, execution_time, ok, runtime, filename, worker_tag, share,
+                            queue_wait=_queue_wait(job), batch_size=len(jobs))
+        if ok:
+            total_cost += cost
+        cached = cache_key(file_path, runtime, job.args[1])
+        if cached and ok:
+            result_cache.put(cached[0], result, cached[1])
+            result_cache.settle(cached[0], job.id, cached[1])
+        elif cached:
+            result_cache.release(cached[0], job.id)
+    logger.info(f"Batch of {len(jobs)} {function_name} jobs completed in {execution_time * len(jobs):.3f}s")
+    return outcomes, total_cost
@@ -0,0 +1,141 @@
+"""
+Helpers for array-aware handlers.
+
+Operands arrive as NumPy arrays (msgpack and Arrow payloads), lists
+(JSON payloads) or plain numbers. Arrays and lists are computed with one
+vectorized NumPy operation, element by element; plain numbers keep
+Python's semantics, so scalar payloads return exactly what they did.
+Without NumPy (the python:3.11 container has none) lists are computed
+element by element in Python instead.
+
+Handlers import this module as functions.arrays in the worker and the
+warm pool, and as arrays in a container, where it sits beside them.
+"""
+import contextlib
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Integers up to this magnitude are batched in int64 without overflowing it
+BATCH_INT_LIMIT = 2 ** 31
+
+
+def is_array(value):
+    return np is not None and isinstance(value, np.ndarray)
+
+
+def is_vector(value):
+    """Operands computed element by element: arrays, lists and tuples"""
+    return is_array(value) or isinstance(value, (list, tuple))
+
+
+def as_array(value, dtype=None):
+    """value as an ndarray; arrays of the right dtype are returned without copying"""
+    return np.asarray(value, dtype=dtype)
+
+
+def to_python(value):
+    """NumPy scalars become Python numbers; arrays and everything else are left alone"""
+    if np is not None and isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def jsonable(value):
+    """json.dumps default for array results"""
+    if is_array(value) or (np is not None and isinstance(value, np.generic)):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def elementwise(op, a, b):
+    """op(a, b), broadcast element by element when either operand is an array or list"""
+    if not (is_vector(a) or is_vector(b)):
+        return op(a, b)
+    if np is not None:
+        return to_python(op(as_array(a), as_array(b)))
+    if is_vector(a) and is_vector(b):
+        if len(a) != len(b):
+            raise ValueError(f"operands have different lengths: {len(a)} and {len(b)}")
+        return [op(x, y) for x, y in zip(a, b)]
+    if is_vector(a):
+        return [op(x, b) for x in a]
+    return [op(a, y) for y in b]
+
+
+def ignore_float_errors():
+    """Context in which NumPy division by zero gives inf or nan without warning"""
+    if np is None:
+        return contextlib.nullcontext()
+    return np.errstate(divide='ignore', invalid='ignore')
+
+
+def power(base, exp):
+    """base ** exp; integer arrays raised to negative powers give floats, as Python's ints do"""
+    if is_array(exp) and exp.dtype.kind in 'iu' and (exp < 0).any():
+        base = as_array(base, np.float64)
+    return base ** exp
+
+
+def total(numbers):
+    """
+    Sum of a list or array of numbers. A 2-D array or a list of lists is a
+    batch: each row is summed, giving an array or list of sums.
+    """
+    if is_array(numbers):
+        return to_python(numbers.sum(axis=-1) if numbers.ndim else numbers)
+    if numbers and is_vector(numbers[0]):
+        return [total(row) for row in numbers]
+    return sum(numbers)
+
+
+def _vectorized(op, payloads, operands, safe):
+    """op over every payload's operands at once, or None unless they are all ints or all floats"""
+    (a_name, a_default), (b_name, b_default) = operands
+    try:
+        a = [payload.get(a_name, a_default) for payload in payloads]
+        b = [payload.get(b_name, b_default) for payload in payloads]
+    except AttributeError:  # a payload that is not a dict
+        return None
+    kinds = set(map(type, a)) | set(map(type, b))
+    if kinds == {int}:
+        dtype = np.int64
+    elif kinds == {float}:
+        dtype = np.float64
+    else:
+        return None
+    try:
+        a, b = as_array(a, dtype), as_array(b, dtype)
+    except OverflowError:
+        return None
+    if dtype is np.int64 and max(np.abs(a).max(), np.abs(b).max()) >= BATCH_INT_LIMIT:
+        return None
+    if safe is not None and not safe(a, b):
+        return None
+    return op(a, b).tolist()
+
+
+def batch_binary(op, handler, payloads, operands, safe=None):
+    """
+    handler_batch for a binary operation over two payload fields. When
+    every payload's operands are ints (small enough for int64) or every
+    one's are floats, they are stacked into two arrays and computed in one
+    vectorized op; otherwise handler is called per payload. operands is
+    ((name, default), (name, default)). safe(a, b), if given, checks the
+    stacked arrays for values that need handler's special casing (e.g.
+    division by zero). A payload whose handler call raises gets the
+    exception as its result.
+    """
+    if np is not None and payloads:
+        results = _vectorized(op, payloads, operands, safe)
+        if results is not None:
+            return results
+    results = []
+    for payload in payloads:
+        try:
+            results.append(handler(payload))
+        except Exception as e:
+            results.append(e)
+    return results
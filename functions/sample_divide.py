@@ -1,15 +1,37 @@
 import os
 import json
+import operator
 
+try:
+    from functions.arrays import batch_binary, elementwise, ignore_float_errors, is_vector, jsonable
+except ImportError:
+    # In a container the helpers sit beside this script in /app
+    from arrays import batch_binary, elementwise, ignore_float_errors, is_vector, jsonable
+
+CACHEABLE = True
+
+# a and b may be numbers, or arrays or lists divided element by element
 def handler(payload):
     a = payload.get("a", 0)
     b = payload.get("b", 1)
+    if is_vector(a) or is_vector(b):
+        # A zero divisor in an array gives inf or nan, as in NumPy
+        with ignore_float_errors():
+            return elementwise(operator.truediv, a, b)
     try:
         return a / b
     except ZeroDivisionError:
         return "Error: divide by zero"
 
+def handler_batch(payloads):
+    # Numeric operands of a whole micro-batch are computed in one vectorized op
+    return batch_binary(operator.truediv, handler, payloads, (("a", 0), ("b", 1)), safe=lambda a, b: b.all())
+
 if __name__ == "__main__":
-    payload = os.environ.get("PAYLOAD", "{}")
-    data = json.loads(payload)
-    print(handler(data))
+    # Large payloads are mounted as a file instead
+    if "PAYLOAD_FILE" in os.environ:
+        with open(os.environ["PAYLOAD_FILE"]) as f:
+            data = json.load(f)
+    else:
+        data = json.loads(os.environ.get("PAYLOAD", "{}"))
+    print(json.dumps(handler(data), default=jsonable))
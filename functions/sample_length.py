@@ -1,11 +1,17 @@
 import os
 import json
 
+CACHEABLE = True
+
 def handler(payload):
     data = payload.get("data", [])
     return len(data)
 
 if __name__ == "__main__":
-    payload = os.environ.get("PAYLOAD", "{}")
-    data = json.loads(payload)
-    print(handler(data))
+    # Large payloads are mounted as a file instead
+    if "PAYLOAD_FILE" in os.environ:
+        with open(os.environ["PAYLOAD_FILE"]) as f:
+            data = json.load(f)
+    else:
+        data = json.loads(os.environ.get("PAYLOAD", "{}"))
+    print(json.dumps(handler(data)))
@@ -1,12 +1,25 @@
 import os
 import json
 
+try:
+    from functions.arrays import elementwise, jsonable, power
+except ImportError:
+    # In a container the helpers sit beside this script in /app
+    from arrays import elementwise, jsonable, power
+
+CACHEABLE = True
+
+# base and exp may be numbers, or arrays or lists raised element by element
 def handler(payload):
     base = payload.get("base", 0)
     exp = payload.get("exp", 1)
-    return base ** exp
+    return elementwise(power, base, exp)
 
 if __name__ == "__main__":
-    payload = os.environ.get("PAYLOAD", "{}")
-    data = json.loads(payload)
-    print(handler(data))
+    # Large payloads are mounted as a file instead
+    if "PAYLOAD_FILE" in os.environ:
+        with open(os.environ["PAYLOAD_FILE"]) as f:
+            data = json.load(f)
+    else:
+        data = json.loads(os.environ.get("PAYLOAD", "{}"))
+    print(json.dumps(handler(data), default=jsonable))
@@ -1,12 +1,30 @@
 import os
 import json
+import operator
 
+try:
+    from functions.arrays import batch_binary, elementwise, jsonable
+except ImportError:
+    # In a container the helpers sit beside this script in /app
+    from arrays import batch_binary, elementwise, jsonable
+
+CACHEABLE = True
+
+# a and b may be numbers, or arrays or lists subtracted element by element
 def handler(payload):
     a = payload.get("a", 0)
     b = payload.get("b", 0)
-    return a - b
+    return elementwise(operator.sub, a, b)
+
+def handler_batch(payloads):
+    # Numeric operands of a whole micro-batch are computed in one vectorized op
+    return batch_binary(operator.sub, handler, payloads, (("a", 0), ("b", 0)))
 
 if __name__ == "__main__":
-    payload = os.environ.get("PAYLOAD", "{}")
-    data = json.loads(payload)
-    print(handler(data))
+    # Large payloads are mounted as a file instead
+    if "PAYLOAD_FILE" in os.environ:
+        with open(os.environ["PAYLOAD_FILE"]) as f:
+            data = json.load(f)
+    else:
+        data = json.loads(os.environ.get("PAYLOAD", "{}"))
+    print(json.dumps(handler(data), default=jsonable))
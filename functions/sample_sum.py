@@ -1,7 +1,25 @@
 import os
 import json
 
-payload = os.environ.get("PAYLOAD", "{}")
-data = json.loads(payload)
-numbers = data.get("numbers", [])
-print(sum(numbers))
\ No newline at end of file
+try:
+    from functions.arrays import jsonable, total
+except ImportError:
+    # In a container the helpers sit beside this script in /app
+    from arrays import jsonable, total
+
+CACHEABLE = True
+
+# numbers may be a list or an array; a list of lists or a 2-D array is a
+# batch whose rows are summed separately
+def handler(payload):
+    numbers = payload.get("numbers", [])
+    return total(numbers)
+
+if __name__ == "__main__":
+    # Large payloads are mounted as a file instead
+    if "PAYLOAD_FILE" in os.environ:
+        with open(os.environ["PAYLOAD_FILE"]) as f:
+            data = json.load(f)
+    else:
+        data = json.loads(os.environ.get("PAYLOAD", "{}"))
+    print(json.dumps(handler(data), default=jsonable))
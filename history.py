@@ -0,0 +1,232 @@
+"""
+Job history: how long finished jobs stay in Redis, and the Parquet
+archive they move to.
+
+RQ keeps a finished job's hash, meta and result for JOB_RESULT_TTL
+seconds and a failed one's for JOB_FAILURE_TTL. The compact per-job
+record that /jobs lists (see job_index) outlives both; once a job has
+ended and was enqueued over ARCHIVE_AFTER seconds ago, the archiver moves
+its record, in batches, to Parquet files partitioned by enqueue day
+(end day for records without an enqueue time):
+
+    archive/day=2026-10-18/part-<batch digest>.parquet
+
+A batch's file is named after its job ids, so a batch archived again
+after a crash between writing and deleting replaces its own file. /history
+aggregates cost and latency per function and day from the archive, reading
+only the days and columns a query needs.
+"""
+import os
+import time
+import hashlib
+from datetime import date, datetime, timedelta, timezone
+
+from job_index import ALL_KEY, RECORD_KEY, index_key
+
+JOB_RESULT_TTL = int(os.environ.get('JOB_RESULT_TTL', 500))
+JOB_FAILURE_TTL = int(os.environ.get('JOB_FAILURE_TTL', 7 * 86400))
+
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', 'archive')
+ARCHIVE_AFTER = float(os.environ.get('ARCHIVE_AFTER', 3600))
+ARCHIVE_BATCH = int(os.environ.get('ARCHIVE_BATCH', 10000))
+ARCHIVE_INTERVAL = float(os.environ.get('ARCHIVE_INTERVAL', 300))
+
+TERMINAL_STATUSES = ('finished', 'failed', 'canceled')
+STRING_COLUMNS = ('job_id', 'function', 'queue', 'runtime', 'status', 'worker_tag')
+FLOAT_COLUMNS = ('queue_wait', 'execution_time', 'end_to_end', 'cost', 'cpu_seconds', 'max_rss_mb', 'io_bytes')
+GROUP_FIELDS = ('function', 'day', 'worker_tag', 'queue', 'runtime', 'status')
+LATENCY_COLUMNS = ('queue_wait', 'execution_time', 'end_to_end')
+QUANTILES = (0.5, 0.95, 0.99)
+MAX_HISTORY_DAYS = int(os.environ.get('MAX_HISTORY_DAYS', 366))
+
+
+class RetainingWorkerMixin:
+    """
+    Worker mixin applying JOB_RESULT_TTL to finished jobs and
+    JOB_FAILURE_TTL to failed ones that were enqueued without their own
+    """
+    default_failure_ttl = JOB_FAILURE_TTL
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('default_result_ttl', JOB_RESULT_TTL)
+        super().__init__(*args, **kwargs)
+
+    def handle_job_failure(self, job, *args, **kwargs):
+        if job.failure_ttl is None:
+            job.failure_ttl = self.default_failure_ttl
+        return super().handle_job_failure(job, *args, **kwargs)
+
+
+def retaining(worker_class):
+    """Return a subclass of worker_class that expires job data after the configured TTLs"""
+    return type(f"Retaining{worker_class.__name__}", (RetainingWorkerMixin, worker_class), {})
+
+
+def _timestamp(value):
+    return datetime.fromtimestamp(float(value), timezone.utc) if value else None
+
+
+def _schema():
+    import pyarrow as pa
+    return pa.schema([(name, pa.string()) for name in STRING_COLUMNS]
+                     + [('enqueued_at', pa.timestamp('us', tz='UTC')), ('ended_at', pa.timestamp('us', tz='UTC'))]
+                     + [(name, pa.float64()) for name in FLOAT_COLUMNS])
+
+
+def _row(job_id, record):
+    record = {key.decode(): value.decode() for key, value in record.items()}
+    enqueued_at, ended_at = float(record.get('enqueued_at') or 0), float(record.get('ended_at') or 0)
+    row = {'job_id': job_id, **{name: record.get(name) for name in STRING_COLUMNS[1:]},
+           'enqueued_at': _timestamp(enqueued_at), 'ended_at': _timestamp(ended_at),
+           'end_to_end': ended_at - enqueued_at if enqueued_at and ended_at else None}
+    for name in FLOAT_COLUMNS:
+        if name != 'end_to_end':
+            row[name] = float(record[name]) if record.get(name) else None
+    return row
+
+
+class Archiver:
+    """
+    Moves the job_index records of ended jobs enqueued over `after`
+    seconds ago from Redis to day-partitioned Parquet files under
+    directory. Jobs that are still queued or running are never touched,
+    and RQ's own job data is left to expire on its TTL.
+    """
+
+    def __init__(self, redis_conn, directory=ARCHIVE_DIR, after=ARCHIVE_AFTER, batch_size=ARCHIVE_BATCH):
+        self.redis = redis_conn
+        self.directory = directory
+        self.after = after
+        self.batch_size = batch_size
+
+    def _due(self, cutoff):
+        """Up to batch_size (job id, status) pairs of jobs in a terminal status enqueued before cutoff"""
+        due = []
+        for status in TERMINAL_STATUSES:
+            entries = self.redis.zrangebyscore(index_key('status', status), '-inf', cutoff,
+                                               start=0, num=self.batch_size - len(due))
+            due += [(job_id.decode(), status) for job_id in entries]
+            if len(due) >= self.batch_size:
+                break
+        return due
+
+    def _write(self, rows, digest):
+        """Write rows to one Parquet file per enqueue day; returns the paths written"""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        by_day = {}
+        for row in rows:
+            day = (row['enqueued_at'] or row['ended_at'] or datetime.fromtimestamp(0, timezone.utc)).date().isoformat()
+            by_day.setdefault(day, []).append(row)
+        schema = _schema()
+        paths = []
+        for day, day_rows in sorted(by_day.items()):
+            directory = os.path.join(self.directory, f"day={day}")
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"part-{digest}.parquet")
+            table = pa.Table.from_pylist(day_rows, schema=schema)
+            # Written aside and renamed, so readers never see half a file
+            tmp_path = f"{path}.tmp"
+            pq.write_table(table, tmp_path, compression='zstd')
+            os.replace(tmp_path, path)
+            paths.append(path)
+        return paths
+
+    def archive_batch(self, now=None):
+        """Archive one batch; returns the number of jobs moved"""
+        now = now if now is not None else time.time()
+        due = self._due(now - self.after)
+        if not due:
+            return 0
+        with self.redis.pipeline() as pipe:
+            for job_id, _ in due:
+                pipe.hgetall(RECORD_KEY.format(job_id=job_id))
+            records = pipe.execute()
+        rows = [_row(job_id, record) for (job_id, _), record in zip(due, records) if record]
+        digest = hashlib.sha1(','.join(job_id for job_id, _ in due).encode()).hexdigest()[:16]
+        if rows:
+            self._write(rows, digest)
+        with self.redis.pipeline() as pipe:
+            for (job_id, status), record in zip(due, records):
+                pipe.delete(RECORD_KEY.format(job_id=job_id))
+                pipe.zrem(ALL_KEY, job_id)
+                pipe.zrem(index_key('status', status), job_id)
+                for field in ('function', 'worker_tag'):
+                    value = record.get(field.encode())
+                    if value:
+                        pipe.zrem(index_key(field, value.decode()), job_id)
+            pipe.execute()
+        return len(due)
+
+    def run(self, now=None):
+        """Archive batches until no job is due; returns the number of jobs moved"""
+        total = 0
+        while True:
+            moved = self.archive_batch(now)
+            total += moved
+            if moved < self.batch_size:
+                return total
+
+
+def parse_day(value, default):
+    """A YYYY-MM-DD query parameter as a date; raises ValueError"""
+    if not value:
+        return default
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Invalid date {value}, expected YYYY-MM-DD") from None
+
+
+def query_history(directory=ARCHIVE_DIR, start=None, end=None, function=None, group_by=('function', 'day')):
+    """
+    Jobs, failures, cost and queue wait, execution and end-to-end latency
+    (mean and QUANTILES) of archived jobs enqueued from start to end (dates,
+    inclusive), grouped by group_by, optionally for one function. Only the
+    partitions of those days and the columns used are read.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    columns = sorted({'job_id', 'status', 'cost', *LATENCY_COLUMNS, *group_by} - {'day'})
+    if not os.path.isdir(directory):
+        return []
+    partitioning = ds.partitioning(pa.schema([('day', pa.string())]), flavor='hive')
+    dataset = ds.dataset(directory, format='parquet', partitioning=partitioning,
+                         exclude_invalid_files=True, ignore_prefixes=['.', '_'])
+    condition = (ds.field('day') >= start.isoformat()) & (ds.field('day') <= end.isoformat())
+    if function:
+        condition &= ds.field('function') == function
+    table = dataset.to_table(columns=columns + (['day'] if 'day' in group_by else []), filter=condition)
+    if table.num_rows == 0:
+        return []
+    table = table.append_column('failed', pc.cast(pc.equal(table['status'], 'failed'), pa.int64()))
+    quantiles = pc.TDigestOptions(q=list(QUANTILES))
+    aggregations = [('job_id', 'count'), ('failed', 'sum'), ('cost', 'sum')]
+    for column in LATENCY_COLUMNS:
+        aggregations += [(column, 'mean'), (column, 'tdigest', quantiles)]
+    grouped = table.group_by(list(group_by)).aggregate(aggregations).to_pylist()
+
+    rows = []
+    for entry in grouped:
+        row = {field: entry[field] for field in group_by}
+        row.update(jobs=entry['job_id_count'], failed=entry['failed_sum'], cost=round(entry['cost_sum'] or 0.0, 6))
+        for column in LATENCY_COLUMNS:
+            digest = entry[f"{column}_tdigest"] or []
+            row[column] = {'mean': None if entry[f"{column}_mean"] is None else round(entry[f"{column}_mean"], 6),
+                           **{f"p{int(q * 100)}": None if value is None or value != value else round(value, 6)
+                              for q, value in zip(QUANTILES, digest)}}
+        rows.append(row)
+    return sorted(rows, key=lambda row: tuple(str(row[field]) for field in group_by))
+
+
+def history_range(start, end, today=None):
+    """(start, end) dates of a /history query: the last 7 days by default, at most MAX_HISTORY_DAYS"""
+    today = today or datetime.now(timezone.utc).date()
+    end = end or today
+    start = start or end - timedelta(days=6)
+    if start > end:
+        raise ValueError('from must not be after to')
+    if (end - start).days >= MAX_HISTORY_DAYS:
+        raise ValueError(f'a history query spans at most {MAX_HISTORY_DAYS} days')
+    return start, end
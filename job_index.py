@@ -0,0 +1,179 @@
+import os
+import time
+from datetime import datetime, timezone
+
+from rq.job import Job
+
+from jobmeta import run_info
+
+ALL_KEY = 'jobs:index:all'
+INDEX_KEY = 'jobs:index:{field}:{value}'
+RECORD_KEY = 'jobs:record:{job_id}'
+
+# Fields /jobs can filter on; each has a sorted set per value, scored by enqueue time
+INDEXED_FIELDS = ('status', 'function', 'worker_tag')
+NUMERIC_FIELDS = ('execution_time', 'cost', 'queue_wait', 'cpu_seconds', 'max_rss_mb', 'io_bytes')
+STATUSES = ('queued', 'started', 'finished', 'failed', 'canceled')
+# Job functions whose jobs the API adds to the listing with record_enqueued
+INDEXED_FUNCTIONS = ('executor.run_job', 'mapreduce.run_map', 'pipelines.run_stages')
+
+
+def index_key(field, value):
+    return INDEX_KEY.format(field=field, value=value)
+
+
+def _score(job):
+    return job.enqueued_at.replace(tzinfo=timezone.utc).timestamp() if job.enqueued_at else 0.0
+
+
+def _set_status(conn, job, status):
+    # Retried jobs can come back from 'failed', so clear every other status
+    for other in STATUSES:
+        if other != status:
+            conn.zrem(index_key('status', other), job.id)
+    conn.zadd(index_key('status', status), {job.id: _score(job)})
+
+
+def record_enqueued(redis_conn, job, pipeline=None):
+    """
+    Add a freshly enqueued run_job job to the listing indexes. Like the
+    other record_* helpers, writes go through pipeline if one is given,
+    otherwise through a pipeline of their own.
+    """
+    conn = pipeline if pipeline is not None else redis_conn.pipeline()
+    score = _score(job)
+    function_name = job.args[0]
+    conn.hset(RECORD_KEY.format(job_id=job.id), mapping={
+        'function': function_name,
+        'queue': job.origin,
+        'runtime': job.meta.get('runtime') or '',
+        'status': 'queued',
+        'enqueued_at': score,
+    })
+    conn.zadd(ALL_KEY, {job.id: score})
+    _set_status(conn, job, 'queued')
+    conn.zadd(index_key('function', function_name), {job.id: score})
+    if pipeline is None:
+        conn.execute()
+
+
+def record_started(redis_conn, job, worker_tag, pipeline=None):
+    conn = pipeline if pipeline is not None else redis_conn.pipeline()
+    score = _score(job)
+    conn.hset(RECORD_KEY.format(job_id=job.id), mapping={'status': 'started', 'worker_tag': worker_tag})
+    _set_status(conn, job, 'started')
+    conn.zadd(index_key('worker_tag', worker_tag), {job.id: score})
+    if pipeline is None:
+        conn.execute()
+
+
+class IndexedJob(Job):
+    """
+    Job class for workers (their job_class) that marks listed jobs started
+    in the pipeline RQ sends before running a job, rather than in a round
+    trip of its own
+    """
+
+    def prepare_for_execution(self, worker_name, pipeline):
+        super().prepare_for_execution(worker_name, pipeline)
+        if self.func_name in INDEXED_FUNCTIONS:
+            record_started(None, self, os.environ.get('WORKER_TAG', 'unknown-worker'), pipeline=pipeline)
+
+
+def record_finished(redis_conn, job, status, pipeline=None, now=None):
+    """
+    Move job to the finished/failed index and store what job history keeps
+    of it: execution time, cost, queue wait, end time and resource usage
+    """
+    conn = pipeline if pipeline is not None else redis_conn.pipeline()
+    run = run_info(job.meta)
+    usage = run['usage'] or {}
+    fields = {
+        'status': status,
+        'execution_time': round(run['execution_time'] or 0.0, 6),
+        'cost': run['cost'] or 0.0,
+        'ended_at': now if now is not None else time.time(),
+        'cpu_seconds': round(usage.get('cpu_user', 0.0) + usage.get('cpu_sys', 0.0), 6),
+        'max_rss_mb': usage.get('max_rss_mb', 0.0),
+        'io_bytes': usage.get('io_read_bytes', 0) + usage.get('io_write_bytes', 0),
+    }
+    if run['queue_wait'] is not None:
+        fields['queue_wait'] = round(run['queue_wait'], 6)
+    conn.hset(RECORD_KEY.format(job_id=job.id), mapping=fields)
+    _set_status(conn, job, status)
+    if pipeline is None:
+        conn.execute()
+
+
+def encode_cursor(score, skip):
+    return f"{score}:{skip}"
+
+
+def decode_cursor(cursor):
+    """Raises ValueError for a malformed cursor"""
+    score, _, skip = cursor.rpartition(':')
+    return float(score), int(skip)
+
+
+def _format_record(job_id, record):
+    record = {k.decode(): v.decode() for k, v in record.items()}
+    for field in NUMERIC_FIELDS:
+        if field in record:
+            record[field] = float(record[field])
+    for field in ('enqueued_at', 'ended_at'):
+        if field in record:
+            record[field] = datetime.fromtimestamp(float(record[field]), timezone.utc).isoformat()
+    return {'job_id': job_id, **record}
+
+
+def query_jobs(redis_conn, filters=None, cursor=None, limit=50, max_scan=5000):
+    """
+    Return (jobs, next_cursor) for the newest jobs matching every filter
+    ({field: value} over INDEXED_FIELDS), newest first.
+
+    The smallest matching index drives the walk and the remaining filters
+    are checked against each job's record, so a page costs O(log N + scanned)
+    no matter how many jobs are stored. A walk stops after max_scan entries
+    even if the page is not full; next_cursor then resumes where it stopped.
+    next_cursor is None once the index is exhausted.
+
+    Cursors are (score, skip) pairs: the enqueue time of the last job
+    returned and how many jobs with exactly that score were already seen,
+    which keeps pages stable when jobs share an enqueue time.
+    """
+    filters = {field: value for field, value in (filters or {}).items() if value}
+    keys = [index_key(field, value) for field, value in filters.items()]
+    if len(keys) > 1:
+        with redis_conn.pipeline() as pipe:
+            for key in keys:
+                pipe.zcard(key)
+            sizes = pipe.execute()
+        driver = min(zip(sizes, keys))[1]
+    else:
+        driver = keys[0] if keys else ALL_KEY
+
+    max_score, skip = decode_cursor(cursor) if cursor else ('+inf', 0)
+    chunk = max(limit, 100)
+    jobs, scanned = [], 0
+    while len(jobs) < limit and scanned < max_scan:
+        entries = redis_conn.zrevrangebyscore(driver, max_score, '-inf', start=skip, num=chunk, withscores=True)
+        with redis_conn.pipeline() as pipe:
+            for job_id, _ in entries:
+                pipe.hgetall(RECORD_KEY.format(job_id=job_id.decode()))
+            records = pipe.execute()
+        consumed = 0
+        for (job_id, score), record in zip(entries, records):
+            if score == max_score:
+                skip += 1
+            else:
+                max_score, skip = score, 1
+            consumed += 1
+            if record and all(record.get(field.encode(), b'').decode() == value
+                              for field, value in filters.items()):
+                jobs.append(_format_record(job_id.decode(), record))
+                if len(jobs) == limit:
+                    break
+        scanned += consumed
+        if consumed == len(entries) and len(entries) < chunk:
+            return jobs, None
+    return jobs, encode_cursor(max_score, skip)
@@ -0,0 +1,223 @@
+"""
+Per-job stdout/stderr, kept in a Redis stream per job.
+
+Output is written while the job runs: lines from containers as they are
+printed, from in-process (legacy) handlers through a per-thread capture
+of sys.stdout and sys.stderr, and from the warm pool with each call's
+response. Lines are buffered and sent at most every JOB_LOG_FLUSH_INTERVAL
+seconds in one round trip. Each stream keeps roughly the last
+JOB_LOG_MAX_LINES lines and expires JOB_LOG_TTL seconds after its last
+write. A job's log ends with an 'end' entry, so /logs/<job_id>?follow=1
+knows when to stop.
+
+The process logs under logs/ rotate at LOG_MAX_BYTES, and /logs reads
+their tail by seeking back from the end of the file.
+"""
+import os
+import sys
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+
+JOB_LOG_KEY = 'joblog:{job_id}'  # entries {stream: stdout|stderr|end, line}
+JOB_LOG_MAX_LINES = int(os.environ.get('JOB_LOG_MAX_LINES', 1000))
+# Longer lines are cut to this many characters
+JOB_LOG_MAX_LINE = int(os.environ.get('JOB_LOG_MAX_LINE', 4096))
+JOB_LOG_TTL = int(os.environ.get('JOB_LOG_TTL', 86400))
+JOB_LOG_FLUSH_INTERVAL = float(os.environ.get('JOB_LOG_FLUSH_INTERVAL', 0.5))
+STREAMS = ('stdout', 'stderr')
+END = 'end'
+
+LOG_MAX_BYTES = int(os.environ.get('LOG_MAX_BYTES', 10 * 2 ** 20))
+LOG_BACKUPS = int(os.environ.get('LOG_BACKUPS', 5))
+LOG_READ_BLOCK = 8192
+
+
+class JobLog:
+    """
+    Buffered writer of one job's output. write() takes text in any
+    chunks; only whole lines are sent until close(). Lines are sent at
+    most flush_interval seconds after they are written, and at most
+    JOB_LOG_MAX_LINES lines are held between flushes.
+    """
+
+    def __init__(self, redis_conn, job_id, flush_interval=JOB_LOG_FLUSH_INTERVAL):
+        self.redis = redis_conn
+        self.key = JOB_LOG_KEY.format(job_id=job_id)
+        self.flush_interval = flush_interval
+        self._pending = deque(maxlen=JOB_LOG_MAX_LINES)
+        self._partial = dict.fromkeys(STREAMS, '')
+        self._last_flush = time.monotonic()
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def write(self, stream, text):
+        if not text:
+            return
+        with self._lock:
+            *lines, self._partial[stream] = (self._partial[stream] + text).split('\n')
+            self._pending.extend((stream, line[:JOB_LOG_MAX_LINE]) for line in lines)
+            wait = self.flush_interval - (time.monotonic() - self._last_flush)
+            if self._pending and wait > 0 and self._timer is None:
+                # A quiet job's last lines still go out on time
+                self._timer = threading.Timer(wait, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if self._pending and wait <= 0:
+            self.flush()
+
+    def flush(self, end=None, pipeline=None):
+        """
+        Send buffered lines, then an end entry recording status if end is
+        given; through pipeline, without executing it, if one is given
+        """
+        with self._lock:
+            entries, self._pending = list(self._pending), deque(maxlen=JOB_LOG_MAX_LINES)
+            self._last_flush = time.monotonic()
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if end is not None:
+            entries.append((END, end))
+        if not entries:
+            return
+        pipe = pipeline if pipeline is not None else self.redis.pipeline(transaction=False)
+        for stream, line in entries:
+            pipe.xadd(self.key, {'stream': stream, 'line': line}, maxlen=JOB_LOG_MAX_LINES, approximate=True)
+        pipe.expire(self.key, JOB_LOG_TTL)
+        if pipeline is None:
+            pipe.execute()
+
+    def close(self, status, pipeline=None):
+        """Send what is left, including unterminated lines, and mark the log complete"""
+        with self._lock:
+            for stream in STREAMS:
+                if self._partial[stream]:
+                    self._pending.append((stream, self._partial[stream][:JOB_LOG_MAX_LINE]))
+                    self._partial[stream] = ''
+        self.flush(end=status, pipeline=pipeline)
+
+
+class _ThreadRouter:
+    """sys.stdout/sys.stderr stand-in sending writes from capturing threads to their JobLog"""
+
+    def __init__(self, stream, original):
+        self.stream = stream
+        self.original = original
+
+    def write(self, text):
+        log = getattr(_capturing, 'log', None)
+        if log is None:
+            return self.original.write(text)
+        log.write(self.stream, text)
+        return len(text)
+
+    def flush(self):
+        self.original.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.original, name)
+
+
+_capturing = threading.local()
+_install_lock = threading.Lock()
+
+
+@contextmanager
+def capture_output(log):
+    """Send this thread's sys.stdout and sys.stderr writes to log inside the block"""
+    if log is None:
+        yield
+        return
+    with _install_lock:
+        for name in STREAMS:
+            if not isinstance(getattr(sys, name), _ThreadRouter):
+                setattr(sys, name, _ThreadRouter(name, getattr(sys, name)))
+    previous, _capturing.log = getattr(_capturing, 'log', None), log
+    try:
+        yield
+    finally:
+        _capturing.log = previous
+
+
+def decode_entries(entries):
+    """Raw stream entries as [{id, stream, line}, ...]"""
+    return [{'id': entry_id.decode(), 'stream': fields[b'stream'].decode(), 'line': fields[b'line'].decode()}
+            for entry_id, fields in entries]
+
+
+def read_job_log(redis_conn, job_id, after=None, tail=100):
+    """
+    A job's log lines after the entry id after, or its last tail lines.
+    Returns (lines, cursor, end): cursor is the id to pass as after next
+    time, end the job's status once its output has ended, else None.
+    """
+    key = JOB_LOG_KEY.format(job_id=job_id)
+    if after is not None:
+        entries = redis_conn.xrange(key, f"({after}", '+', count=JOB_LOG_MAX_LINES)
+    else:
+        entries = redis_conn.xrevrange(key, '+', '-', count=tail + 1)[::-1]
+    return split_end(decode_entries(entries), after, tail if after is None else None)
+
+
+def split_end(lines, cursor, tail=None):
+    """(output lines, cursor, end status or None) from decoded entries"""
+    end = lines[-1]['line'] if lines and lines[-1]['stream'] == END else None
+    if lines:
+        cursor = lines[-1]['id']
+    if end is not None:
+        lines = lines[:-1]
+    if tail is not None:
+        lines = lines[-tail:] if tail else []
+    return lines, cursor, end
+
+
+def follow_job_log(redis_conn, job_id, after, block_ms):
+    """Block up to block_ms for lines after after; returns (lines, cursor, end)"""
+    key = JOB_LOG_KEY.format(job_id=job_id)
+    response = redis_conn.xread({key: after or '0-0'}, count=JOB_LOG_MAX_LINES, block=max(1, block_ms))
+    return split_end(decode_entries(response[0][1] if response else []), after)
+
+
+async def read_job_log_async(redis_conn, job_id, after=None, tail=100):
+    """read_job_log for a redis.asyncio client"""
+    key = JOB_LOG_KEY.format(job_id=job_id)
+    if after is not None:
+        entries = await redis_conn.xrange(key, f"({after}", '+', count=JOB_LOG_MAX_LINES)
+    else:
+        entries = (await redis_conn.xrevrange(key, '+', '-', count=tail + 1))[::-1]
+    return split_end(decode_entries(entries), after, tail if after is None else None)
+
+
+async def follow_job_log_async(redis_conn, job_id, after, block_ms):
+    """follow_job_log for a redis.asyncio client"""
+    key = JOB_LOG_KEY.format(job_id=job_id)
+    response = await redis_conn.xread({key: after or '0-0'}, count=JOB_LOG_MAX_LINES, block=max(1, block_ms))
+    return split_end(decode_entries(response[0][1] if response else []), after)
+
+
+def file_handler(path):
+    """
+    Handler for a process log under logs/, rotated at LOG_MAX_BYTES keeping
+    LOG_BACKUPS old files. Rotation renames the file from the writing
+    process, so every process needs a file of its own.
+    """
+    return RotatingFileHandler(path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS)
+
+
+def tail_file(path, lines=100, block_size=LOG_READ_BLOCK):
+    """Last lines of a text file, read in blocks back from its end"""
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        data = b''
+        # One newline more than lines, as the file normally ends with one
+        while position > 0 and data.count(b'\n') <= lines:
+            step = min(block_size, position)
+            position -= step
+            f.seek(position)
+            data = f.read(step) + data
+    text = data.decode('utf-8', errors='replace').splitlines(keepends=True)
+    return text[-lines:] if lines else []
@@ -0,0 +1,90 @@
+"""
+Compact encoding of the bookkeeping a worker adds to a job's meta.
+
+RQ pickles meta into the job hash, where every key name and nested dict
+is paid for again on each job. Timing, cost, retries, cache hits and
+resource usage are therefore packed into a single fixed-layout bytes
+value under RUN_KEY (77 bytes). The fields a request sets at enqueue
+time (runtime, filename, codec, version, ...) and worker_tag stay plain
+keys. run_info() decodes either layout, so jobs written before the
+packed one still read back.
+"""
+import struct
+
+RUN_KEY = 'run'
+# flags, retries, batch size, 7 doubles (execution_time, cost, queue_wait
+# and the Usage floats), 2 unsigned I/O byte counts
+RUN = struct.Struct('<BHH7d2Q')
+USAGE_FLOATS = ('cpu_user', 'cpu_sys', 'max_rss_mb', 'wall')
+USAGE_COUNTS = ('io_read_bytes', 'io_write_bytes')
+# accounting.Usage.FIELDS, the order usage is reported in
+USAGE_FIELDS = ('cpu_user', 'cpu_sys', 'max_rss_mb', 'io_read_bytes', 'io_write_bytes', 'wall')
+
+HAS_QUEUE_WAIT = 1
+HAS_RESULT_CACHE = 2
+RESULT_CACHE_HIT = 4
+HAS_MODULE_CACHE = 8
+MODULE_CACHE_HIT = 16
+USAGE_UNMEASURED = 32
+
+# Keys of the unpacked layout, removed once a job's run is packed
+LEGACY_KEYS = ('execution_time', 'cost', 'queue_wait', 'retries', 'batch_size', 'usage',
+               'result_cache_hit', 'module_cache_hit', 'module_cache_hits', 'module_cache_misses', 'map_id')
+
+
+def pack_run(meta, execution_time, cost, retries=0, usage=None, queue_wait=None, batch_size=0,
+             result_cache_hit=None, module_cache_hit=None):
+    """Store a job's run bookkeeping in meta under RUN_KEY; usage is a Usage dict"""
+    usage = usage or {}
+    flags = 0
+    if queue_wait is not None:
+        flags |= HAS_QUEUE_WAIT
+    if result_cache_hit is not None:
+        flags |= HAS_RESULT_CACHE | (RESULT_CACHE_HIT if result_cache_hit else 0)
+    if module_cache_hit is not None:
+        flags |= HAS_MODULE_CACHE | (MODULE_CACHE_HIT if module_cache_hit else 0)
+    if usage.get('unmeasured'):
+        flags |= USAGE_UNMEASURED
+    for key in LEGACY_KEYS:
+        meta.pop(key, None)
+    meta[RUN_KEY] = RUN.pack(
+        flags, min(retries or 0, 0xffff), min(batch_size or 0, 0xffff),
+        execution_time, cost, queue_wait or 0.0,
+        *(float(usage.get(field, 0.0)) for field in USAGE_FLOATS),
+        *(int(usage.get(field, 0)) for field in USAGE_COUNTS))
+    return meta
+
+
+def run_info(meta):
+    """
+    {execution_time, cost, queue_wait, retries, batch_size, result_cache_hit,
+    module_cache_hit, usage} of a job; values the job has not recorded (yet)
+    are None, retries 0
+    """
+    packed = meta.get(RUN_KEY)
+    if packed is None:
+        return {
+            'execution_time': meta.get('execution_time'),
+            'cost': meta.get('cost'),
+            'queue_wait': meta.get('queue_wait'),
+            'retries': meta.get('retries', 0),
+            'batch_size': meta.get('batch_size'),
+            'result_cache_hit': meta.get('result_cache_hit'),
+            'module_cache_hit': meta.get('module_cache_hit'),
+            'usage': meta.get('usage'),
+        }
+    flags, retries, batch_size, execution_time, cost, queue_wait, *values = RUN.unpack(packed)
+    packed_usage = dict(zip(USAGE_FLOATS + USAGE_COUNTS, values))
+    usage = {field: packed_usage[field] for field in USAGE_FIELDS}
+    if flags & USAGE_UNMEASURED:
+        usage['unmeasured'] = True
+    return {
+        'execution_time': execution_time,
+        'cost': cost,
+        'queue_wait': queue_wait if flags & HAS_QUEUE_WAIT else None,
+        'retries': retries,
+        'batch_size': batch_size or None,
+        'result_cache_hit': bool(flags & RESULT_CACHE_HIT) if flags & HAS_RESULT_CACHE else None,
+        'module_cache_hit': bool(flags & MODULE_CACHE_HIT) if flags & HAS_MODULE_CACHE else None,
+        'usage': usage,
+    }
@@ -0,0 +1,189 @@
+"""
+Map jobs: one function over many payloads, then an optional reduce.
+
+/map splits the payloads into chunks, one RQ job each, and creates a
+deferred parent job whose id is the map's. A chunk job runs the whole
+chunk in one runtime call, then stores its outcomes and decrements the
+map's pending counter in one transaction. The chunk that brings the
+counter to zero enqueues the parent, which reads every chunk's outcomes
+in one round trip, reduces them and finishes with the reduced result.
+A chunk job that raises, times out or is abandoned by a dead worker is
+counted down by its on_failure callback with every item failed, so the
+parent still runs, and fails. Per item nothing is written to Redis; per
+chunk, one job and one hash field.
+"""
+import os
+import time
+import pickle
+import logging
+
+from rq import Queue, get_current_job
+from rq.exceptions import NoSuchJobError
+from rq.job import Job
+
+from accounting import measure
+from blobs import load, offload
+from executor import redis_conn, run_payloads, _record_meta, _record_outcome, _queue_wait
+from joblogs import JobLog
+from serialization import get_codec
+
+logger = logging.getLogger(__name__)
+
+PENDING_KEY = 'map:{map_id}:pending'   # chunks still running
+OUTCOMES_KEY = 'map:{map_id}:outcomes'  # chunk index -> pickled [(ok, result_or_traceback), ...]
+
+CHUNK_SIZE = int(os.environ.get('MAP_CHUNK_SIZE', 1000))
+MAX_MAP_SIZE = int(os.environ.get('MAX_MAP_SIZE', 1000000))
+# Map bookkeeping is dropped after this long even if the parent never runs
+MAP_TTL = int(os.environ.get('MAP_TTL', 86400))
+# Failed items quoted in a failed map's error
+MAX_REPORTED_FAILURES = 5
+
+# KEYS: OUTCOMES_KEY, PENDING_KEY. ARGV: chunk index, pickled outcomes, MAP_TTL.
+# Stores a chunk's outcomes and counts it down once: a chunk whose callback
+# fires after it recorded its outcomes is not counted twice. Returns the
+# chunks still pending, or -1 if the chunk had already been recorded.
+FINISH_CHUNK = """
+if redis.call('HSETNX', KEYS[1], ARGV[1], ARGV[2]) == 0 then
+    return -1
+end
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return redis.call('DECR', KEYS[2])
+"""
+finish_chunk = redis_conn.register_script(FINISH_CHUNK)
+
+
+def chunked(payloads, chunk_size):
+    return [payloads[start:start + chunk_size] for start in range(0, len(payloads), chunk_size)]
+
+
+def start_map(pipeline, map_id, chunks):
+    """Set up a map's pending counter in pipeline, which must run before its chunk jobs are queued"""
+    pipeline.set(PENDING_KEY.format(map_id=map_id), chunks, ex=MAP_TTL)
+    pipeline.delete(OUTCOMES_KEY.format(map_id=map_id))
+
+
+def release_parent(map_id):
+    """Enqueue a map's deferred parent job, as RQ does for a job whose dependencies are met"""
+    parent = Job.fetch(map_id, connection=redis_conn)
+    queue = Queue(parent.origin, connection=redis_conn)
+    with redis_conn.pipeline() as pipe:
+        queue.deferred_job_registry.remove(parent, pipeline=pipe)
+        queue._enqueue_job(parent, pipeline=pipe)
+        pipe.execute()
+
+
+def run_map_chunk(function_name, map_id, index, payloads):
+    """
+    Run one chunk of a map job. Item failures are kept as outcomes, so the
+    chunk itself completes; if it fails anyway, fail_map_chunk counts it
+    down. Returns the number of items that succeeded.
+    """
+    worker_tag = os.environ.get('WORKER_TAG', 'unknown-worker')
+    job = get_current_job()
+    runtime = job.meta.get('runtime') or 'python'
+    filename = job.meta.get('filename') or f"{function_name}.py"
+    codec = job.meta.get('codec')
+    start_time = time.time()
+    log = JobLog(redis_conn, job.id)
+    with measure() as usage:
+        payloads = load(payloads)
+        try:
+            outcomes = run_payloads(runtime, filename, payloads, codec, usage=usage, log=log)
+        except Exception as e:
+            logger.error(f"Map {map_id} chunk {index} failed: {str(e)}")
+            outcomes = [(False, f"{type(e).__name__}: {e}")] * len(payloads)
+
+    execution_time = time.time() - start_time
+    succeeded = sum(1 for ok, _ in outcomes if ok)
+    queue_wait = _queue_wait(job)
+    cost = _record_meta(job, execution_time, succeeded == len(outcomes), runtime, filename, worker_tag, usage,
+                        queue_wait=queue_wait)
+    with redis_conn.pipeline() as pipe:
+        finish_chunk(keys=[OUTCOMES_KEY.format(map_id=map_id), PENDING_KEY.format(map_id=map_id)],
+                     args=[index, pickle.dumps(outcomes), MAP_TTL], client=pipe)
+        pipe.incrbyfloat("total_cost", cost)
+        # The chunk completes even when items failed; its log ends 'finished'
+        _record_outcome(pipe, job, function_name, worker_tag, succeeded == len(outcomes), cost, execution_time,
+                        queue_wait)
+        log.close('finished', pipeline=pipe)
+        remaining = pipe.execute()[0]
+    logger.info(f"Map {map_id} chunk {index}: {succeeded}/{len(outcomes)} items in {execution_time:.3f}s")
+    if remaining == 0:
+        release_parent(map_id)
+    return succeeded
+
+
+def fail_map_chunk(job, connection, exc_type, exc_value, tb):
+    """
+    on_failure callback of chunk jobs, also run by RQ for chunks abandoned
+    by a dead worker: record each of the chunk's items as failed and
+    release the parent if this was the last chunk
+    """
+    _, map_id, index, _ = job.args
+    try:
+        sizes = Job.fetch(map_id, connection=connection).meta['map']
+    except NoSuchJobError:
+        return
+    items = min(sizes['chunk_size'], sizes['items'] - index * sizes['chunk_size'])
+    error = f"chunk {index} failed: {exc_type.__name__}"
+    if str(exc_value):
+        error += f": {exc_value}"
+    logger.error(f"Map {map_id} {error}")
+    remaining = finish_chunk(keys=[OUTCOMES_KEY.format(map_id=map_id), PENDING_KEY.format(map_id=map_id)],
+                             args=[index, pickle.dumps([(False, error)] * items), MAP_TTL], client=connection)
+    if remaining == 0:
+        release_parent(map_id)
+
+
+def _reduce(results, meta, usage=None, log=None):
+    """Call the reduce function with {reduce_field: results}"""
+    runtime = meta.get('reduce_runtime') or 'python'
+    filename = meta.get('reduce_filename') or f"{meta['reduce']}.py"
+    # Offloaded so that a container gets a large reduce payload as a file
+    payload = offload({meta.get('reduce_field', 'numbers'): results}, codec=get_codec(meta.get('codec')))
+    (ok, result), = run_payloads(runtime, filename, [payload], meta.get('codec'), usage=usage, log=log)
+    if not ok:
+        raise RuntimeError(f"Reduce function {meta['reduce']} failed: {result}")
+    return result
+
+
+def run_map(function_name, chunks):
+    """
+    Parent job of a map: gather every chunk's outcomes in item order and
+    reduce them. Fails if any item failed; without a reduce function the
+    result is the list of item results.
+    """
+    worker_tag = os.environ.get('WORKER_TAG', 'unknown-worker')
+    job = get_current_job()
+    map_id = job.id
+    start_time = time.time()
+    log = JobLog(redis_conn, job.id)
+    success = False
+    usage = None
+    try:
+        with measure() as usage:
+            raw = redis_conn.hgetall(OUTCOMES_KEY.format(map_id=map_id))
+            if len(raw) != chunks:
+                raise RuntimeError(f"Map {map_id} has outcomes for {len(raw)} of {chunks} chunks")
+            outcomes = [outcome for index in range(chunks) for outcome in pickle.loads(raw[str(index).encode()])]
+            failures = [(item, error) for item, (ok, error) in enumerate(outcomes) if not ok]
+            if failures:
+                details = '\n'.join(f"item {item}: {error}" for item, error in failures[:MAX_REPORTED_FAILURES])
+                raise RuntimeError(f"{len(failures)} of {len(outcomes)} items failed\n{details}")
+            results = [result for _, result in outcomes]
+            if job.meta.get('reduce'):
+                results = _reduce([load(result) for result in results], job.meta, usage, log)
+            result = offload(results, codec=get_codec(job.meta.get('codec')))
+            success = True
+            return result
+    finally:
+        execution_time = time.time() - start_time
+        queue_wait = _queue_wait(job)
+        cost = _record_meta(job, execution_time, success, job.meta.get('runtime'),
+                            job.meta.get('filename'), worker_tag, usage, queue_wait=queue_wait)
+        with redis_conn.pipeline(transaction=False) as pipe:
+            pipe.delete(OUTCOMES_KEY.format(map_id=map_id), PENDING_KEY.format(map_id=map_id))
+            pipe.incrbyfloat("total_cost", cost)
+            _record_outcome(pipe, job, function_name, worker_tag, success, cost, execution_time, queue_wait, log)
+            pipe.execute()
@@ -0,0 +1,123 @@
+import os
+import types
+import asyncio
+import inspect
+import traceback
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class ModuleCache:
+    """
+    LRU cache of imported function modules.
+    Entries are validated against the file's mtime and size on every lookup;
+    when those change the source is re-read and only recompiled if its
+    sha256 differs, so rewriting a file with identical bytes stays a hit.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def load(self, name, path):
+        """Return (module, hit) for functions/<name>.py at path"""
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry and entry['signature'] == signature:
+                self._entries.move_to_end(name)
+                self.hits += 1
+                return entry['module'], True
+
+        with open(path, 'rb') as f:
+            source = f.read()
+        digest = hashlib.sha256(source).hexdigest()
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry and entry['digest'] == digest:
+                entry['signature'] = signature
+                self._entries.move_to_end(name)
+                self.hits += 1
+                return entry['module'], True
+
+        module = types.ModuleType(name)
+        module.__file__ = path
+        exec(compile(source, path, 'exec'), module.__dict__)
+        with self._lock:
+            self._entries[name] = {'signature': signature, 'digest': digest, 'module': module}
+            self._entries.move_to_end(name)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            self.misses += 1
+        return module, False
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _event_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='async-handlers', daemon=True).start()
+        return _loop
+
+
+def call_handler(handler, payload):
+    """
+    handler(payload). An `async def` handler's coroutine runs on this
+    process's shared event loop, so the awaits of handlers running in
+    different worker slots interleave on one thread.
+    """
+    result = handler(payload)
+    if not inspect.iscoroutine(result):
+        return result
+    future = asyncio.run_coroutine_threadsafe(result, _event_loop())
+    try:
+        return future.result()
+    except BaseException:
+        # Includes the job timeout raised in the waiting thread
+        future.cancel()
+        raise
+
+
+def call_batch(module, payloads):
+    """
+    Call a function module's handler over a batch of payloads.
+    Modules may define handler_batch(payloads) to process the whole batch
+    at once, returning an exception in place of a result to fail just that
+    payload; otherwise handler is called per payload. Returns a list of
+    (ok, result_or_traceback) pairs in payload order.
+    """
+    if hasattr(module, 'handler_batch'):
+        results = module.handler_batch(payloads)
+        if len(results) != len(payloads):
+            raise ValueError(f"handler_batch returned {len(results)} results for {len(payloads)} payloads")
+        return [(False, ''.join(traceback.format_exception(result))) if isinstance(result, Exception)
+                else (True, result) for result in results]
+    if not hasattr(module, 'handler'):
+        raise AttributeError(f"Function {module.__name__} missing handler function")
+    outcomes = []
+    for payload in payloads:
+        try:
+            outcomes.append((True, call_handler(module.handler, payload)))
+        except Exception:
+            outcomes.append((False, traceback.format_exc()))
+    return outcomes
@@ -0,0 +1,154 @@
+"""
+Pipelines: a DAG of function stages, each fed the results of the stages
+it reads from.
+
+/pipeline groups the stages into units. A stage marked colocate joins
+the unit of its upstream stages; every other stage starts a unit of its
+own. Each unit is one RQ job that depends_on the jobs of the units it
+reads from, so RQ enqueues it as soon as they have all finished. The job
+fetches those upstream results itself, then runs its stages in order,
+handing each result to the next stage in memory. Its result is
+{stage id: result} for its stages. A failed unit cancels every job
+downstream of it.
+"""
+import os
+import time
+import logging
+
+from rq import get_current_job
+from rq.job import Job, JobStatus
+
+from accounting import measure
+from blobs import load, offload
+from events import publish
+from executor import redis_conn, run_payloads, _record_meta, _record_outcome, _queue_wait
+from job_index import record_finished
+from joblogs import JobLog
+
+logger = logging.getLogger(__name__)
+
+MAX_PIPELINE_STAGES = int(os.environ.get('MAX_PIPELINE_STAGES', 100))
+
+
+def upstreams(stage):
+    """Ids of the stages stage waits for: its inputs, then its after list"""
+    return list(dict.fromkeys([*stage.get('inputs', {}).values(), *stage.get('after', [])]))
+
+
+def plan_units(stages):
+    """
+    Order stages ({id, inputs, after, colocate, ...}) topologically, in
+    submission order where the DAG allows, and group them into units.
+    Returns the units as lists of stages in run order, each unit after the
+    units it reads from. Raises ValueError for an unknown upstream, a cycle,
+    or a colocated stage without upstreams or whose upstreams are in
+    different units.
+    """
+    by_id = {stage['id']: stage for stage in stages}
+    waiting = {}
+    for stage in stages:
+        for upstream in upstreams(stage):
+            if upstream not in by_id:
+                raise ValueError(f"stage {stage['id']}: unknown upstream stage {upstream}")
+            if upstream == stage['id']:
+                raise ValueError(f"stage {stage['id']} depends on itself")
+        waiting[stage['id']] = set(upstreams(stage))
+
+    units, unit_of = [], {}
+    while waiting:
+        ready = [stage for stage in stages if waiting.get(stage['id']) == set()]
+        if not ready:
+            raise ValueError(f"stages {', '.join(sorted(waiting))} form a cycle")
+        for stage in ready:
+            del waiting[stage['id']]
+            if stage.get('colocate'):
+                owners = {unit_of[upstream] for upstream in upstreams(stage)}
+                if len(owners) != 1:
+                    raise ValueError(f"stage {stage['id']}: a colocated stage needs upstreams in exactly one unit")
+                unit = owners.pop()
+            else:
+                unit = len(units)
+                units.append([])
+            units[unit].append(stage)
+            unit_of[stage['id']] = unit
+        for pending in waiting.values():
+            pending.difference_update(stage['id'] for stage in ready)
+    return units
+
+
+def upstream_results(sources):
+    """Results of the stages in sources ({stage id: job id}) from their jobs, loaded"""
+    job_ids = list(dict.fromkeys(sources.values()))
+    outputs = {job_id: job.return_value() if job is not None else None
+               for job_id, job in zip(job_ids, Job.fetch_many(job_ids, connection=redis_conn))}
+    results = {}
+    for stage_id, job_id in sources.items():
+        if not outputs[job_id] or stage_id not in outputs[job_id]:
+            raise RuntimeError(f"Upstream stage {stage_id} (job {job_id}) has no result")
+        results[stage_id] = load(outputs[job_id][stage_id])
+    return results
+
+
+def cancel_downstream(job):
+    """Cancel every job waiting, directly or through others, on job, which has failed"""
+    pending, seen = list(job.dependent_ids), set()
+    while pending:
+        dependents = [dependent for dependent in Job.fetch_many(pending, connection=redis_conn)
+                      if dependent is not None and dependent.id not in seen]
+        pending = []
+        for dependent in dependents:
+            seen.add(dependent.id)
+            if dependent.get_status(refresh=False) != JobStatus.DEFERRED:
+                continue
+            with redis_conn.pipeline() as pipe:
+                dependent.cancel(pipeline=pipe)
+                record_finished(redis_conn, dependent, 'canceled', pipeline=pipe)
+                # /wait and /events hear about it like any other outcome
+                publish(redis_conn, dependent, JobStatus.CANCELED, pipeline=pipe)
+                pipe.execute()
+            pending.extend(dependent.dependent_ids)
+    if seen:
+        logger.info(f"Job {job.id} failed; canceled {len(seen)} downstream jobs")
+
+
+def run_stages(function_name, pipeline_id, stages, sources):
+    """
+    Run one unit of a pipeline. stages are {id, function, payload, inputs,
+    runtime, filename} in run order; sources maps the upstream stages read
+    from other units to their jobs. Each stage's payload gets every input
+    field set to the named stage's result. Returns {stage id: result}.
+    """
+    worker_tag = os.environ.get('WORKER_TAG', 'unknown-worker')
+    job = get_current_job()
+    start_time = time.time()
+    queue_wait = _queue_wait(job)
+    log = JobLog(redis_conn, job.id)
+    success = False
+    usage = None
+    try:
+        with measure() as usage:
+            results = upstream_results(sources)
+            produced = {}
+            for stage in stages:
+                payload = dict(load(stage['payload']),
+                               **{field: results[upstream] for field, upstream in stage['inputs'].items()})
+                # Kept in memory for the stages after it; only the job's result is offloaded
+                (ok, result), = run_payloads(stage['runtime'], stage['filename'], [payload],
+                                             offload_results=False, usage=usage, log=log)
+                if not ok:
+                    raise RuntimeError(f"Stage {stage['id']} ({stage['function']}) failed:\n{result}")
+                results[stage['id']] = produced[stage['id']] = result
+            success = True
+            return {stage_id: offload(result) for stage_id, result in produced.items()}
+    except Exception as e:
+        logger.error(f"Pipeline {pipeline_id} job {job.id} failed: {str(e)}")
+        cancel_downstream(job)
+        raise
+    finally:
+        execution_time = time.time() - start_time
+        cost = _record_meta(job, execution_time, success, stages[0]['runtime'], stages[0]['filename'],
+                            worker_tag, usage, queue_wait=queue_wait)
+        with redis_conn.pipeline(transaction=False) as pipe:
+            pipe.incrbyfloat("total_cost", cost)
+            _record_outcome(pipe, job, function_name, worker_tag, success, cost, execution_time, queue_wait, log)
+            pipe.execute()
@@ -0,0 +1,52 @@
+import os
+import json
+import random
+
+# Highest priority first
+QUEUE_NAMES = ['high', 'default', 'low']
+
+# Long-running functions go to 'low' so they cannot starve latency-sensitive ones
+DEFAULT_ROUTES = {'sample_sleep': 'low'}
+ROUTES = {**DEFAULT_ROUTES, **json.loads(os.environ.get('QUEUE_ROUTES', '{}'))}
+
+
+def route(function_name, priority=None):
+    """Pick the queue for a job: an explicit priority wins, then the routing table"""
+    if priority:
+        if priority not in QUEUE_NAMES:
+            raise ValueError(f"Invalid priority {priority}, expected one of {', '.join(QUEUE_NAMES)}")
+        return priority
+    return ROUTES.get(function_name, 'default')
+
+
+def parse_weights(spec):
+    """Parse 'high:6,default:3,low:1' into {'high': 6.0, ...}"""
+    weights = {}
+    for part in spec.split(','):
+        name, _, weight = part.partition(':')
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+class WeightedQueueOrder:
+    """
+    Worker mixin that, after every dequeue, reorders the queues by a
+    weighted random draw, so lower-priority queues get a share of
+    dequeues instead of waiting for higher ones to drain.
+    """
+    queue_weights = {}
+
+    def reorder_queues(self, reference_queue):
+        remaining = list(self.queues)
+        ordered = []
+        while remaining:
+            weights = [self.queue_weights.get(queue.name, 1.0) for queue in remaining]
+            pick = random.choices(remaining, weights=weights)[0]
+            remaining.remove(pick)
+            ordered.append(pick)
+        self._ordered_queues = ordered
+
+
+def weighted(worker_class, weights):
+    """Return a subclass of worker_class that consumes its queues in weighted order"""
+    return type(f"Weighted{worker_class.__name__}", (WeightedQueueOrder, worker_class), {'queue_weights': weights})
@@ -0,0 +1,205 @@
+import os
+import ast
+import json
+import time
+import hashlib
+import threading
+
+from serialization import is_array
+
+DEFAULT_TTL = int(os.environ.get('RESULT_CACHE_TTL', 300))
+MAX_ENTRIES = int(os.environ.get('RESULT_CACHE_MAX_ENTRIES', 10000))
+MAX_RESULT_BYTES = int(os.environ.get('RESULT_CACHE_MAX_RESULT_BYTES', 64 * 1024))
+
+KEY_PREFIX = 'result_cache'
+
+# KEYS: the claim key. ARGV: the stale owner's job id, the new job id, ttl.
+# Takes over the claim if it is still the stale owner's (or has expired);
+# otherwise returns the job id that holds it now.
+REPLACE_CLAIM = """
+local owner = redis.call('GET', KEYS[1])
+if owner and owner ~= ARGV[1] then
+    return owner
+end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+return false
+"""
+
+_policies = {}
+_policies_lock = threading.Lock()
+
+
+def _read_policy(source):
+    """Find top-level CACHEABLE / CACHE_TTL assignments without importing the module"""
+    cacheable, ttl = False, DEFAULT_TTL
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        return False, ttl
+    for node in tree.body:
+        if not isinstance(node, ast.Assign) or not isinstance(node.value, ast.Constant):
+            continue
+        for target in node.targets:
+            if isinstance(target, ast.Name) and target.id == 'CACHEABLE':
+                cacheable = node.value.value is True
+            elif isinstance(target, ast.Name) and target.id == 'CACHE_TTL' and isinstance(node.value.value, int):
+                ttl = node.value.value
+    return cacheable, ttl
+
+
+def function_policy(path):
+    """
+    Return (content_digest, ttl) if the function file at path declares
+    CACHEABLE = True, else None. Memoized on the file's mtime and size.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    signature = (stat.st_mtime_ns, stat.st_size)
+    with _policies_lock:
+        cached = _policies.get(path)
+    if cached and cached[0] == signature:
+        return cached[1]
+
+    with open(path, 'rb') as f:
+        source = f.read()
+    cacheable, ttl = _read_policy(source) if path.endswith('.py') else (False, DEFAULT_TTL)
+    policy = (hashlib.sha256(source).hexdigest(), ttl) if cacheable else None
+    with _policies_lock:
+        _policies[path] = (signature, policy)
+    return policy
+
+
+def _canonical(value):
+    # Arrays from the msgpack and Arrow codecs are hashed by content; str()
+    # of a large array elides most of it
+    return value.tolist() if is_array(value) else str(value)
+
+
+def payload_digest(payload):
+    canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'), default=_canonical)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def cache_key(path, runtime, payload):
+    """Return (key, ttl) for a pure function call, or None if the function is not cacheable"""
+    policy = function_policy(path)
+    if policy is None:
+        return None
+    digest, ttl = policy
+    # Runtimes differ in result types (Docker results are parsed from stdout), so keep them apart
+    return f"{digest}:{runtime}:{payload_digest(payload)}", ttl
+
+
+class ResultCache:
+    """
+    Redis-backed cache of results for functions that declare CACHEABLE = True.
+    Entries expire after their TTL; once more than max_entries are indexed the
+    oldest are evicted. Each key can also be claimed by the job computing it
+    so duplicate submissions coalesce onto that job.
+    """
+
+    def __init__(self, redis_conn, max_entries=MAX_ENTRIES, max_result_bytes=MAX_RESULT_BYTES):
+        self.redis = redis_conn
+        self.max_entries = max_entries
+        self.max_result_bytes = max_result_bytes
+        self._replace_claim = redis_conn.register_script(REPLACE_CLAIM)
+
+    def _result_key(self, key):
+        return f"{KEY_PREFIX}:result:{key}"
+
+    def _claim_key(self, key):
+        return f"{KEY_PREFIX}:job:{key}"
+
+    def get(self, key):
+        """Return (hit, result)"""
+        raw = self.redis.get(self._result_key(key))
+        self.redis.incr(f"{KEY_PREFIX}:{'hits' if raw is not None else 'misses'}")
+        if raw is None:
+            return False, None
+        return True, json.loads(raw)
+
+    def put(self, key, result, ttl):
+        try:
+            raw = json.dumps(result)
+        except (TypeError, ValueError):
+            return False
+        if len(raw) > self.max_result_bytes:
+            return False
+        result_key = self._result_key(key)
+        index_key = f"{KEY_PREFIX}:index"
+        with self.redis.pipeline() as pipe:
+            pipe.set(result_key, raw, ex=ttl)
+            pipe.zadd(index_key, {result_key: time.time()})
+            pipe.zcard(index_key)
+            size = pipe.execute()[-1]
+        if size > self.max_entries:
+            evicted = [member for member, _ in self.redis.zpopmin(index_key, size - self.max_entries)]
+            if evicted:
+                self.redis.delete(*evicted)
+        return True
+
+    def claim(self, key, job_id, ttl):
+        """Claim key for job_id; returns the id of the job already holding it, or None"""
+        if self.redis.set(self._claim_key(key), job_id, nx=True, ex=ttl):
+            return None
+        owner = self.redis.get(self._claim_key(key))
+        return owner.decode() if owner else None
+
+    def replace_claim(self, key, stale_id, job_id, ttl):
+        """
+        Move key's claim from stale_id, a job that cannot be coalesced onto,
+        to job_id; returns None, or the id of the job that claimed it first
+        """
+        owner = self._replace_claim(keys=[self._claim_key(key)], args=[stale_id, job_id, ttl])
+        return owner.decode() if owner else None
+
+    def settle(self, key, job_id, ttl):
+        """Keep job_id's claim alive for as long as its result stays cached"""
+        if self.redis.get(self._claim_key(key)) == job_id.encode():
+            self.redis.expire(self._claim_key(key), ttl)
+
+    def release(self, key, job_id):
+        """Drop job_id's claim after a failure so the next submission runs again"""
+        if self.redis.get(self._claim_key(key)) == job_id.encode():
+            self.redis.delete(self._claim_key(key))
+
+    def record_coalesced(self):
+        self.redis.incr(f"{KEY_PREFIX}:coalesced")
+
+    def stats(self):
+        with self.redis.pipeline() as pipe:
+            for name in ('hits', 'misses', 'coalesced'):
+                pipe.get(f"{KEY_PREFIX}:{name}")
+            pipe.zcard(f"{KEY_PREFIX}:index")
+            hits, misses, coalesced, entries = pipe.execute()
+        return {
+            'hits': int(hits or 0),
+            'misses': int(misses or 0),
+            'coalesced': int(coalesced or 0),
+            'entries': entries,
+        }
+
+
+class AsyncResultCache:
+    """The submission side of ResultCache (claims and coalescing) for a redis.asyncio client"""
+
+    _claim_key = ResultCache._claim_key
+
+    def __init__(self, redis_conn):
+        self.redis = redis_conn
+        self._replace_claim = redis_conn.register_script(REPLACE_CLAIM)
+
+    async def claim(self, key, job_id, ttl):
+        if await self.redis.set(self._claim_key(key), job_id, nx=True, ex=ttl):
+            return None
+        owner = await self.redis.get(self._claim_key(key))
+        return owner.decode() if owner else None
+
+    async def replace_claim(self, key, stale_id, job_id, ttl):
+        owner = await self._replace_claim(keys=[self._claim_key(key)], args=[stale_id, job_id, ttl])
+        return owner.decode() if owner else None
+
+    async def record_coalesced(self):
+        await self.redis.incr(f"{KEY_PREFIX}:coalesced")
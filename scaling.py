@@ -0,0 +1,141 @@
+import math
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from datetime import timezone
+
+from rq.job import Job
+
+COMPLETED_KEY = 'scaling:completed:{queue}'
+EXEC_TIME_KEY = 'scaling:exec_time:{queue}'
+WAIT_KEY = 'scaling:wait:{queue}'
+
+# A point-in-time view of the queue and of cumulative per-function completions
+Observation = namedtuple('Observation', [
+    'time',              # seconds, from the autoscaler's clock
+    'queue_size',
+    'completed',         # {function: jobs completed so far}
+    'exec_time',         # {function: total execution seconds so far}
+    'queued_functions',  # function names of a sample from the head of the queue
+])
+
+
+def record_completion(redis_conn, queue_name, function_name, execution_time, wait_time=None, pipeline=None):
+    """Count a finished job, its execution time and queue wait towards the scaling stats"""
+    conn = pipeline if pipeline is not None else redis_conn
+    conn.hincrby(COMPLETED_KEY.format(queue=queue_name), function_name, 1)
+    conn.hincrbyfloat(EXEC_TIME_KEY.format(queue=queue_name), function_name, execution_time)
+    if wait_time is not None:
+        conn.hincrby(WAIT_KEY.format(queue=queue_name), 'count', 1)
+        conn.hincrbyfloat(WAIT_KEY.format(queue=queue_name), 'total', wait_time)
+
+
+def observe(redis_conn, queue, now, sample_size=100):
+    """Collect an Observation for queue in two round trips"""
+    with redis_conn.pipeline() as pipe:
+        pipe.llen(queue.key)
+        pipe.lrange(queue.key, 0, sample_size - 1)
+        pipe.hgetall(COMPLETED_KEY.format(queue=queue.name))
+        pipe.hgetall(EXEC_TIME_KEY.format(queue=queue.name))
+        queue_size, sample_ids, completed, exec_time = pipe.execute()
+    sample = Job.fetch_many([job_id.decode() for job_id in sample_ids], connection=redis_conn)
+    return Observation(
+        time=now,
+        queue_size=queue_size,
+        completed={k.decode(): int(v) for k, v in completed.items()},
+        exec_time={k.decode(): float(v) for k, v in exec_time.items()},
+        queued_functions=[job.args[0] for job in sample if job is not None and job.args],
+    )
+
+
+def queue_stats(redis_conn, queue, now):
+    """Depth, age of the oldest queued job and mean wait of started jobs for /metrics"""
+    with redis_conn.pipeline() as pipe:
+        pipe.llen(queue.key)
+        pipe.lindex(queue.key, 0)
+        pipe.hgetall(WAIT_KEY.format(queue=queue.name))
+        depth, head_id, wait = pipe.execute()
+    oldest_wait = 0.0
+    if head_id is not None:
+        head = Job.fetch_many([head_id.decode()], connection=redis_conn)[0]
+        if head is not None and head.enqueued_at is not None:
+            oldest_wait = max(0.0, now - head.enqueued_at.replace(tzinfo=timezone.utc).timestamp())
+    count = int(wait.get(b'count', 0))
+    return {
+        'depth': depth,
+        'oldest_wait': round(oldest_wait, 3),
+        'mean_wait': round(float(wait.get(b'total', 0)) / count, 3) if count else None,
+    }
+
+
+class ScalingPolicy(ABC):
+    """
+    Maps an Observation to the number of jobs that should run at once:
+    a worker count for single-slot workers, which the autoscaler divides
+    by the slots per worker otherwise (before min/max clamping)
+    """
+
+    @abstractmethod
+    def desired_workers(self, observation):
+        pass
+
+
+class QueueLengthPolicy(ScalingPolicy):
+    """The original rule: one worker per 10 queued jobs"""
+
+    def desired_workers(self, observation):
+        return observation.queue_size // 10 + 1
+
+
+class LittlesLawPolicy(ScalingPolicy):
+    """
+    Target concurrency from Little's law: arrival rate times mean execution
+    time keeps up with new work, plus enough workers to drain the current
+    backlog within drain_target seconds. Backlog work is estimated from the
+    per-function mean execution times of the jobs at the head of the queue.
+    """
+
+    def __init__(self, drain_target=30.0, smoothing=0.5, default_exec_time=1.0):
+        self.drain_target = drain_target
+        self.smoothing = smoothing
+        self.default_exec_time = default_exec_time
+        self.arrival_rate = 0.0
+        self._previous = None
+
+    def mean_exec_times(self, observation):
+        return {
+            name: observation.exec_time.get(name, 0.0) / count
+            for name, count in observation.completed.items() if count
+        }
+
+    def desired_workers(self, observation):
+        means = self.mean_exec_times(observation)
+        total_completed = sum(observation.completed.values())
+        overall_mean = (sum(observation.exec_time.values()) / total_completed
+                        if total_completed else self.default_exec_time)
+
+        previous, self._previous = self._previous, observation
+        recent_mean = overall_mean
+        if previous is not None and observation.time > previous.time:
+            elapsed = observation.time - previous.time
+            completions = total_completed - sum(previous.completed.values())
+            # Whatever completed or is still waiting arrived since the last look
+            arrivals = max(0, completions + observation.queue_size - previous.queue_size)
+            self.arrival_rate += self.smoothing * (arrivals / elapsed - self.arrival_rate)
+            if completions > 0:
+                recent_mean = (sum(observation.exec_time.values()) - sum(previous.exec_time.values())) / completions
+
+        if observation.queued_functions:
+            backlog_mean = sum(means.get(name, overall_mean) for name in observation.queued_functions) \
+                / len(observation.queued_functions)
+        else:
+            backlog_mean = overall_mean
+        backlog_work = observation.queue_size * backlog_mean
+
+        concurrency = self.arrival_rate * recent_mean + backlog_work / self.drain_target
+        return math.ceil(concurrency)
+
+
+POLICIES = {
+    'queue_length': QueueLengthPolicy,
+    'littles_law': LittlesLawPolicy,
+}
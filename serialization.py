@@ -0,0 +1,176 @@
+"""
+Codecs for job payloads and results, negotiated per job by content type.
+
+A job submitted with a non-JSON body records its codec's name in
+job.meta['codec']. The same codec then encodes the job's payload and
+result in the blob store, on the warm pool's pipe, and in /result
+responses. Payloads and results small enough to stay in the job hash
+are still pickled by RQ's serializer, which is per queue rather than per
+job. JSON stays the default.
+
+NumPy arrays survive msgpack and Arrow with their dtype and shape, and
+are decoded as read-only views over the encoded buffer rather than copied.
+"""
+import json
+
+try:
+    import msgpack
+except ImportError:  # optional: only needed for msgpack jobs
+    msgpack = None
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+ARROW = 'application/vnd.apache.arrow.stream'
+BINARY = 'application/octet-stream'
+
+# msgpack extension type holding a NumPy array as (dtype, shape, raw bytes)
+NDARRAY_EXT = 1
+# Arrow schema metadata telling decode() what shape of value it is reading
+ARROW_KIND = b'kind'
+
+
+def is_array(value):
+    """NumPy arrays and scalars, without importing NumPy"""
+    return hasattr(value, 'dtype') and hasattr(value, 'tolist')
+
+
+def json_default(value):
+    """json.dumps default: NumPy arrays and scalars become lists and numbers"""
+    if is_array(value):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class JsonCodec:
+    name = 'json'
+    content_type = JSON
+    extension = 'json'
+
+    def encode(self, value):
+        return json.dumps(value, default=json_default).encode()
+
+    def decode(self, data):
+        return json.loads(bytes(data))
+
+
+class MsgpackCodec:
+    """msgpack, with bytes kept as bytes and NumPy arrays as raw buffers"""
+    name = 'msgpack'
+    content_type = MSGPACK
+    extension = 'msgpack'
+
+    def _require(self):
+        if msgpack is None:
+            raise ValueError("The msgpack codec needs the msgpack package: pip install msgpack")
+
+    @staticmethod
+    def _default(value):
+        if not is_array(value):
+            raise TypeError(f"Object of type {type(value).__name__} is not msgpack serializable")
+        if value.ndim == 0:
+            return value.item()
+        if value.dtype.hasobject:
+            return value.tolist()
+        import numpy as np
+        value = np.ascontiguousarray(value)
+        return msgpack.ExtType(NDARRAY_EXT, msgpack.packb(
+            [value.dtype.str, list(value.shape), memoryview(value).cast('B')]))
+
+    @staticmethod
+    def _ext_hook(code, data):
+        if code != NDARRAY_EXT:
+            return msgpack.ExtType(code, data)
+        import numpy as np
+        dtype, shape, buffer = msgpack.unpackb(data)
+        return np.frombuffer(buffer, dtype=dtype).reshape(shape)
+
+    def encode(self, value):
+        self._require()
+        return msgpack.packb(value, default=self._default)
+
+    def decode(self, data):
+        self._require()
+        try:
+            return msgpack.unpackb(data, ext_hook=self._ext_hook, strict_map_key=False)
+        except (msgpack.UnpackException, ValueError, TypeError) as e:
+            raise ValueError(f"Invalid msgpack data: {e}") from e
+
+
+class ArrowCodec:
+    """
+    Arrow IPC stream. A dict of equal-length 1-D arrays or lists is
+    written as columns and decoded back to a dict of NumPy arrays; a lone
+    array as a single column; anything else as a one-row value.
+    """
+    name = 'arrow'
+    content_type = ARROW
+    extension = 'arrow'
+
+    @staticmethod
+    def _columns(value):
+        if not isinstance(value, dict) or not value:
+            return None
+        lengths = set()
+        for column in value.values():
+            if is_array(column) and column.ndim == 1:
+                lengths.add(len(column))
+            elif isinstance(column, list):
+                lengths.add(len(column))
+            else:
+                return None
+        return value if len(lengths) == 1 else None
+
+    def encode(self, value):
+        import pyarrow as pa
+        columns = self._columns(value)
+        try:
+            if columns is not None:
+                batch = pa.RecordBatch.from_pydict({str(name): pa.array(column) for name, column in columns.items()},
+                                                   metadata={ARROW_KIND: b'columns'})
+            elif is_array(value) and value.ndim >= 1:
+                batch = pa.RecordBatch.from_pydict({'value': pa.array(value.reshape(-1))},
+                                                   metadata={ARROW_KIND: b'array',
+                                                             b'shape': json.dumps(value.shape).encode()})
+            else:
+                batch = pa.RecordBatch.from_pydict({'value': pa.array([value])}, metadata={ARROW_KIND: b'value'})
+        except (pa.ArrowException, TypeError) as e:
+            raise ValueError(f"Value cannot be encoded as Arrow: {e}") from e
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, batch.schema) as writer:
+            writer.write_batch(batch)
+        return sink.getvalue().to_pybytes()
+
+    def decode(self, data):
+        import pyarrow as pa
+        try:
+            table = pa.ipc.open_stream(pa.py_buffer(data)).read_all()
+        except pa.ArrowException as e:
+            raise ValueError(f"Invalid Arrow stream: {e}") from e
+        metadata = table.schema.metadata or {}
+        kind = metadata.get(ARROW_KIND, b'columns')
+        if kind == b'value':
+            return table.column('value')[0].as_py()
+        if kind == b'array':
+            return table.column('value').to_numpy().reshape(json.loads(metadata[b'shape']))
+        return {name: table.column(name).to_numpy() for name in table.column_names}
+
+
+JSON_CODEC = JsonCodec()
+CODECS = {codec.name: codec for codec in (JSON_CODEC, MsgpackCodec(), ArrowCodec())}
+CONTENT_TYPES = {codec.content_type: codec for codec in CODECS.values()}
+CONTENT_TYPES['application/x-msgpack'] = CODECS['msgpack']
+
+
+def get_codec(name=None):
+    """Codec recorded in a job's meta; None is JSON"""
+    if name is None:
+        return JSON_CODEC
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError(f"Unknown codec {name}") from None
+
+
+def codec_for(content_type):
+    """Codec for a request's mimetype, or None if it is not one of ours"""
+    return CONTENT_TYPES.get(content_type)
@@ -0,0 +1,100 @@
+import logging
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from rq import SimpleWorker
+from rq.timeouts import TimerDeathPenalty
+from rq.worker import StopRequested, WorkerStatus
+
+logger = logging.getLogger(__name__)
+
+
+class ConcurrentWorker(SimpleWorker):
+    """
+    Worker that runs up to `slots` jobs at once in threads of one process,
+    for I/O-bound functions that would otherwise hold a whole process while
+    they wait. A job is only dequeued once a slot is free, so queued jobs
+    stay available to other workers. Timeouts are enforced per thread.
+
+    A warm shutdown stops dequeuing at once and waits for the running jobs.
+    The worker is BUSY while any slot is in use; slot_usage() gives the
+    detail, which heartbeats report to the autoscaler.
+    """
+
+    death_penalty_class = TimerDeathPenalty
+
+    def __init__(self, *args, slots=8, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.slots = slots
+        self._free = threading.Semaphore(slots)
+        self._running = {}  # slot token -> future; a retried job may be dequeued before its slot is released
+        self._tokens = itertools.count()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(slots, thread_name_prefix='slot')
+
+    def slot_usage(self):
+        """(busy slots, total slots)"""
+        with self._lock:
+            return len(self._running), self.slots
+
+    def dequeue_job_and_maintain_ttl(self, timeout, max_idle_time=None):
+        while True:
+            # Heartbeat while every slot is taken, without holding a job meanwhile
+            while not self._free.acquire(timeout=self.job_monitoring_interval):
+                self.heartbeat()
+            try:
+                result = super().dequeue_job_and_maintain_ttl(timeout, max_idle_time)
+            except BaseException:
+                self._free.release()
+                raise
+            if result is not None:
+                return result
+            self._free.release()
+            # Burst or idle timeout: finish what is running, whose dependents
+            # may have been enqueued meanwhile, before giving up
+            with self._lock:
+                running = list(self._running.values())
+            if not running:
+                return None
+            wait(running)
+
+    def set_state(self, state, pipeline=None):
+        # dequeue_job_and_maintain_ttl marks the worker idle while slots are busy
+        if state == WorkerStatus.IDLE and self._running:
+            state = WorkerStatus.BUSY
+        super().set_state(state, pipeline=pipeline)
+
+    def execute_job(self, job, queue):
+        with self._lock:
+            token = next(self._tokens)
+            self._running[token] = self._executor.submit(self._run_slot, token, job, queue)
+        self.set_state(WorkerStatus.BUSY)
+
+    def _run_slot(self, token, job, queue):
+        try:
+            self.perform_job(job, queue)
+        except Exception:
+            logger.exception(f"Slot failed running job {job.id}")
+        finally:
+            with self._lock:
+                del self._running[token]
+                idle = not self._running
+            self._free.release()
+            if idle:
+                self.set_state(WorkerStatus.IDLE)
+
+    def _shutdown(self):
+        # The main loop never runs a job itself, so it can stop right away;
+        # teardown waits for the slots
+        if self.scheduler:
+            self.stop_scheduler()
+        raise StopRequested()
+
+    def teardown(self):
+        with self._lock:
+            running = len(self._running)
+        if running:
+            logger.info(f"Waiting for {running} running jobs")
+        self._executor.shutdown(wait=True)
+        super().teardown()
@@ -0,0 +1,418 @@
+"""
+Latency histograms and worker heartbeats behind /metrics.
+
+Queue wait, execution time and end-to-end latency of every job are kept
+in log-linear (HDR-style) histograms per function and worker_tag, and API
+request latency per endpoint. A histogram is a Redis hash of bucket
+counts per minute, so recording a job is a few HINCRBYs added to the
+pipeline that writes the rest of its bookkeeping, and percentiles over any window come from adding
+the buckets up. The API buffers its observations in memory and flushes
+them once a second.
+
+Workers publish a heartbeat with their state from a background thread,
+so a worker that dies without cleaning up drops out of the counts within
+HEARTBEAT_TIMEOUT seconds.
+"""
+import os
+import json
+import time
+import logging
+import threading
+from collections import Counter
+from datetime import timezone
+
+from redis import Redis
+
+from jobmeta import run_info
+
+logger = logging.getLogger(__name__)
+
+# Values are recorded in microseconds into buckets SUB_BITS bits wide: exact
+# below 2 * SUB, and within 1/SUB (about 3%) of the true value above
+SUB_BITS = 5
+SUB = 1 << SUB_BITS
+
+LATENCY_KEY = 'latency:{metric}:{bucket}'  # "<label>|<label>|<bucket index>" -> count
+TOTALS_KEY = 'latency:totals'               # "<metric>|<label>|<label>|count" or "...|sum", never reset
+JOB_METRICS = ('queue_wait', 'execution', 'end_to_end')
+API_METRIC = 'api_request'
+LABELS = {metric: ('function', 'worker_tag') for metric in JOB_METRICS}
+LABELS[API_METRIC] = ('endpoint', 'method')
+DESCRIPTIONS = {'queue_wait': 'Time jobs waited in their queue', 'execution': 'Time jobs ran',
+                'end_to_end': 'Time from enqueue to completion', API_METRIC: 'API request latency'}
+
+LATENCY_BUCKET_SECONDS = int(os.environ.get('LATENCY_BUCKET_SECONDS', 60))
+# Percentiles in /metrics cover this many most recent seconds
+LATENCY_WINDOW = int(os.environ.get('LATENCY_WINDOW', 300))
+LATENCY_FLUSH_INTERVAL = float(os.environ.get('LATENCY_FLUSH_INTERVAL', 1.0))
+PERCENTILES = (50, 90, 95, 99, 99.9)
+
+HEARTBEATS_KEY = 'workers:heartbeats'  # worker name -> JSON {time, state, worker_tag, queues, slots, busy_slots}
+HEARTBEAT_INTERVAL = float(os.environ.get('WORKER_HEARTBEAT_INTERVAL', 5))
+HEARTBEAT_TIMEOUT = 3 * HEARTBEAT_INTERVAL
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def bucket_index(value):
+    """Histogram bucket of a non-negative integer value"""
+    if value < 2 * SUB:
+        return max(0, value)
+    shift = value.bit_length() - SUB_BITS - 1
+    return (shift + 1) * SUB + (value >> shift) - SUB
+
+
+def bucket_bounds(index):
+    """Lowest and highest values that fall in bucket index"""
+    if index < 2 * SUB:
+        return index, index
+    shift = index // SUB - 1
+    low = (index % SUB + SUB) << shift
+    return low, low + (1 << shift) - 1
+
+
+class Histogram:
+    """Bucket counts of durations in microseconds; histograms merge by adding counts"""
+
+    def __init__(self, counts=None):
+        self.counts = Counter(counts or {})
+
+    def record(self, seconds, count=1):
+        self.counts[bucket_index(int(seconds * 1e6))] += count
+
+    def merge(self, other):
+        self.counts.update(other.counts)
+        return self
+
+    @property
+    def count(self):
+        return sum(self.counts.values())
+
+    def percentile(self, p):
+        """Seconds at or below which p percent of values fall, or None if empty"""
+        total = self.count
+        if not total:
+            return None
+        rank = max(1, total * p / 100)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                low, high = bucket_bounds(index)
+                return (low + high) / 2 / 1e6
+        return None
+
+    def summary(self):
+        """count, p50 ... p99.9 and max in seconds"""
+        summary = {'count': self.count}
+        for p in PERCENTILES:
+            value = self.percentile(p)
+            summary[f"p{p:g}".replace('.', '_')] = round(value, 6) if value is not None else None
+        summary['max'] = round(bucket_bounds(max(self.counts))[1] / 1e6, 6) if self.counts else None
+        return summary
+
+
+def window_bucket(now, bucket_seconds=LATENCY_BUCKET_SECONDS):
+    return int(now // bucket_seconds) * bucket_seconds
+
+
+def write_latencies(pipe, pending, now=None):
+    """Add {(metric, label, label): (Histogram, sum of seconds)} to the current bucket through pipe"""
+    bucket = window_bucket(now if now is not None else time.time())
+    keys = set()
+    for (metric, first, second), (histogram, total) in pending.items():
+        key = LATENCY_KEY.format(metric=metric, bucket=bucket)
+        keys.add(key)
+        for index, count in histogram.counts.items():
+            pipe.hincrby(key, f"{first}|{second}|{index}", count)
+        pipe.hincrby(TOTALS_KEY, f"{metric}|{first}|{second}|count", histogram.count)
+        pipe.hincrbyfloat(TOTALS_KEY, f"{metric}|{first}|{second}|sum", total)
+    for key in keys:
+        pipe.expire(key, LATENCY_WINDOW + LATENCY_BUCKET_SECONDS)
+
+
+class LatencyRecorder:
+    """
+    Aggregates observations in memory and writes them to Redis in one
+    pipeline per flush(). start() flushes every LATENCY_FLUSH_INTERVAL
+    seconds from a daemon thread.
+    """
+
+    def __init__(self, redis_conn):
+        self.redis = redis_conn
+        self._pending = {}  # (metric, label, label) -> [Histogram, sum of seconds]
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def observe(self, metric, labels, seconds):
+        with self._lock:
+            entry = self._pending.setdefault((metric, *labels), [Histogram(), 0.0])
+            entry[0].record(seconds)
+            entry[1] += seconds
+
+    def flush(self, pipeline=None, now=None):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        pipe = pipeline if pipeline is not None else self.redis.pipeline(transaction=False)
+        write_latencies(pipe, pending, now)
+        if pipeline is None:
+            pipe.execute()
+
+    def start(self, interval=LATENCY_FLUSH_INTERVAL):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, args=(interval,), daemon=True)
+            self._thread.start()
+
+    def _run(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing latency histograms: {str(e)}")
+
+
+def _timestamp(moment):
+    return moment.replace(tzinfo=timezone.utc).timestamp() if moment is not None else None
+
+
+def job_latencies(job, now=None):
+    """{metric: seconds} for a completed job; metrics whose timestamps are missing are left out"""
+    enqueued, started = _timestamp(job.enqueued_at), _timestamp(job.started_at)
+    ended = _timestamp(job.ended_at) or (now if now is not None else time.time())
+    run = run_info(job.meta)
+    latencies = {}
+    if run['queue_wait'] is not None:
+        latencies['queue_wait'] = run['queue_wait']
+    elif enqueued is not None and started is not None:
+        latencies['queue_wait'] = max(0.0, started - enqueued)
+    if run['execution_time'] is not None:
+        latencies['execution'] = run['execution_time']
+    if enqueued is not None:
+        latencies['end_to_end'] = max(0.0, ended - enqueued)
+    return latencies
+
+
+def record_job(redis_conn, job, pipeline=None, now=None):
+    """
+    Record a completed job's latencies under its function and worker_tag,
+    through pipeline if one is given. Jobs still running count as ending now.
+    """
+    now = now if now is not None else time.time()
+    labels = (job.args[0] if job.args else '', job.meta.get('worker_tag') or 'unknown-worker')
+    pending = {}
+    for metric, seconds in job_latencies(job, now).items():
+        histogram = Histogram()
+        histogram.record(seconds)
+        pending[(metric, *labels)] = (histogram, seconds)
+    pipe = pipeline if pipeline is not None else redis_conn.pipeline(transaction=False)
+    write_latencies(pipe, pending, now)
+    if pipeline is None:
+        pipe.execute()
+
+
+def read_latency(redis_conn, now=None, window=LATENCY_WINDOW, bucket_seconds=LATENCY_BUCKET_SECONDS):
+    """
+    ({metric: {(label, label): Histogram}} over the last window seconds,
+    {metric: {(label, label): (count, sum)}} since the start), in one round trip
+    """
+    now = now if now is not None else time.time()
+    buckets = range(window_bucket(now - window + bucket_seconds, bucket_seconds), int(now) + 1, bucket_seconds)
+    with redis_conn.pipeline() as pipe:
+        for metric in LABELS:
+            for bucket in buckets:
+                pipe.hgetall(LATENCY_KEY.format(metric=metric, bucket=bucket))
+        pipe.hgetall(TOTALS_KEY)
+        responses = pipe.execute()
+    histograms = {metric: {} for metric in LABELS}
+    responses = iter(responses)
+    for metric in LABELS:
+        for _ in buckets:
+            for field, count in next(responses).items():
+                labels, _, index = field.decode().rpartition('|')
+                series = tuple(labels.split('|', 1))
+                histograms[metric].setdefault(series, Histogram()).counts[int(index)] += int(count)
+    totals = {metric: {} for metric in LABELS}
+    for field, value in next(responses).items():
+        metric, _, rest = field.decode().partition('|')
+        rest, _, stat = rest.rpartition('|')
+        if metric not in totals:
+            continue
+        count, total = totals[metric].get(tuple(rest.split('|', 1)), (0, 0.0))
+        if stat == 'count':
+            count = int(value)
+        else:
+            total = float(value)
+        totals[metric][tuple(rest.split('|', 1))] = (count, total)
+    return histograms, totals
+
+
+def latency_summary(histograms, window=LATENCY_WINDOW):
+    """Percentiles of each metric per value of each of its labels, for /metrics"""
+    summary = {'window': window}
+    for metric, series in histograms.items():
+        views = {}
+        for position, label in enumerate(LABELS[metric]):
+            merged = {}
+            for labels, histogram in series.items():
+                merged.setdefault(labels[position], Histogram()).merge(histogram)
+            views[f"by_{label}"] = {value: histogram.summary() for value, histogram in merged.items()}
+        summary[metric] = views
+    return summary
+
+
+def publish_heartbeat(redis_conn, name, state, worker_tag, queues, slots=1, busy_slots=None, now=None):
+    state = getattr(state, 'value', state)
+    redis_conn.hset(HEARTBEATS_KEY, name, json.dumps({
+        'time': now if now is not None else time.time(),
+        'state': state,
+        'worker_tag': worker_tag,
+        'queues': queues,
+        'slots': slots,
+        'busy_slots': busy_slots if busy_slots is not None else int(state == 'busy'),
+    }))
+
+
+def live_heartbeats(redis_conn, now=None, timeout=HEARTBEAT_TIMEOUT):
+    """Heartbeats newer than timeout, by worker name; older ones are deleted"""
+    now = now if now is not None else time.time()
+    beats, stale = {}, []
+    for name, raw in redis_conn.hgetall(HEARTBEATS_KEY).items():
+        beat = json.loads(raw)
+        if beat['time'] < now - timeout:
+            stale.append(name)
+        else:
+            beats[name.decode()] = beat
+    if stale:
+        redis_conn.hdel(HEARTBEATS_KEY, *stale)
+    return beats
+
+
+def worker_counts(redis_conn, now=None, timeout=HEARTBEAT_TIMEOUT):
+    """Active, busy and idle workers and their busy and total slots, overall and per worker_tag"""
+    fields = ('active', 'busy', 'idle', 'slots', 'busy_slots')
+    counts = dict.fromkeys(fields, 0)
+    counts['by_worker_tag'] = {}
+    for beat in live_heartbeats(redis_conn, now, timeout).values():
+        state = 'busy' if beat['state'] == 'busy' else 'idle'
+        tag = counts['by_worker_tag'].setdefault(beat['worker_tag'], dict.fromkeys(fields, 0))
+        for entry in (counts, tag):
+            entry['active'] += 1
+            entry[state] += 1
+            entry['slots'] += beat.get('slots', 1)
+            entry['busy_slots'] += beat.get('busy_slots', int(state == 'busy'))
+    return counts
+
+
+def queue_capacity(redis_conn, queue_name, now=None, timeout=HEARTBEAT_TIMEOUT):
+    """(live workers, their total slots) among workers listening on queue_name"""
+    beats = [beat for beat in live_heartbeats(redis_conn, now, timeout).values() if queue_name in beat['queues']]
+    return len(beats), sum(beat.get('slots', 1) for beat in beats)
+
+
+class InstrumentedWorkerMixin:
+    """
+    Worker mixin that publishes a heartbeat every HEARTBEAT_INTERVAL
+    seconds. Heartbeats come from a thread with its own connection, so
+    they keep going while a job runs in the main thread and never share a
+    socket with a fork. Job latencies are recorded by the job functions
+    themselves (see executor._record_outcome), with the rest of a job's
+    bookkeeping.
+    """
+
+    def register_birth(self):
+        super().register_birth()
+        self._heartbeat_stop = threading.Event()
+        connection = Redis(**self.connection.connection_pool.connection_kwargs)
+        threading.Thread(target=self._beat, args=(connection,), daemon=True).start()
+
+    def register_death(self):
+        if hasattr(self, '_heartbeat_stop'):
+            self._heartbeat_stop.set()
+        self.connection.hdel(HEARTBEATS_KEY, self.name)
+        super().register_death()
+
+    def _beat(self, connection):
+        worker_tag = os.environ.get('WORKER_TAG', 'unknown-worker')
+        queues = self.queue_names()
+        while True:
+            try:
+                # Multi-slot workers (slots.ConcurrentWorker) report their slots
+                busy_slots, slots = self.slot_usage() if hasattr(self, 'slot_usage') else (None, 1)
+                publish_heartbeat(connection, self.name, self.get_state(), worker_tag, queues, slots, busy_slots)
+            except Exception as e:
+                logger.warning(f"Heartbeat of {self.name} failed: {str(e)}")
+            if self._heartbeat_stop.wait(HEARTBEAT_INTERVAL):
+                return
+
+
+def instrumented(worker_class):
+    """Return worker_class with heartbeats, subclassing it if needed"""
+    if issubclass(worker_class, InstrumentedWorkerMixin):
+        return worker_class
+    return type(f"Instrumented{worker_class.__name__}", (InstrumentedWorkerMixin, worker_class), {})
+
+
+def wants_prometheus(format_param, accept):
+    """Whether a /metrics request asks for the Prometheus text format"""
+    if format_param:
+        return format_param == 'prometheus'
+    return 'text/plain' in accept or 'openmetrics' in accept
+
+
+def _label_text(labels):
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+def render_prometheus(metrics, histograms, totals):
+    """The /metrics dict and latency histograms in the Prometheus text exposition format"""
+    lines = []
+
+    def family(name, kind, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for suffix, labels, value in samples:
+            if value is not None:
+                lines.append(f"{name}{suffix}{_label_text(labels) if labels else ''} {value}")
+
+    queues = metrics.get('queues', {})
+    family('faas_queue_depth', 'gauge', 'Jobs waiting in each queue.',
+           [('', {'queue': name}, stats['depth']) for name, stats in queues.items()])
+    family('faas_queue_oldest_wait_seconds', 'gauge', 'Age of the oldest job waiting in each queue.',
+           [('', {'queue': name}, stats['oldest_wait']) for name, stats in queues.items()])
+    workers = metrics.get('workers', {})
+    family('faas_workers', 'gauge', 'Workers with a recent heartbeat, by state.',
+           [('', {'worker_tag': tag, 'state': state}, entry[state])
+            for tag, entry in workers.get('by_worker_tag', {}).items() for state in ('busy', 'idle')])
+    family('faas_worker_slots', 'gauge', 'Job slots of workers with a recent heartbeat, busy or total.',
+           [('', {'worker_tag': tag, 'kind': kind}, entry[field])
+            for tag, entry in workers.get('by_worker_tag', {}).items()
+            for kind, field in (('busy', 'busy_slots'), ('total', 'slots'))])
+    family('faas_admission_rejected_total', 'counter', 'Submissions refused by admission control, by limit.',
+           [('', {'limit': limit}, count) for limit, count in metrics.get('admission', {}).get('rejected', {}).items()])
+    family('faas_cost_total', 'counter', 'Cost of all successful jobs.', [('', None, metrics.get('total_cost'))])
+    usage = metrics.get('usage', {})
+    for dimension in ('function', 'worker_tag'):
+        family(f'faas_window_cost_by_{dimension}', 'gauge',
+               f"Cost of jobs in the usage window by {dimension}.",
+               [('', {dimension: value}, entry['cost'])
+                for value, entry in usage.get(f'by_{dimension}', {}).items()])
+
+    for metric, series in totals.items():
+        name = f"faas_{metric}_seconds"
+        samples = []
+        for labels in sorted(set(series) | set(histograms.get(metric, {}))):
+            label_map = dict(zip(LABELS[metric], labels))
+            histogram = histograms.get(metric, {}).get(labels)
+            if histogram is not None:
+                for p in PERCENTILES:
+                    samples.append(('', {**label_map, 'quantile': f"{p / 100:g}"}, histogram.percentile(p)))
+            count, total = series.get(labels, (0, 0.0))
+            samples.append(('_sum', label_map, round(total, 6)))
+            samples.append(('_count', label_map, count))
+        family(name, 'summary', f"{DESCRIPTIONS[metric]}; quantiles over the last {LATENCY_WINDOW}s.", samples)
+    return '\n'.join(lines) + '\n'
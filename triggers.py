@@ -0,0 +1,230 @@
+import os
+import json
+import uuid
+from datetime import datetime
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from croniter import croniter
+
+DEFS_KEY = 'triggers:defs'              # trigger id -> JSON definition
+CRON_KEY = 'triggers:cron'              # scheduled trigger ids scored by next fire time
+EVENT_KEY = 'triggers:event:{event_type}'
+LEADER_KEY = 'triggers:leader'
+WAKEUP_KEY = 'triggers:wakeup'          # pushed on registration to wake the sleeping scheduler
+LATENESS_KEY = 'triggers:lateness'      # recent enqueue delays past the scheduled time
+FIRED_KEY = 'triggers:fired'
+
+LEADER_TTL = float(os.environ.get('TRIGGER_LEADER_TTL', 5))
+# 'skip' still fires a run that is at most this many seconds late
+MISFIRE_GRACE = float(os.environ.get('TRIGGER_MISFIRE_GRACE', 1))
+DUE_BATCH = 1000
+MAX_CATCH_UP = 1000
+ACCURACY_WINDOW = 1000
+
+CATCH_UP_POLICIES = ('skip', 'once', 'all')
+
+# ARGV holds (id, expected score, new score) triples. A trigger is rescheduled
+# only if its score is still the one we read, so overlapping schedulers
+# never fire the same run twice.
+CLAIM = """
+local claimed = {}
+for i = 1, #ARGV, 3 do
+    local score = redis.call('ZSCORE', KEYS[1], ARGV[i])
+    if score and tonumber(score) == tonumber(ARGV[i + 1]) then
+        redis.call('ZADD', KEYS[1], ARGV[i + 2], ARGV[i])
+        table.insert(claimed, ARGV[i])
+    end
+end
+return claimed
+"""
+
+# Extend the lease if we hold it, otherwise try to take it
+HOLD_LEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+    return 1
+end
+return 0
+"""
+
+
+def validate_schedule(trig):
+    """Check a cron trigger's cron/interval, timezone and catch_up; raises ValueError"""
+    if trig.get('catch_up', 'once') not in CATCH_UP_POLICIES:
+        raise ValueError(f"catch_up must be one of {', '.join(CATCH_UP_POLICIES)}")
+    try:
+        ZoneInfo(trig.get('timezone') or 'UTC')
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Unknown timezone {trig.get('timezone')}")
+    if trig.get('cron') is not None:
+        if not isinstance(trig['cron'], str) or not croniter.is_valid(trig['cron']):
+            raise ValueError(f"Invalid cron expression {trig['cron']}")
+    elif not isinstance(trig.get('interval'), (int, float)) or trig['interval'] <= 0:
+        raise ValueError('interval must be a positive number of seconds')
+
+
+def next_fire_after(trig, after):
+    """Next scheduled time strictly after the timestamp after"""
+    if trig.get('cron') is not None:
+        tz = ZoneInfo(trig.get('timezone') or 'UTC')
+        return croniter(trig['cron'], datetime.fromtimestamp(after, tz)).get_next(float)
+    return after + trig['interval']
+
+
+def first_fire(trig, now):
+    # Interval triggers run straight away, as they always have
+    return next_fire_after(trig, now) if trig.get('cron') is not None else now
+
+
+def due_fires(trig, scheduled, now):
+    """
+    Apply the trigger's catch_up policy to the runs due between scheduled
+    and now. Returns (scheduled times to fire, next fire time).
+      skip: fire only the latest run, and only if it is within MISFIRE_GRACE
+      once: fire the latest run, however late (the default)
+      all:  fire every missed run, up to MAX_CATCH_UP
+    """
+    fires, t = [], scheduled
+    while t <= now and len(fires) < MAX_CATCH_UP:
+        fires.append(t)
+        t = next_fire_after(trig, t)
+    if t <= now:
+        t = next_fire_after(trig, now)
+    policy = trig.get('catch_up', 'once')
+    if policy == 'skip':
+        fires = [fire for fire in fires[-1:] if now - fire <= MISFIRE_GRACE]
+    elif policy == 'once':
+        fires = fires[-1:]
+    return fires, t
+
+
+class TriggerStore:
+    """
+    Cron and webhook triggers persisted in Redis. Scheduled triggers sit in
+    a sorted set keyed by next fire time, which serves as the scheduler's
+    priority queue: due triggers cost O(log N + due) however many are
+    registered, and the head gives the exact time to sleep until. Webhook
+    triggers are indexed by event type.
+    """
+
+    def __init__(self, redis_conn):
+        self.redis = redis_conn
+        self._claim = redis_conn.register_script(CLAIM)
+
+    def add(self, trig, now, pipeline=None):
+        """Store a trigger dict with an 'id'; scheduled triggers are queued for their first run"""
+        conn = pipeline if pipeline is not None else self.redis.pipeline()
+        conn.hset(DEFS_KEY, trig['id'], json.dumps(trig))
+        if trig['type'] == 'cron':
+            conn.zadd(CRON_KEY, {trig['id']: first_fire(trig, now)})
+            conn.lpush(WAKEUP_KEY, trig['id'])
+            conn.ltrim(WAKEUP_KEY, 0, 0)
+        elif trig['type'] == 'webhook':
+            conn.sadd(EVENT_KEY.format(event_type=trig.get('event_type')), trig['id'])
+        if pipeline is None:
+            conn.execute()
+
+    def get(self, trigger_id):
+        raw = self.redis.hget(DEFS_KEY, trigger_id)
+        return json.loads(raw) if raw else None
+
+    def next_fire(self, trigger_id=None):
+        """Next fire time of a trigger, or of the earliest trigger; None if there is none"""
+        if trigger_id is not None:
+            return self.redis.zscore(CRON_KEY, trigger_id)
+        head = self.redis.zrange(CRON_KEY, 0, 0, withscores=True)
+        return head[0][1] if head else None
+
+    def remove(self, trigger_id):
+        """Delete a trigger; returns False if it did not exist"""
+        trig = self.get(trigger_id)
+        if trig is None:
+            return False
+        with self.redis.pipeline() as pipe:
+            pipe.hdel(DEFS_KEY, trigger_id)
+            pipe.zrem(CRON_KEY, trigger_id)
+            if trig['type'] == 'webhook':
+                pipe.srem(EVENT_KEY.format(event_type=trig.get('event_type')), trigger_id)
+            pipe.execute()
+        return True
+
+    def _load(self, trigger_ids):
+        if not trigger_ids:
+            return []
+        return [json.loads(raw) for raw in self.redis.hmget(DEFS_KEY, trigger_ids) if raw]
+
+    def take_due(self, now, limit=DUE_BATCH):
+        """
+        Claim up to limit triggers due at now and move each to its next fire
+        time. Returns [(trigger, [scheduled times to fire]), ...].
+        """
+        entries = self.redis.zrangebyscore(CRON_KEY, '-inf', now, start=0, num=limit, withscores=True)
+        if not entries:
+            return []
+        trigger_ids = [trigger_id.decode() for trigger_id, _ in entries]
+        plans, args = {}, []
+        for trigger_id, (_, scheduled), raw in zip(trigger_ids, entries, self.redis.hmget(DEFS_KEY, trigger_ids)):
+            if raw is None:
+                self.redis.zrem(CRON_KEY, trigger_id)
+                continue
+            trig = json.loads(raw)
+            fires, next_fire = due_fires(trig, scheduled, now)
+            plans[trigger_id] = (trig, fires)
+            args += [trigger_id, repr(scheduled), repr(next_fire)]
+        if not args:
+            return []
+        return [plans[trigger_id.decode()] for trigger_id in self._claim(keys=[CRON_KEY], args=args)]
+
+    def wait(self, timeout):
+        """Sleep up to timeout seconds, returning early when a scheduled trigger is added"""
+        # BLPOP rounds to milliseconds and treats 0 as 'block forever'
+        if timeout >= 0.001:
+            self.redis.blpop(WAKEUP_KEY, timeout=timeout)
+
+    def for_event(self, event_type):
+        return self._load([trigger_id.decode() for trigger_id in
+                           self.redis.smembers(EVENT_KEY.format(event_type=event_type))])
+
+    def record_lateness(self, lateness):
+        """Record how many seconds after their scheduled time runs were enqueued"""
+        if not lateness:
+            return
+        with self.redis.pipeline() as pipe:
+            pipe.lpush(LATENESS_KEY, *lateness)
+            pipe.ltrim(LATENESS_KEY, 0, ACCURACY_WINDOW - 1)
+            pipe.incrby(FIRED_KEY, len(lateness))
+            pipe.execute()
+
+    def firing_accuracy(self):
+        """Runs fired so far and lateness percentiles over the last ACCURACY_WINDOW runs"""
+        with self.redis.pipeline() as pipe:
+            pipe.get(FIRED_KEY)
+            pipe.lrange(LATENESS_KEY, 0, -1)
+            fired, recent = pipe.execute()
+        recent = sorted(float(value) for value in recent)
+        stats = {'fired': int(fired or 0)}
+        if recent:
+            stats.update({
+                'lateness_p50': round(recent[len(recent) // 2], 4),
+                'lateness_p99': round(recent[int(0.99 * (len(recent) - 1))], 4),
+                'lateness_max': round(recent[-1], 4),
+            })
+        return stats
+
+
+class LeaderLease:
+    """
+    A Redis lease that at most one process holds at a time. hold() takes or
+    renews it and must be called more often than every ttl seconds.
+    """
+
+    def __init__(self, redis_conn, key=LEADER_KEY, ttl=LEADER_TTL):
+        self.key = key
+        self.ttl = ttl
+        self.token = str(uuid.uuid4())
+        self._hold = redis_conn.register_script(HOLD_LEASE)
+
+    def hold(self):
+        return bool(self._hold(keys=[self.key], args=[self.token, int(self.ttl * 1000)]))
@@ -0,0 +1,287 @@
+import os
+import sys
+import json
+import queue
+import atexit
+import select
+import logging
+import threading
+import traceback
+import subprocess
+
+try:
+    import resource
+except ImportError:  # non-POSIX platforms
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+FUNCTIONS_DIR = os.path.abspath('functions')
+# Output a call returns with its response; the start of longer output is dropped
+MAX_CALL_OUTPUT = 64 * 1024
+
+
+def _sandbox_limits(memory_limit_mb):
+    """Return a preexec_fn applying resource limits to a pool process"""
+    def apply():
+        os.setsid()
+        if resource is None:
+            return
+        limit = memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+        resource.setrlimit(resource.RLIMIT_NOFILE, (64, 64))
+    return apply
+
+
+class PoolProcess:
+    """A pre-forked Python interpreter serving handler calls over pipes"""
+
+    def __init__(self, functions_dir, memory_limit_mb):
+        from blobs import BLOB_DIR
+        self.proc = subprocess.Popen(
+            [sys.executable, '-I', os.path.abspath(__file__), functions_dir],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            cwd=functions_dir,
+            env={'PATH': '/usr/bin:/bin', 'PYTHONDONTWRITEBYTECODE': '1', 'BLOB_DIR': BLOB_DIR},
+            preexec_fn=_sandbox_limits(memory_limit_mb) if os.name == 'posix' else None,
+        )
+        self.invocations = 0
+        self.baseline_rss = None
+        self.rss = 0
+
+    @property
+    def pid(self):
+        return self.proc.pid
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def request(self, message, frames, timeout):
+        """
+        Send one request and wait for its response. Messages are a JSON
+        header line followed by the codec-encoded values it lists the sizes
+        of. Returns (response header, response frames).
+        """
+        message['sizes'] = [len(frame) for frame in frames]
+        self.proc.stdin.write((json.dumps(message) + '\n').encode())
+        for frame in frames:
+            self.proc.stdin.write(frame)
+        self.proc.stdin.flush()
+
+        ready, _, _ = select.select([self.proc.stdout], [], [], timeout)
+        if not ready:
+            self.kill()
+            raise TimeoutError(f"Pool process {self.pid} timed out after {timeout}s")
+        line = self.proc.stdout.readline()
+        if not line:
+            raise RuntimeError(f"Pool process {self.pid} exited with code {self.proc.wait()}")
+
+        response = json.loads(line)
+        frames = [self.proc.stdout.read(size) for size in response.get('sizes', [])]
+        self.invocations += 1
+        self.rss = response.get('rss', 0)
+        if self.baseline_rss is None:
+            self.baseline_rss = self.rss
+        return response, frames
+
+    def rss_growth_mb(self):
+        if self.baseline_rss is None:
+            return 0
+        return (self.rss - self.baseline_rss) / 1024
+
+    def kill(self):
+        if self.alive():
+            self.proc.kill()
+        self.proc.wait()
+
+    def terminate(self):
+        if self.alive():
+            try:
+                self.proc.stdin.close()
+                self.proc.wait(timeout=5)
+            except (OSError, subprocess.TimeoutExpired):
+                self.kill()
+
+
+class WarmPool:
+    """
+    Pool of warm interpreter processes for the 'pool' runtime.
+    Processes are recycled after max_invocations calls or once their
+    peak RSS grows by more than max_rss_growth_mb since the first call.
+    """
+
+    def __init__(self, size=2, max_invocations=500, max_rss_growth_mb=64,
+                 memory_limit_mb=512, timeout=300, functions_dir=FUNCTIONS_DIR):
+        self.size = size
+        self.max_invocations = max_invocations
+        self.max_rss_growth_mb = max_rss_growth_mb
+        self.memory_limit_mb = memory_limit_mb
+        self.timeout = timeout
+        self.functions_dir = functions_dir
+        self.recycled = 0
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._started = False
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            for _ in range(self.size):
+                self._idle.put(self._spawn())
+            self._started = True
+            logger.info(f"Started warm pool with {self.size} processes")
+
+    def _spawn(self):
+        return PoolProcess(self.functions_dir, self.memory_limit_mb)
+
+    def _needs_recycle(self, proc):
+        return (
+            not proc.alive()
+            or proc.invocations >= self.max_invocations
+            or proc.rss_growth_mb() > self.max_rss_growth_mb
+        )
+
+    def _request(self, message, frames, usage=None, log=None):
+        """
+        One request on an idle process. The call's resource usage is added
+        to usage (an accounting.Usage) and its output written to log (a
+        joblogs.JobLog), if given, whether or not it succeeded.
+        """
+        if not self._started:
+            self.start()
+        proc = self._idle.get()
+        try:
+            response, frames = proc.request(message, frames, self.timeout)
+            if usage is not None:
+                usage.add(response.get('usage', {}))
+            if log is not None:
+                for stream, text in response.get('output', {}).items():
+                    log.write(stream, text)
+            if not response['ok']:
+                raise RuntimeError(f"Pool execution failed: {response['error']}")
+            return response, frames
+        finally:
+            if self._needs_recycle(proc):
+                logger.info(f"Recycling pool process {proc.pid} after {proc.invocations} invocations "
+                            f"(rss growth {proc.rss_growth_mb():.1f} MB)")
+                proc.terminate()
+                proc = self._spawn()
+                self.recycled += 1
+            self._idle.put(proc)
+
+    def call(self, module_name, payload, codec=None, usage=None, log=None):
+        """
+        Run handler(payload) from functions/<module_name>.py in a warm
+        process; payload and result cross the pipe encoded with the job's
+        codec. Usage and output are reported as in _request.
+        """
+        from serialization import get_codec
+        codec = get_codec(codec)
+        response, frames = self._request({'module': module_name, 'codec': codec.name}, [codec.encode(payload)],
+                                         usage, log)
+        return codec.decode(frames[0])
+
+    def call_batch(self, module_name, payloads, codec=None, usage=None, log=None):
+        """Run a batch of payloads in one round trip; returns [(ok, result_or_traceback), ...]"""
+        from serialization import get_codec
+        codec = get_codec(codec)
+        response, frames = self._request({'module': module_name, 'codec': codec.name, 'batch': True},
+                                         [codec.encode(payload) for payload in payloads], usage, log)
+        frames = iter(frames)
+        return [(True, codec.decode(next(frames))) if ok else (False, error)
+                for ok, error in response['results']]
+
+    def shutdown(self):
+        with self._lock:
+            while not self._idle.empty():
+                self._idle.get_nowait().terminate()
+            self._started = False
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return this worker's warm pool, configured from the environment"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = WarmPool(
+                size=int(os.environ.get('WARM_POOL_SIZE', 2)),
+                max_invocations=int(os.environ.get('WARM_POOL_MAX_INVOCATIONS', 500)),
+                max_rss_growth_mb=int(os.environ.get('WARM_POOL_MAX_RSS_GROWTH_MB', 64)),
+                memory_limit_mb=int(os.environ.get('WARM_POOL_MEMORY_LIMIT_MB', 512)),
+            )
+            atexit.register(_pool.shutdown)
+        return _pool
+
+
+def _serve(functions_dir):
+    """
+    Pool process main loop: one request header line on stdin followed by
+    its encoded payloads. Blob payloads are loaded here and large results
+    stored here, so neither crosses the pipe.
+    """
+    from module_cache import ModuleCache, call_batch, call_handler
+    from blobs import load, offload
+    from serialization import get_codec
+    from accounting import rusage_delta, rusage_snapshot
+    from contextlib import redirect_stderr, redirect_stdout
+    from io import StringIO
+    requests = sys.stdin.buffer
+    channel = os.fdopen(os.dup(1), 'wb')
+    # Anything the handler prints goes to stderr, not the protocol channel
+    os.dup2(2, 1)
+    cache = ModuleCache()
+    for line in requests:
+        request = json.loads(line)
+        frames = [requests.read(size) for size in request['sizes']]
+        frames_out = []
+        before = rusage_snapshot()
+        output = {'stdout': StringIO(), 'stderr': StringIO()}
+        try:
+            name = request['module']
+            codec = get_codec(request.get('codec'))
+            module, _ = cache.load(name, os.path.join(functions_dir, f"{name}.py"))
+            payloads = [load(codec.decode(frame)) for frame in frames]
+            if request.get('batch'):
+                results = []
+                with redirect_stdout(output['stdout']), redirect_stderr(output['stderr']):
+                    outcomes = call_batch(module, payloads)
+                for ok, result in outcomes:
+                    if ok:
+                        try:
+                            frames_out.append(codec.encode(offload(result, codec=codec)))
+                        except Exception:
+                            ok, result = False, traceback.format_exc()
+                    results.append((ok, None if ok else result))
+                response = {'ok': True, 'results': results}
+            elif not hasattr(module, 'handler'):
+                raise AttributeError(f"Function {name} missing handler function")
+            else:
+                with redirect_stdout(output['stdout']), redirect_stderr(output['stderr']):
+                    result = call_handler(module.handler, payloads[0])
+                frames_out = [codec.encode(offload(result, codec=codec))]
+                response = {'ok': True}
+        except Exception:
+            frames_out = []
+            response = {'ok': False, 'error': traceback.format_exc()}
+        response['sizes'] = [len(frame) for frame in frames_out]
+        response['rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else 0
+        response['usage'] = rusage_delta(before).as_dict()
+        response['output'] = {stream: buffer.getvalue()[-MAX_CALL_OUTPUT:] for stream, buffer in output.items()
+                              if buffer.tell()}
+        channel.write((json.dumps(response, default=str) + '\n').encode())
+        for frame in frames_out:
+            channel.write(frame)
+        channel.flush()
+
+
+if __name__ == '__main__':
+    # Isolated mode drops the script directory from sys.path
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    _serve(sys.argv[1])
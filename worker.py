@@ -1,21 +1,60 @@
 import os
 import logging
 from redis import Redis
-from rq import Worker
+from rq import Worker, SimpleWorker
+from batching import BatchingWorker
+from slots import ConcurrentWorker
+from queues import QUEUE_NAMES, parse_weights, weighted
+from events import notifying
+from telemetry import instrumented
+from history import retaining
+from job_index import IndexedJob
+from joblogs import file_handler
 
 os.makedirs('logs', exist_ok=True)
+# One file per worker: a rotating file must have a single writer
+log_name = f"worker-{os.environ.get('WORKER_TAG') or os.getpid()}"
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     handlers=[
-        logging.FileHandler('logs/worker.log'),
+        file_handler(f'logs/{log_name}.log'),
         logging.StreamHandler()
     ]
 )
 
 if __name__ == '__main__':
     redis_conn = Redis(host='localhost', port=6379)
-    worker = Worker(['default'], connection=redis_conn)
+    queue_names = os.environ.get('WORKER_QUEUES', ','.join(QUEUE_NAMES)).split(',')
+    batch_size = int(os.environ.get('BATCH_SIZE', 1))
+    slots = int(os.environ.get('WORKER_SLOTS', 1))
+    if slots > 1:
+        # Up to WORKER_SLOTS jobs at once in threads, for I/O-bound functions
+        worker_class = ConcurrentWorker
+        worker_kwargs = {'slots': slots}
+    elif batch_size > 1:
+        # Opt-in micro-batching of small legacy/pool jobs (always runs in-process)
+        worker_class = BatchingWorker
+        worker_kwargs = {'batch_size': batch_size,
+                         'linger': float(os.environ.get('BATCH_LINGER_MS', 5)) / 1000}
+    else:
+        # 'simple' (the default) runs jobs in this process, so the warm pool
+        # and module cache survive between jobs; 'fork' isolates every job in
+        # a child that starts both cold and exits without shutting the pool down.
+        worker_class = Worker if os.environ.get('WORKER_CLASS', 'simple') == 'fork' else SimpleWorker
+        worker_kwargs = {}
+    # Publish completion events for /wait and /events
+    worker_class = notifying(worker_class)
+    # Worker heartbeats for /metrics
+    worker_class = instrumented(worker_class)
+    # Finished and failed jobs expire from Redis after JOB_RESULT_TTL / JOB_FAILURE_TTL
+    worker_class = retaining(worker_class)
+    # 'strict' always drains higher-priority queues first; 'weighted' shares dequeues by weight
+    if os.environ.get('WORKER_QUEUE_MODE', 'strict') == 'weighted':
+        weights = parse_weights(os.environ.get('WORKER_QUEUE_WEIGHTS', 'high:6,default:3,low:1'))
+        worker_class = weighted(worker_class, weights)
+    # IndexedJob marks jobs started in /jobs as part of RQ's own prepare pipeline
+    worker = worker_class(queue_names, connection=redis_conn, job_class=IndexedJob, **worker_kwargs)
     
     logging.info(f"Starting worker {worker.name}")
     worker.work()
\ No newline at end of file